@@ -1,6 +1,7 @@
 #@juma_samwel 
 from django.contrib import admin
 from .models import Program, Client # Import your models
+from .search import search_clients
 
 # Register your models here.
 
@@ -21,3 +22,15 @@ class ClientAdmin(admin.ModelAdmin):
     search_fields = ('name', 'contact_info') # Enable searching
     list_filter = ('enrolled_programs',) # Allow filtering by enrolled programs
     filter_horizontal = ('enrolled_programs',) # Use a more user-friendly widget for ManyToMany
+    # A total ordering the (name, id) index serves; otherwise the changelist appends -pk
+    ordering = ('name', 'id')
+    # Skip the second, unfiltered COUNT(*) over every client when searching or filtering
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search through the trigram / FTS5 index (afiya/search.py) instead of icontains."""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        # Unranked: the changelist orders by name, and actions update or delete through it
+        return search_clients(queryset, search_term, ranked=False), False
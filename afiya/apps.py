@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AfiyaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'afiya'
+
+    def ready(self):
+        # Connect signal receivers (autocomplete index, etc.)
+        from . import signals  # noqa: F401
@@ -0,0 +1,260 @@
+#@juma_samwel
+"""
+Native async versions of the hot endpoints, for ASGI servers (uvicorn,
+daphne). These are plain Django async views: a request waiting on the
+database or on a slow client holds a coroutine instead of a worker thread,
+so one process can keep thousands of such connections open. (Django's async
+ORM still runs each query on a thread; the connection itself does not.)
+
+They return the same JSON as the DRF views they mirror, with the same
+authentication (afiya.authentication.aauthenticate: cached session, then
+cached token), the same ETag behaviour and the same ?fields= / ?expand=
+sparse fieldsets (afiya/fieldsets.py). Methods they do not implement
+(create, update, delete) are handed to the DRF view.
+
+Mounted under /afiya/async/, and in place of the DRF routes when
+AFIYA_ASYNC_VIEWS is True (see afiya/urls.py). Under WSGI they still work,
+but Django then runs each one in its own event loop, so keep the flag off there.
+"""
+import functools
+import time
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .authentication import aauthenticate
+from .events import broker as event_broker
+from .caching import (
+    aprogram_cache_version,
+    client_etag,
+    compute_etag,
+    etag_matches,
+    not_modified,
+    program_key,
+    set_validators,
+)
+from .fieldsets import parse_fieldset, trim_queryset
+from .models import Client, Program
+from .pagination import ClientCursorPagination
+from .renderers import FastJSONRenderer
+from .routers import primary_reads, use_replicas
+from .search import SEARCH_ORDERING, search_clients
+from .serializers import ClientEnrollmentSerializer, ClientSerializer
+from .views import ClientViewSet, ProgramViewSet, logger
+
+# Same queryset as ClientViewSet
+client_queryset = Client.objects.prefetch_related('enrolled_programs').order_by('name')
+
+
+json_renderer = FastJSONRenderer()
+
+
+def json_response(data, status=200):
+    """The bytes the DRF views' renderer would send."""
+    return HttpResponse(json_renderer.render(data), status=status, content_type='application/json')
+
+
+def error_response(exc):
+    """Render a DRF APIException the way the DRF views would."""
+    # SessionAuthentication comes first and sends no WWW-Authenticate header,
+    # so DRF answers authentication failures with 403; match that.
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        status = 403
+    else:
+        status = exc.status_code
+    data = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+    return json_response(data, status=status)
+
+
+def async_api_view(methods, fallback=None):
+    """
+    Serve `methods` with the wrapped async view, after authenticating the
+    request; send any other method to `fallback` (a DRF view), or 405.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                if fallback is None:
+                    return error_response(exceptions.MethodNotAllowed(request.method))
+                return await sync_to_async(fallback)(request, *args, **kwargs)
+            try:
+                user = await aauthenticate(request)
+                if user is None:
+                    raise exceptions.NotAuthenticated()
+                request.user = user
+                if request.method in SAFE_METHODS:
+                    use_replicas()
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return error_response(exc)
+        # CSRF is checked in aauthenticate, for session-authenticated requests only
+        return csrf_exempt(wrapper)
+    return decorator
+
+
+def client_fieldset(request):
+    """
+    The client queryset and ?fields= / ?expand= fieldset for `request`, as
+    ClientViewSet applies them; the fieldset is None without ?fields=.
+    """
+    fieldset = parse_fieldset(request.GET, ClientSerializer.Meta.fields)
+    queryset = client_queryset if fieldset is None else trim_queryset(client_queryset, fieldset)
+    return queryset, fieldset
+
+
+def client_data(instance, fieldset, many=False):
+    return ClientSerializer(instance, many=many, context={'fieldset': fieldset}).data
+
+
+async def paginate(queryset, request, keyset_ordering=None):
+    """Fetch one keyset page with the async ORM. Returns (paginator, rows)."""
+    paginator = ClientCursorPagination()
+    view = SimpleNamespace(keyset_ordering=keyset_ordering)
+    page_queryset = paginator.page_queryset(queryset, Request(request), view)
+    rows = [row async for row in page_queryset.aiterator(chunk_size=paginator.page_size + 1)]
+    return paginator, paginator.set_page(rows)
+
+
+@async_api_view({'GET'}, fallback=ClientViewSet.as_view({'get': 'list', 'post': 'create'}))
+async def client_list(request):
+    """Async GET /afiya/clients/: cursor-paginated on (name, id)."""
+    queryset, fieldset = client_fieldset(request)
+    paginator, page = await paginate(queryset, request)
+    return json_response(paginator.get_paginated_data(client_data(page, fieldset, many=True)))
+
+
+@async_api_view({'GET'})
+async def client_search(request):
+    """Async GET /afiya/clients/search/?q=: ranked matches, paginated like the list."""
+    query = request.GET.get('q')
+    if query is None:
+        return json_response({'detail': "Query parameter 'q' is required."}, status=400)
+
+    started = time.perf_counter()
+    queryset, fieldset = client_fieldset(request)
+    if query:
+        # search_clients may introspect the database once, so it runs on a thread
+        clients = await sync_to_async(search_clients)(queryset, query)
+        paginator, page = await paginate(clients, request, SEARCH_ORDERING)
+    else:
+        paginator, page = await paginate(queryset, request)
+    response = json_response(paginator.get_paginated_data(client_data(page, fieldset, many=True)))
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms > settings.AFIYA_SEARCH_LATENCY_BUDGET_MS:
+        logger.warning(
+            "Client search for %r took %.1f ms (budget %s ms)",
+            query, elapsed_ms, settings.AFIYA_SEARCH_LATENCY_BUDGET_MS
+        )
+    return response
+
+
+async def get_client(pk, queryset=client_queryset):
+    try:
+        return await queryset.aget(pk=pk)
+    except Client.DoesNotExist:
+        raise exceptions.NotFound('No Client matches the given query.')
+
+
+@async_api_view({'GET'}, fallback=ClientViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+}))
+async def client_detail(request, pk):
+    """Async GET /afiya/clients/{pk}/ with ETag / Last-Modified revalidation."""
+    if 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers:
+        updated_at = await Client.objects.filter(pk=pk).values_list('updated_at', flat=True).afirst()
+        if updated_at is not None:
+            etag = client_etag(pk, updated_at)
+            if not_modified(request, etag, updated_at):
+                return set_validators(HttpResponse(status=304), etag, updated_at)
+
+    queryset, fieldset = client_fieldset(request)
+    client = await get_client(pk, queryset)
+    response = json_response(client_data(client, fieldset))
+    return set_validators(response, client_etag(client.pk, client.updated_at), client.updated_at)
+
+
+@async_api_view({'POST'})
+async def client_enroll(request, pk):
+    """Async POST /afiya/clients/{pk}/enroll/ with {"program_id": ...}."""
+    client = await get_client(pk)
+    data = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES]).data
+    serializer = ClientEnrollmentSerializer(data=data)
+    # Validation looks the program up, so it runs on a thread
+    if not await sync_to_async(serializer.is_valid)():
+        return json_response(serializer.errors, status=400)
+
+    await client.enrolled_programs.aadd(serializer.validated_data['program'])
+    client = await get_client(pk) # add() drops the prefetched programs; reload them
+    return json_response(ClientSerializer(client).data)
+
+
+@async_api_view({'GET'}, fallback=ProgramViewSet.as_view({'get': 'list', 'post': 'create'}))
+async def program_list(request):
+    """Async GET /afiya/programs/, sharing the DRF view's versioned cache entries."""
+    key = program_key(await aprogram_cache_version(), 'list', '', 'json')
+    entry = await cache.aget(key)
+    if entry is None:
+        with primary_reads(): # Shared with every worker: never fill it from a lagging replica
+            data = [program async for program in Program.objects.order_by('name').values('id', 'name')]
+        entry = {'etag': compute_etag(data), 'data': data}
+        await cache.aset(key, entry, timeout=settings.AFIYA_PROGRAM_CACHE_TIMEOUT)
+
+    if etag_matches(request, entry['etag']):
+        return set_validators(HttpResponse(status=304), entry['etag'])
+    return set_validators(json_response(entry['data']), entry['etag'])
+
+
+# How long a disconnected EventSource waits before reconnecting
+EVENTS_RETRY_MS = 3000
+
+
+def format_event(event):
+    data = json_renderer.render(event.data).decode('utf-8')
+    return f'id: {event.id}\nevent: {event.kind}\ndata: {data}\n\n'
+
+
+async def event_lines(subscription):
+    try:
+        yield f'retry: {EVENTS_RETRY_MS}\n\n'
+        while True:
+            events = await subscription.next_events(settings.AFIYA_EVENTS_HEARTBEAT)
+            # A comment line on idle connections keeps proxies from closing them
+            yield ''.join(map(format_event, events)) if events else ': keep-alive\n\n'
+    finally:
+        # Runs when the client disconnects and the server closes the generator
+        subscription.close()
+
+
+@async_api_view({'GET'})
+async def event_stream(request):
+    """
+    GET /afiya/events/: client and enrollment changes as server-sent events
+    (see afiya/events.py). Resumes after Last-Event-ID (or ?last_event_id=).
+    Needs an ASGI server: under WSGI the endless response would hold a worker
+    thread, so unless AFIYA_SSE_ENABLED and served through ASGI it answers 204,
+    which makes EventSource stop reconnecting.
+    """
+    if not settings.AFIYA_SSE_ENABLED or not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    # Subscribe before returning, so nothing published from here on is missed
+    subscription = event_broker.subscribe(last_event_id)
+    response = StreamingHttpResponse(event_lines(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # nginx: do not buffer the stream
+    return response
@@ -0,0 +1,183 @@
+#@juma_samwel
+"""
+Drop-in replacements for DRF's SessionAuthentication and TokenAuthentication
+that remember which user a session key or token resolved to.
+
+Resolved users live in a bounded per-process LRU with a TTL
+(AFIYA_AUTH_CACHE_MAX_ENTRIES / AFIYA_AUTH_CACHE_TTL), so a warm request
+authenticates without the session read or the Token->User join. With
+AFIYA_AUTH_CACHE_SHARED the entries are also kept in Django's cache, so
+other worker processes start warm.
+
+Each user has a generation number, bumped when their token is deleted,
+their account is saved (password change, is_active flip, ...) or they log
+out (see afiya/signals.py). Entries remember the generation they were
+stored under and are ignored once it moves. In shared mode the generation
+is read from Django's cache on every hit, so invalidation reaches all
+processes; per-process mode relies on the TTL for other processes.
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+
+
+def _digest(credential):
+    # Never keep raw tokens / session keys as cache keys
+    return hashlib.sha256(credential.encode('utf-8')).hexdigest()
+
+
+class AuthCache:
+    """Bounded, TTL-limited map of credential -> user with per-user invalidation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (user, generation, expires_at)
+        self._generations = {}
+
+    @property
+    def shared(self):
+        return getattr(settings, 'AFIYA_AUTH_CACHE_SHARED', False)
+
+    def _generation(self, user_id):
+        if self.shared:
+            return cache.get(f'afiya:auth:gen:{user_id}', 0)
+        return self._generations.get(user_id, 0)
+
+    def get(self, kind, credential):
+        """The cached user for this credential, or None on a miss."""
+        key = f'{kind}:{_digest(credential)}'
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.shared:
+            stored = cache.get(f'afiya:auth:{key}')
+            if stored is not None:
+                user, generation = stored
+                entry = (user, generation, now + settings.AFIYA_AUTH_CACHE_TTL)
+                self._store(key, entry)
+        if entry is None:
+            return None
+        user, generation, expires_at = entry
+        if expires_at < now or generation != self._generation(user.pk):
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        # Views may set attributes on request.user; keep the cached copy clean
+        return copy.copy(user)
+
+    def set(self, kind, credential, user):
+        key = f'{kind}:{_digest(credential)}'
+        generation = self._generation(user.pk)
+        self._store(key, (user, generation, time.monotonic() + settings.AFIYA_AUTH_CACHE_TTL))
+        if self.shared:
+            cache.set(f'afiya:auth:{key}', (user, generation), timeout=settings.AFIYA_AUTH_CACHE_TTL)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.AFIYA_AUTH_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """Forget every cached credential of this user, in all processes when shared."""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        if self.shared:
+            key = f'afiya:auth:gen:{user_id}'
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+auth_cache = AuthCache()
+
+
+class CachedSessionAuthentication(SessionAuthentication):
+    """SessionAuthentication that skips the session and user reads on a cache hit."""
+
+    def authenticate(self, request):
+        session_key = request._request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if session_key:
+            user = auth_cache.get('session', session_key)
+            if user is not None:
+                self.enforce_csrf(request)
+                request._request.user = user
+                return (user, None)
+
+        result = super().authenticate(request)
+        if result is not None and session_key:
+            # request.user is a SimpleLazyObject; cache the evaluated User
+            auth_cache.set('session', session_key, getattr(result[0], '_wrapped', result[0]))
+        return result
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that skips the Token->User lookup on a cache hit."""
+
+    def authenticate_credentials(self, key):
+        user = auth_cache.get('token', key)
+        if user is not None:
+            return (user, self.get_model()(key=key, user=user))
+
+        user, token = super().authenticate_credentials(key)
+        auth_cache.set('token', key, user)
+        return (user, token)
+
+
+async def aauthenticate(request):
+    """
+    Async counterpart of the configured DRF authentication, for plain Django
+    async views: session first, then token, both through auth_cache.
+    Returns the user or None; raises AuthenticationFailed / PermissionDenied
+    like the DRF classes do (bad token, inactive user, missing CSRF token).
+    """
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if session_key:
+        user = auth_cache.get('session', session_key)
+        if user is None:
+            user = await request.auser()
+            if user.is_authenticated and user.is_active:
+                auth_cache.set('session', session_key, user)
+            else:
+                user = None
+        if user is not None:
+            # Same CSRF rule as SessionAuthentication: unsafe methods need the token
+            CachedSessionAuthentication().enforce_csrf(Request(request))
+            return user
+
+    auth = get_authorization_header(request).split()
+    if not auth or auth[0].lower() != b'token':
+        return None
+    if len(auth) != 2:
+        raise exceptions.AuthenticationFailed('Invalid token header.')
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+
+    user = auth_cache.get('token', key)
+    if user is not None:
+        return user
+    try:
+        token = await Token.objects.select_related('user').aget(key=key)
+    except Token.DoesNotExist:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    auth_cache.set('token', key, token.user)
+    return token.user
@@ -0,0 +1,177 @@
+#@juma_samwel
+"""
+Per-process prefix index over Client.name for the autocomplete endpoint.
+
+Names are kept in one list sorted case-insensitively, with a parallel
+array of client ids, so a lookup is a bisect plus a short forward scan and
+never touches the database. The index is built lazily on first use,
+patched on post_save/post_delete (see afiya/signals.py), and rebuilt after
+AFIYA_AUTOCOMPLETE_MAX_AGE seconds so writes made by other worker
+processes eventually show up too. One thread builds at a time: the first
+build makes concurrent lookups wait for it, while a stale index keeps
+answering from the old arrays until its replacement is swapped in. Patches
+that arrive while a build runs are also replayed onto the new arrays, since
+the rows it read may predate them.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+
+from .routers import primary_reads
+
+
+def _fold(name):
+    return name.casefold()
+
+
+class ClientNameIndex:
+    """Sorted-array prefix index mapping client names to ids."""
+    bulk_rebuild_threshold = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock() # Held for a whole build, so one runs at a time
+        self._names = None # Sorted by casefolded name, then id
+        self._ids = None
+        self._folded = {} # id -> folded name, to find an entry by bisecting
+        self._built_at = 0.0
+        self._expired = False # Set by invalidate(): rebuild on the next lookup
+        self._pending = None # (id, name or None) patches made while a build runs
+
+    @property
+    def is_built(self):
+        return self._names is not None
+
+    def _is_stale(self):
+        max_age = getattr(settings, 'AFIYA_AUTOCOMPLETE_MAX_AGE', 0)
+        return self._expired or (bool(max_age) and time.monotonic() - self._built_at > max_age)
+
+    def build(self):
+        """Load every client name from the database and replace the index."""
+        with self._build_lock:
+            self._build_locked()
+
+    def _build_if_needed(self, wait):
+        """
+        Build unless another thread already is (`wait` False) or has just
+        finished one while we waited for the build lock.
+        """
+        if not self._build_lock.acquire(blocking=wait):
+            return
+        try:
+            if not self.is_built or self._is_stale():
+                self._build_locked()
+        finally:
+            self._build_lock.release()
+
+    def _load(self):
+        """Every (name, id) pair, sorted the way the index keeps them."""
+        from .models import Client
+
+        with primary_reads(): # Upserts only patch what the build saw
+            rows = Client.objects.order_by().values_list('name', 'id').iterator(chunk_size=10000)
+            return sorted(rows, key=lambda row: (_fold(row[0]), row[1]))
+
+    def _build_locked(self):
+        with self._lock:
+            # Writes committed from here on may be missing from what _load()
+            # reads: record their patches and replay them on the new arrays
+            self._pending = []
+            self._expired = False # An invalidate() during the build sets it again
+        try:
+            entries = self._load()
+        except BaseException:
+            with self._lock:
+                self._pending = None
+                self._expired = True
+            raise
+        names = [name for name, _ in entries]
+        ids = array('q', (client_id for _, client_id in entries))
+        folded = {client_id: _fold(name) for name, client_id in entries}
+        with self._lock:
+            self._names, self._ids, self._folded = names, ids, folded
+            for client_id, name in self._pending:
+                self._remove_locked(client_id)
+                if name is not None:
+                    self._insert_locked(client_id, name)
+            self._pending = None
+            self._built_at = time.monotonic()
+
+    def invalidate(self):
+        """Mark the index stale; the next lookup rebuilds it, others answer from it meanwhile."""
+        with self._lock:
+            self._expired = True
+
+    def lookup(self, prefix, limit=10):
+        """Return up to `limit` (id, name) pairs whose name starts with `prefix`."""
+        if not self.is_built:
+            self._build_if_needed(wait=True)
+        elif self._is_stale():
+            self._build_if_needed(wait=False) # Meanwhile other threads serve the old arrays
+        folded = _fold(prefix)
+        results = []
+        with self._lock:
+            names, ids = self._names, self._ids
+            index = bisect_left(names, folded, key=_fold)
+            while index < len(names) and len(results) < limit:
+                if not _fold(names[index]).startswith(folded):
+                    break
+                results.append((ids[index], names[index]))
+                index += 1
+        return results
+
+    def _position_locked(self, folded, client_id):
+        """Where (folded, client_id) is or would go: entries sort by folded name, then id."""
+        low = bisect_left(self._names, folded, key=_fold)
+        high = bisect_right(self._names, folded, low, key=_fold)
+        return bisect_left(self._ids, client_id, low, high)
+
+    def _remove_locked(self, client_id):
+        folded = self._folded.pop(client_id, None)
+        if folded is None:
+            return
+        index = self._position_locked(folded, client_id)
+        del self._names[index]
+        del self._ids[index]
+
+    def _insert_locked(self, client_id, name):
+        folded = _fold(name)
+        index = self._position_locked(folded, client_id)
+        self._names.insert(index, name)
+        self._ids.insert(index, client_id)
+        self._folded[client_id] = folded
+
+    def upsert(self, client_id, name):
+        """Insert or rename one client. No-op until the index has been built."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((client_id, name))
+            if self._names is None:
+                return
+            self._remove_locked(client_id)
+            self._insert_locked(client_id, name)
+
+    def upsert_many(self, entries):
+        """
+        Insert or rename many (id, name) pairs. Large batches just drop the
+        index instead, since one rebuild beats thousands of list inserts.
+        """
+        if len(entries) > self.bulk_rebuild_threshold:
+            self.invalidate()
+            return
+        for client_id, name in entries:
+            self.upsert(client_id, name)
+
+    def remove(self, client_id):
+        """Remove one client. No-op until the index has been built."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((client_id, None))
+            if self._names is not None:
+                self._remove_locked(client_id)
+
+
+client_name_index = ClientNameIndex()
@@ -0,0 +1,35 @@
+#@juma_samwel
+"""
+Timing helpers shared by the bench_* and loadtest management commands.
+
+latency_ms() summarises per-request latencies (mean, nearest-rank
+percentiles, max) so every command reports them the same way. best_of()
+times a callable several times and keeps the fastest run, which is the
+figure the micro-benchmarks report: it is the one least disturbed by
+whatever else the machine is doing.
+"""
+import statistics
+import time
+
+from .metrics import quantile
+
+
+def latency_ms(latencies, percentiles=(50, 99)):
+    """Mean, the given percentiles and max of `latencies` (seconds, non-empty), in milliseconds."""
+    latencies = sorted(latencies)
+    return {
+        'mean': statistics.fmean(latencies) * 1000,
+        **{f'p{p}': quantile(latencies, p / 100) * 1000 for p in percentiles},
+        'max': latencies[-1] * 1000,
+    }
+
+
+def best_of(run, repeat):
+    """Call `run` `repeat` times; return its last result and the fastest call in seconds."""
+    best = result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
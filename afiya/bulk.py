@@ -0,0 +1,292 @@
+#@juma_samwel
+"""
+Batched client registration, program enrollment and lookup, shared by the
+bulk API endpoints and the offline import tooling.
+
+Rows are validated with one reused ClientSerializer (no per-row field
+construction), inserted with bulk_create, and linked to programs through
+a single bulk insert into the enrolled_programs through-table. Invalid rows
+are collected as per-row errors instead of aborting the batch.
+
+bulk_create skips the model signals, so the signals our receivers rely on
+are sent by hand: clients_bulk_created for the new clients, and
+pre_add/post_add m2m_changed (reverse, one per program) for enrollments.
+"""
+from collections import defaultdict, deque
+from itertools import islice
+
+from django.db import connections, router, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.db.models.signals import m2m_changed
+from rest_framework import serializers
+
+from . import changelog
+from .models import Client, Program
+from .parsers import NDJSONLineError
+from .serializers import ClientSerializer
+from .signals import clients_bulk_created
+
+Enrollment = Client.enrolled_programs.through
+
+# Keep IN (...) lists under every backend's bound-parameter limit.
+LOOKUP_CHUNK_SIZE = 900
+
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` items from any iterable."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def validate_client_row(serializer, row, known_program_ids):
+    """
+    Validate one incoming row with a reusable ClientSerializer instance.
+    Returns (validated_data, program_ids) or raises ValidationError.
+    """
+    if isinstance(row, NDJSONLineError):
+        raise serializers.ValidationError(
+            {'non_field_errors': [f'Invalid JSON on line {row.line_number}: {row.message}']}
+        )
+    validated_data = serializer.run_validation(row)
+
+    program_ids = row.get('enrolled_program_ids') or []
+    if not isinstance(program_ids, list) or not all(
+            isinstance(value, int) and not isinstance(value, bool) for value in program_ids):
+        raise serializers.ValidationError(
+            {'enrolled_program_ids': ['Expected a list of program IDs.']}
+        )
+    missing = [value for value in program_ids if value not in known_program_ids]
+    if missing:
+        raise serializers.ValidationError(
+            {'enrolled_program_ids': [f"Program with ID {value} not found." for value in missing]}
+        )
+    return validated_data, list(dict.fromkeys(program_ids))
+
+
+def send_enrollment_signals(links, using):
+    """
+    Send m2m_changed for enrollments inserted behind the ORM's back,
+    grouped per program (reverse side), the same way program.clients.add() would.
+    `links` is an iterable of (client_id, program_id) pairs.
+    """
+    by_program = defaultdict(set)
+    for client_id, program_id in links:
+        by_program[program_id].add(client_id)
+    if not by_program:
+        return
+    programs = Program.objects.using(using).in_bulk(list(by_program))
+    with changelog.batched(using): # One change log insert, not one per program
+        for program_id, client_ids in by_program.items():
+            for action in ('pre_add', 'post_add'):
+                m2m_changed.send(
+                    sender=Enrollment, instance=programs[program_id], action=action,
+                    reverse=True, model=Client, pk_set=client_ids, using=using,
+                )
+
+
+def refetch_client_ids(clients, last_id, using):
+    """
+    Set the ids of clients bulk-inserted without RETURNING. Rows after
+    `last_id` are matched to them on (name, date_of_birth, contact_info) in
+    insert order; rows another transaction inserted meanwhile match nothing.
+    """
+    waiting = defaultdict(deque)
+    for client in clients:
+        waiting[client.name, client.date_of_birth, client.contact_info].append(client)
+    rows = Client.objects.using(using).filter(pk__gt=last_id).order_by('pk').values_list(
+        'pk', 'name', 'date_of_birth', 'contact_info',
+    )
+    for pk, *key in rows.iterator():
+        if waiting.get(tuple(key)):
+            waiting[tuple(key)].popleft().pk = pk
+
+
+def insert_clients(pending, batch_size):
+    """
+    Insert validated clients and their enrollments.
+    `pending` is a list of (Client, program_ids) pairs; returns the saved clients.
+    """
+    using = router.db_for_write(Client)
+    with changelog.batched(using): # The batch's clients and enrollments in one change log insert
+        clients = [client for client, _ in pending]
+        if connections[using].features.can_return_rows_from_bulk_insert:
+            clients = Client.objects.using(using).bulk_create(clients, batch_size=batch_size)
+            clients_bulk_created.send(sender=Client, instances=clients, using=using)
+        else:
+            # Without RETURNING the new ids are not known, so rows that carry
+            # enrollments fall back to one INSERT each (post_save covers them),
+            # and the ids of the rest are read back for clients_bulk_created.
+            for client, program_ids in pending:
+                if program_ids:
+                    client.save(using=using)
+            bulk = [client for client, program_ids in pending if not program_ids]
+            if bulk:
+                last_id = Client.objects.using(using).aggregate(last=Max('pk'))['last'] or 0
+                Client.objects.using(using).bulk_create(bulk, batch_size=batch_size)
+                refetch_client_ids(bulk, last_id, using)
+                clients_bulk_created.send(sender=Client, instances=bulk, using=using)
+
+        links = [
+            (client.pk, program_id)
+            for client, program_ids in pending
+            for program_id in program_ids
+        ]
+        Enrollment.objects.using(using).bulk_create(
+            [Enrollment(client_id=client_id, program_id=program_id) for client_id, program_id in links],
+            batch_size=batch_size,
+        )
+        send_enrollment_signals(links, using)
+    return clients
+
+
+class BulkRegistrationResult:
+    """Accumulates created ids and per-row errors for a bulk registration."""
+
+    def __init__(self):
+        self.created = []
+        self.errors = []
+
+    def as_dict(self):
+        return {
+            'created_count': len(self.created),
+            'error_count': len(self.errors),
+            'created': [{'index': index, 'id': client_id} for index, client_id in self.created],
+            'errors': [{'index': index, 'errors': errors} for index, errors in self.errors],
+        }
+
+
+def bulk_register_clients(rows, batch_size):
+    """
+    Validate and insert an iterable of client rows in chunks of `batch_size`,
+    all inside one transaction. Row indexes in the result are 0-based
+    positions in the input.
+    """
+    result = BulkRegistrationResult()
+    known_program_ids = set(Program.objects.values_list('id', flat=True))
+    serializer = ClientSerializer()
+
+    with transaction.atomic(using=router.db_for_write(Client)):
+        for chunk in chunked(enumerate(rows), batch_size):
+            pending, indexes = [], []
+            for index, row in chunk:
+                try:
+                    validated_data, program_ids = validate_client_row(serializer, row, known_program_ids)
+                except serializers.ValidationError as exc:
+                    result.errors.append((index, exc.detail))
+                    continue
+                pending.append((Client(**validated_data), program_ids))
+                indexes.append(index)
+            if pending:
+                clients = insert_clients(pending, batch_size)
+                result.created.extend(zip(indexes, (client.pk for client in clients)))
+    return result
+
+
+class BulkEnrollmentResult:
+    """Counts for a bulk enrollment of clients into one program."""
+
+    def __init__(self, program):
+        self.program = program
+        self.requested = 0
+        self.enrolled = 0
+        self.already_enrolled = 0
+        self.not_found = []
+
+    def as_dict(self):
+        return {
+            'program_id': self.program.pk,
+            'requested': self.requested,
+            'enrolled': self.enrolled,
+            'already_enrolled': self.already_enrolled,
+            'not_found': self.not_found,
+        }
+
+
+def insert_enrollments(program, client_ids, batch_size, using):
+    """
+    Insert (client, program) through-table rows and return the ids of the
+    clients actually enrolled. Backends with INSERT ... ON CONFLICT DO
+    NOTHING RETURNING (PostgreSQL, SQLite) skip pairs a concurrent request
+    enrolled first and leave them out of the result, so signals go out once
+    per enrollment. Others use a plain bulk_create, where such a race
+    raises IntegrityError instead.
+    """
+    connection = connections[using]
+    features = connection.features
+    if not (features.supports_update_conflicts_with_target and features.can_return_rows_from_bulk_insert):
+        Enrollment.objects.using(using).bulk_create(
+            [Enrollment(client_id=client_id, program_id=program.pk) for client_id in client_ids],
+            batch_size=batch_size,
+        )
+        return list(client_ids)
+
+    quote = connection.ops.quote_name
+    table = quote(Enrollment._meta.db_table)
+    client_column = quote(Enrollment._meta.get_field('client').column)
+    program_column = quote(Enrollment._meta.get_field('program').column)
+    inserted = []
+    with connection.cursor() as cursor:
+        for chunk in chunked(client_ids, min(batch_size, LOOKUP_CHUNK_SIZE // 2)):
+            cursor.execute(
+                f'INSERT INTO {table} ({client_column}, {program_column}) '
+                f'VALUES {", ".join(["(%s, %s)"] * len(chunk))} '
+                f'ON CONFLICT DO NOTHING RETURNING {client_column}',
+                [value for client_id in chunk for value in (client_id, program.pk)],
+            )
+            inserted += [row[0] for row in cursor.fetchall()]
+    return inserted
+
+
+def bulk_enroll_clients(program, client_ids, batch_size):
+    """
+    Enroll many clients into `program`.
+
+    Each chunk of ids costs one lookup that reports which clients exist and
+    which are already enrolled; all new through-table rows then go in with
+    one insert per batch (insert_enrollments). Pairs a concurrent request
+    enrolled in between count as already enrolled and send no signals.
+    """
+    result = BulkEnrollmentResult(program)
+    using = router.db_for_write(Enrollment)
+    client_ids = list(dict.fromkeys(client_ids))
+    result.requested = len(client_ids)
+
+    new_ids = []
+    with transaction.atomic(using=using):
+        for chunk in chunked(client_ids, LOOKUP_CHUNK_SIZE):
+            found = dict(
+                Client.objects.using(using).filter(pk__in=chunk).annotate(
+                    is_enrolled=Exists(Enrollment.objects.filter(client_id=OuterRef('pk'), program_id=program.pk))
+                ).order_by().values_list('pk', 'is_enrolled')
+            )
+            for client_id in chunk:
+                if client_id not in found:
+                    result.not_found.append(client_id)
+                elif found[client_id]:
+                    result.already_enrolled += 1
+                else:
+                    new_ids.append(client_id)
+
+        enrolled = insert_enrollments(program, new_ids, batch_size, using) if new_ids else []
+        send_enrollment_signals(((client_id, program.pk) for client_id in enrolled), using)
+
+    result.enrolled = len(enrolled)
+    result.already_enrolled += len(new_ids) - len(enrolled)
+    return result
+
+
+def clients_by_id(queryset, client_ids):
+    """
+    Fetch the clients with the given ids from `queryset`, in the order the
+    ids were given (repeated ids are returned once).
+
+    Unlike the chunked lookups above this is a single IN (...) query, plus
+    one per prefetch on the queryset, so callers must bound the number of
+    ids (AFIYA_CLIENT_BATCH_MAX_IDS). Returns (clients, ids not found).
+    """
+    client_ids = list(dict.fromkeys(client_ids))
+    found = {client.pk: client for client in queryset.order_by().filter(pk__in=client_ids)}
+    clients = [found[client_id] for client_id in client_ids if client_id in found]
+    not_found = [client_id for client_id in client_ids if client_id not in found]
+    return clients, not_found
@@ -0,0 +1,162 @@
+#@juma_samwel
+"""
+Response caching and conditional GET helpers.
+
+Programs: list/retrieve payloads are stored in Django's cache framework
+under keys that embed a version number. Any Program save or delete bumps the
+version (see afiya/signals.py), which orphans every cached payload at once
+instead of having to find and delete individual keys. Each entry stores its
+ETag, so a matching If-None-Match is answered with an empty 304.
+
+With the default local-memory backend each worker process has its own cache
+and version, so a write made in one process reaches the others only when
+their entries expire (AFIYA_PROGRAM_CACHE_TIMEOUT). Configure a shared
+backend (CACHE_BACKEND / CACHE_LOCATION) to invalidate everywhere at once.
+
+Clients: nothing is cached server-side. Client.updated_at moves on every
+edit and enrollment change, so a client's ETag/Last-Modified can be checked
+with one primary-key lookup and a 304 sent before any prefetch or
+serialization happens.
+"""
+import hashlib
+import json
+from calendar import timegm
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from .routers import primary_reads
+
+PROGRAM_VERSION_KEY = 'afiya:programs:version'
+
+
+def program_cache_version():
+    """The current program cache version, initialising it on first use."""
+    version = cache.get(PROGRAM_VERSION_KEY)
+    if version is None:
+        cache.add(PROGRAM_VERSION_KEY, 1, timeout=None)
+        version = cache.get(PROGRAM_VERSION_KEY, 1)
+    return version
+
+
+def bump_program_cache_version():
+    """Invalidate every cached program response."""
+    try:
+        cache.incr(PROGRAM_VERSION_KEY)
+    except ValueError:
+        # Key missing (evicted or never set): any fresh value orphans old entries
+        cache.set(PROGRAM_VERSION_KEY, 2, timeout=None)
+
+
+def program_key(version, action, lookup, response_format):
+    return ':'.join(['afiya:programs', f'v{version}', action, str(lookup), response_format])
+
+
+def program_cache_key(view, request):
+    """Key for one program response: version, action, object and response format."""
+    lookup = view.kwargs.get(view.lookup_url_kwarg or view.lookup_field, '')
+    return program_key(program_cache_version(), view.action, lookup, request.accepted_renderer.format)
+
+
+async def aprogram_cache_version():
+    """program_cache_version() for async views."""
+    version = await cache.aget(PROGRAM_VERSION_KEY)
+    if version is None:
+        await cache.aadd(PROGRAM_VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(PROGRAM_VERSION_KEY, 1)
+    return version
+
+
+def compute_etag(data):
+    digest = hashlib.sha1(json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode('utf-8'))
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match', '')
+    candidates = {candidate.strip().removeprefix('W/') for candidate in header.split(',')}
+    return '*' in candidates or etag in candidates
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+    # Authenticated data: browsers may keep it but must revalidate each time
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class CachedResponseMixin:
+    """
+    Serve list/retrieve from the versioned cache, with ETag revalidation.
+    Permission checks still run on every request; only the query and
+    serialization are skipped on a hit.
+    """
+
+    def cached_response(self, request, produce):
+        key = program_cache_key(self, request)
+        entry = cache.get(key)
+        if entry is None:
+            with primary_reads(): # A lagging replica would poison the entry
+                response = produce()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = {'etag': compute_etag(response.data), 'data': response.data}
+            cache.set(key, entry, timeout=settings.AFIYA_PROGRAM_CACHE_TIMEOUT)
+
+        if etag_matches(request, entry['etag']):
+            return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), entry['etag'])
+        return set_validators(Response(entry['data'], status=status.HTTP_200_OK), entry['etag'])
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs)
+        )
+
+
+def client_etag(client_id, updated_at):
+    return f'"client-{client_id}-{updated_at.timestamp():.6f}"'
+
+
+def not_modified(request, etag, last_modified):
+    """
+    True if the request's validators still match. If-None-Match wins over
+    If-Modified-Since when both are sent (RFC 9110).
+    """
+    if 'If-None-Match' in request.headers:
+        return etag_matches(request, etag)
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and int(last_modified.timestamp()) <= since
+
+
+class ConditionalRetrieveMixin:
+    """
+    Answer conditional client retrieves with 304 after a single lookup of
+    updated_at, and attach ETag/Last-Modified to full responses.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        if 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers:
+            lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            try:
+                updated_at = self.get_queryset().model.objects.filter(pk=lookup).values_list(
+                    'updated_at', flat=True).first()
+            except (TypeError, ValueError):
+                updated_at = None # Malformed id: let get_object() produce the 404
+            if updated_at is not None:
+                etag = client_etag(lookup, updated_at)
+                if not_modified(request, etag, updated_at):
+                    return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, updated_at)
+
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        return set_validators(response, client_etag(instance.pk, instance.updated_at), instance.updated_at)
@@ -0,0 +1,242 @@
+#@juma_samwel
+"""
+Change log behind the incremental sync API (GET /afiya/sync/?since=<token>).
+
+Signal receivers (afiya/signals.py) append a ChangeLog row for every saved
+or deleted client and program and every added or removed enrollment, in the
+writing transaction. A sync reads the entries after the caller's token,
+keeps the latest action per object, and returns the current rows of what
+was saved and the ids of what was deleted:
+
+  {"token": "812", "more": false, "reset": false,
+   "clients": [{"id", "name", "date_of_birth", "contact_info"}, ...],
+   "programs": [{"id", "name"}, ...],
+   "enrollments": [[client_id, program_id], ...],
+   "deleted": {"clients": [...], "programs": [...], "enrollments": [[client_id, program_id], ...]}}
+
+Callers store "token" and send it back as ?since=; "more" means another page
+follows straight away. Deleting a client or a program also drops its
+enrollments, without enrollment tombstones of their own. "reset" means the
+token is newer than anything in this database (a restore, another
+deployment): drop the local copy and sync again from the start.
+
+Tokens are the entries' `seq`, not their id. A token is only safe if
+entries become visible in token order, otherwise a reader could move past
+an entry whose transaction commits late, and ids are handed out when rows
+are inserted, not when they commit. On PostgreSQL a deferred constraint
+trigger numbers a transaction's entries as it commits: the first of them to
+fire takes a transaction-level advisory lock and draws seq values for all
+of them at once, and the lock is held until the commit completes. Writers
+therefore queue for the lock only while committing, not for their whole
+transaction, so a bulk upload or import batch that spends seconds inserting
+does not block every other writer meanwhile. On SQLite an insert
+trigger copies the id into seq, which is commit order there (one writer at
+a time). Migrations that make SQLite rebuild afiya_changelog drop that
+trigger and must reinstall it (install_numbering). Other backends get the
+id copied by record() and no ordering guarantee.
+
+Bulk writers wrap their signals in batched(), so a batch appends its
+entries with one INSERT rather than one per signal (per program, say).
+
+`compact_changelog` deletes entries superseded by a later entry for the same
+object, which never hides a change from a sync.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import F
+
+from .fast_serializers import date_field
+from .models import ChangeLog, Client, Program
+from .stats import LOOKUP_CHUNK_SIZE
+
+Enrollment = Client.enrolled_programs.through
+
+# pg_advisory_xact_lock key serializing change log commits ('afya')
+APPEND_LOCK_KEY = 0x61667961
+
+POSTGRES_SEQUENCE = 'afiya_changelog_seq'
+NUMBERING_TRIGGER = 'afiya_changelog_number'
+POSTGRES_INSTALL = [
+    f'CREATE SEQUENCE IF NOT EXISTS {POSTGRES_SEQUENCE}',
+    f"SELECT setval('{POSTGRES_SEQUENCE}', COALESCE(MAX(seq), 0) + 1, false) FROM afiya_changelog",
+    f"""CREATE OR REPLACE FUNCTION {NUMBERING_TRIGGER}() RETURNS trigger AS $$
+    BEGIN
+        -- The transaction's first entry to fire numbers them all; the rest find seq set
+        IF EXISTS (SELECT 1 FROM afiya_changelog WHERE id = NEW.id AND seq IS NULL) THEN
+            PERFORM pg_advisory_xact_lock({APPEND_LOCK_KEY});
+            UPDATE afiya_changelog AS entry SET seq = numbered.seq
+            FROM (
+                SELECT id, nextval('{POSTGRES_SEQUENCE}') AS seq
+                FROM (SELECT id FROM afiya_changelog WHERE seq IS NULL ORDER BY id) AS pending
+            ) AS numbered
+            WHERE entry.id = numbered.id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""",
+    f'DROP TRIGGER IF EXISTS {NUMBERING_TRIGGER} ON afiya_changelog',
+    f"""CREATE CONSTRAINT TRIGGER {NUMBERING_TRIGGER} AFTER INSERT ON afiya_changelog
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION {NUMBERING_TRIGGER}()""",
+]
+SQLITE_INSTALL = [
+    f"""CREATE TRIGGER IF NOT EXISTS {NUMBERING_TRIGGER} AFTER INSERT ON afiya_changelog
+    WHEN new.seq IS NULL BEGIN
+        UPDATE afiya_changelog SET seq = new.id WHERE id = new.id;
+    END""",
+]
+SQLITE_UNINSTALL = [f'DROP TRIGGER IF EXISTS {NUMBERING_TRIGGER}']
+POSTGRES_UNINSTALL = [
+    f'DROP TRIGGER IF EXISTS {NUMBERING_TRIGGER} ON afiya_changelog',
+    f'DROP FUNCTION IF EXISTS {NUMBERING_TRIGGER}()',
+    f'DROP SEQUENCE IF EXISTS {POSTGRES_SEQUENCE}',
+]
+
+
+NUMBERED_VENDORS = {
+    'postgresql': (POSTGRES_INSTALL, POSTGRES_UNINSTALL),
+    'sqlite': (SQLITE_INSTALL, SQLITE_UNINSTALL),
+}
+
+
+def install_numbering(connection):
+    """Create the trigger that sets seq on this connection's backend (idempotent)."""
+    install, _ = NUMBERED_VENDORS.get(connection.vendor, ((), ()))
+    with connection.cursor() as cursor:
+        for statement in install:
+            cursor.execute(statement)
+
+
+def uninstall_numbering(connection):
+    """Drop the objects created by install_numbering."""
+    _, uninstall = NUMBERED_VENDORS.get(connection.vendor, ((), ()))
+    with connection.cursor() as cursor:
+        for statement in uninstall:
+            cursor.execute(statement)
+
+
+# Entries held back by batched(), per thread: {database alias: [ChangeLog, ...]}
+_batches = threading.local()
+
+
+@contextmanager
+def batched(using):
+    """Hold back the entries record() appends to `using` inside the block, and insert them together at the end."""
+    held = _batches.__dict__.setdefault('by_alias', {})
+    if using in held: # Already batching: the outermost block inserts
+        yield
+        return
+    held[using] = []
+    try:
+        yield
+        entries = held[using]
+    finally:
+        del held[using]
+    _append(entries, using)
+
+
+def record(changes, using=None):
+    """Append (kind, object_id, related_id, action) changes to the log in the current transaction."""
+    entries = [
+        ChangeLog(kind=kind, object_id=object_id, related_id=related_id, action=action)
+        for kind, object_id, related_id, action in changes
+    ]
+    using = using or router.db_for_write(ChangeLog)
+    held = getattr(_batches, 'by_alias', {}).get(using)
+    if held is not None:
+        held.extend(entries)
+    else:
+        _append(entries, using)
+
+
+def _append(entries, using):
+    if not entries:
+        return
+    ChangeLog.objects.using(using).bulk_create(entries)
+    if connections[using].vendor not in NUMBERED_VENDORS: # Their triggers set seq
+        ChangeLog.objects.using(using).filter(seq__isnull=True).update(seq=F('pk'))
+
+
+def number_pending(using):
+    """
+    On PostgreSQL, number this transaction's entries now instead of at commit,
+    so a sync from inside a transaction that wrote to the log sees them
+    (tests run inside one). This takes the commit lock early: avoid it in
+    long-running writers.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql' and connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SET CONSTRAINTS {NUMBERING_TRIGGER} IMMEDIATE')
+            cursor.execute(f'SET CONSTRAINTS {NUMBERING_TRIGGER} DEFERRED')
+
+
+def parse_token(value):
+    """The log seq in a ?since= token; missing or empty means from the start. ValueError if malformed."""
+    if value in (None, ''):
+        return 0
+    token = int(value)
+    if token < 0:
+        raise ValueError(value)
+    return token
+
+
+def in_chunks(queryset, field, values):
+    """queryset.filter(<field>__in=values), run in chunks of LOOKUP_CHUNK_SIZE."""
+    rows = []
+    for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        rows.extend(queryset.filter(**{f'{field}__in': values[start:start + LOOKUP_CHUNK_SIZE]}))
+    return rows
+
+
+def changes_since(since, limit=None):
+    """The sync payload for up to `limit` log entries after token `since` (see the module docstring)."""
+    limit = limit or settings.AFIYA_SYNC_PAGE_SIZE
+    number_pending(router.db_for_read(ChangeLog))
+    entries = list(
+        ChangeLog.objects.filter(seq__gt=since).order_by('seq')
+        .values_list('seq', 'kind', 'object_id', 'related_id', 'action')[:limit + 1]
+    )
+    more = len(entries) > limit
+    del entries[limit:]
+    # The newest entry is never superseded, so a token past it was not issued here
+    reset = not entries and since > 0 and not ChangeLog.objects.filter(seq__gte=since).exists()
+
+    latest = {}
+    for _, kind, object_id, related_id, action in entries:
+        latest[kind, object_id, related_id] = action
+    saved, deleted = defaultdict(list), defaultdict(list)
+    for (kind, object_id, related_id), action in latest.items():
+        key = (object_id, related_id) if kind == ChangeLog.ENROLLMENT else object_id
+        (saved if action == ChangeLog.SAVED else deleted)[kind].append(key)
+
+    # Rows deleted since their entry was written are left out: their tombstone follows
+    clients = in_chunks(
+        Client.objects.order_by().values('id', 'name', 'date_of_birth', 'contact_info'),
+        'pk', saved[ChangeLog.CLIENT],
+    )
+    for client in clients:
+        client['date_of_birth'] = date_field.to_representation(client['date_of_birth'])
+    programs = in_chunks(Program.objects.order_by().values('id', 'name'), 'pk', saved[ChangeLog.PROGRAM])
+    added = set(saved[ChangeLog.ENROLLMENT])
+    linked = in_chunks(
+        Enrollment.objects.order_by().values_list('client_id', 'program_id'),
+        'client_id', sorted({client_id for client_id, _ in added}),
+    )
+
+    return {
+        'token': str(entries[-1][0] if entries else 0 if reset else since),
+        'more': more,
+        'reset': reset,
+        'clients': sorted(clients, key=lambda client: client['id']),
+        'programs': sorted(programs, key=lambda program: program['id']),
+        'enrollments': sorted(list(link) for link in linked if link in added),
+        'deleted': {
+            'clients': sorted(deleted[ChangeLog.CLIENT]),
+            'programs': sorted(deleted[ChangeLog.PROGRAM]),
+            'enrollments': sorted(list(link) for link in deleted[ChangeLog.ENROLLMENT]),
+        },
+    }
@@ -0,0 +1,134 @@
+#@juma_samwel
+"""
+In-process publish/subscribe for live change events, streamed to browsers
+as server-sent events by afiya.async_views.event_stream (/afiya/events/).
+
+Signal receivers (afiya/signals.py) publish compact events once the
+writing transaction commits:
+
+  client.created   {"id", "name"}
+  client.updated   {"id", "name"}
+  client.deleted   {"id"}
+  enrollment.added {"client_ids": [...], "program_ids": [...]}
+
+Every event gets an increasing id. The last AFIYA_EVENTS_BACKLOG events
+are kept so a reconnecting EventSource (which sends Last-Event-ID) can
+catch up. A subscriber that falls behind by more than
+AFIYA_EVENTS_QUEUE_SIZE events, or asks to resume from an event that is
+no longer kept, gets a single `reset` event instead, meaning "refetch".
+
+Events only reach subscribers in the same process. Publishing is
+thread-safe (signals fire on WSGI threads and sync_to_async threads);
+subscribing needs a running event loop, i.e. an ASGI server.
+"""
+import asyncio
+import threading
+from collections import deque, namedtuple
+
+from django.conf import settings
+
+Event = namedtuple('Event', 'id kind data')
+
+RESET = 'reset'
+
+
+class Subscription:
+    """One listener's queue, drained by its own event loop."""
+
+    def __init__(self, broker, loop, max_pending):
+        self.broker = broker
+        self.loop = loop
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.overflowed = False
+        self.ready = asyncio.Event()
+
+    def deliver(self, events):
+        """Called from any thread; hands `events` to the subscriber's loop."""
+        self.loop.call_soon_threadsafe(self._receive, events)
+
+    def _receive(self, events):
+        if self.overflowed:
+            return
+        if len(self.pending) + len(events) > self.max_pending:
+            # Too far behind to be worth replaying: tell the client to refetch
+            self.pending.clear()
+            self.overflowed = True
+        else:
+            self.pending.extend(events)
+        self.ready.set()
+
+    async def next_events(self, timeout):
+        """The events published since the last call, waiting up to `timeout` seconds ([] if none)."""
+        if not self.pending and not self.overflowed:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        if self.overflowed:
+            self.overflowed = False
+            return [Event(self.broker.last_id, RESET, {})]
+        events = list(self.pending)
+        self.pending.clear()
+        return events
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._recent = deque(maxlen=settings.AFIYA_EVENTS_BACKLOG)
+        self.last_id = 0
+
+    def publish(self, kind, data):
+        self.publish_many([(kind, data)])
+
+    def publish_many(self, events):
+        """Publish (kind, data) pairs, in order, to every subscriber."""
+        if not events:
+            return
+        with self._lock:
+            numbered = []
+            for kind, data in events:
+                self.last_id += 1
+                numbered.append(Event(self.last_id, kind, data))
+            self._recent.extend(numbered)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.deliver(numbered)
+            except RuntimeError:
+                # Its event loop has closed without unsubscribing
+                self.unsubscribe(subscription)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a listener on the running event loop. With `last_event_id`,
+        the events after it are queued first (or a reset, if they are gone).
+        """
+        subscription = Subscription(self, asyncio.get_running_loop(), settings.AFIYA_EVENTS_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if last_event_id is not None and last_event_id != self.last_id:
+                oldest = self._recent[0].id if self._recent else self.last_id + 1
+                if last_event_id > self.last_id or last_event_id < oldest - 1:
+                    # From another process or before a restart, or trimmed from the backlog
+                    subscription.overflowed = True
+                else:
+                    subscription.pending.extend(event for event in self._recent if event.id > last_event_id)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+broker = EventBroker()
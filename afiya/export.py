@@ -0,0 +1,112 @@
+#@juma_samwel
+"""
+Constant-memory export of clients and their enrollments.
+
+Clients are read with .iterator(chunk_size=...), which also runs the
+enrolled_programs prefetch once per chunk, so at most one chunk of clients
+and their programs is held in memory at a time. Rows are encoded into
+small buffers and yielded straight to a StreamingHttpResponse, so the first
+bytes go out before the whole table has been read.
+"""
+import csv
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
+
+from .models import Client, Program
+
+EXPORT_FIELDS = ['id', 'name', 'date_of_birth', 'contact_info', 'enrolled_programs']
+# Yield roughly this many bytes at a time rather than one tiny chunk per row.
+FLUSH_BYTES = 64 * 1024
+
+
+def export_queryset(chunk_size):
+    """Clients in id order with a lean per-chunk prefetch of their programs."""
+    programs = Prefetch('enrolled_programs', queryset=Program.objects.only('id', 'name'))
+    return Client.objects.order_by('id').prefetch_related(programs).iterator(chunk_size=chunk_size)
+
+
+def _buffered(lines):
+    """Join small encoded pieces into ~FLUSH_BYTES chunks."""
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def iter_csv(clients):
+    """
+    CSV rows with a header. Programs are exported as names joined by ';',
+    the same format import_clients reads back.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    def encode(row):
+        writer.writerow(row)
+        line = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return line.encode('utf-8')
+
+    yield encode(EXPORT_FIELDS)
+    for client in clients:
+        yield encode([
+            client.id,
+            client.name,
+            client.date_of_birth.isoformat(),
+            client.contact_info,
+            ';'.join(program.name for program in client.enrolled_programs.all()),
+        ])
+
+
+def iter_ndjson(clients):
+    """One JSON object per line, shaped like the ClientSerializer output."""
+    for client in clients:
+        record = {
+            'id': client.id,
+            'name': client.name,
+            'date_of_birth': client.date_of_birth.isoformat(),
+            'contact_info': client.contact_info,
+            'enrolled_programs': [
+                {'id': program.id, 'name': program.name}
+                for program in client.enrolled_programs.all()
+            ],
+        }
+        yield json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip-compress a byte stream on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_clients(export_format, chunk_size, gzip=False):
+    """Byte chunks for a client export in 'csv' or 'ndjson' format."""
+    encoder = iter_csv if export_format == 'csv' else iter_ndjson
+    chunks = _buffered(encoder(export_queryset(chunk_size)))
+    return gzip_stream(chunks) if gzip else chunks
+
+
+async def as_async_iterator(chunks):
+    """
+    Pull a sync byte stream one chunk at a time from a worker thread.
+    Under ASGI, Django would otherwise read a sync iterator to the end
+    (into memory) before sending anything.
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
@@ -0,0 +1,103 @@
+#@juma_samwel
+"""
+Read-only fast path for rendering clients and programs.
+
+DRF's serializers build a field tree and call to_representation field by
+field, row by row, which dominates CPU time on large client pages. These
+functions build the same dicts straight from .values() rows: one query for
+the clients' columns, one query on the enrollment table for their program
+ids, and program names from a cached id -> name map, versioned with the
+program cache so renames and deletes show up immediately.
+
+The output matches ClientSerializer / ProgramSerializer exactly (keys,
+key order, program order, date format), so the rendered JSON is byte-for-byte
+the same. Only reads use it; writes go through the regular serializers.
+Switched off with AFIYA_FAST_SERIALIZERS=False.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import serializers
+
+from .caching import program_cache_version, program_key
+from .models import Client, Program
+from .routers import primary_reads
+from .serializers import ClientSerializer
+
+Enrollment = Client.enrolled_programs.through
+
+PROGRAMS_FIELD = 'enrolled_programs'
+
+# Formats dates exactly as ClientSerializer does (honours REST_FRAMEWORK['DATE_FORMAT'])
+date_field = serializers.DateField()
+
+
+def program_rows(queryset):
+    """ProgramSerializer(queryset, many=True).data, as plain dicts."""
+    return list(queryset.values('id', 'name'))
+
+
+def program_directory(refresh=False):
+    """
+    {program id: (position, name)} for every program, where position follows
+    Program's default ordering (the order the nested program lists use).
+    Cached under the current program cache version.
+    """
+    key = program_key(program_cache_version(), 'directory', '', 'map')
+    directory = None if refresh else cache.get(key)
+    if directory is None:
+        with primary_reads():
+            programs = Program.objects.order_by(*Program._meta.ordering, 'id').values_list('id', 'name')
+            directory = {program_id: (position, name) for position, (program_id, name) in enumerate(programs)}
+        cache.set(key, directory, timeout=settings.AFIYA_PROGRAM_CACHE_TIMEOUT)
+    return directory
+
+
+def enrolled_programs(client_ids):
+    """{client id: [{'id', 'name'}, ...]} for the given clients, from one enrollment query."""
+    program_ids = defaultdict(list)
+    links = Enrollment.objects.filter(client_id__in=client_ids).values_list('client_id', 'program_id')
+    for client_id, program_id in links:
+        program_ids[client_id].append(program_id)
+
+    directory = program_directory()
+    if any(program_id not in directory for ids in program_ids.values() for program_id in ids):
+        directory = program_directory(refresh=True) # Created since the map was cached
+
+    programs = {}
+    for client_id, ids in program_ids.items():
+        ids.sort(key=lambda program_id: directory[program_id][0])
+        programs[client_id] = [{'id': program_id, 'name': directory[program_id][1]} for program_id in ids]
+    return programs
+
+
+def client_fields(fieldset=None):
+    """ClientSerializer's fields, in order, limited to `fieldset` (see afiya/fieldsets.py)."""
+    return [name for name in ClientSerializer.Meta.fields if fieldset is None or name in fieldset]
+
+
+def client_values(queryset, fieldset=None, extra=()):
+    """
+    `queryset` as .values() rows holding the columns client_rows() needs,
+    plus `extra` (e.g. the keyset pagination position).
+    """
+    columns = [name for name in client_fields(fieldset) if name != PROGRAMS_FIELD]
+    return queryset.prefetch_related(None).values(*dict.fromkeys(['id', *columns, *extra]))
+
+
+def client_rows(rows, fieldset=None):
+    """ClientSerializer(..., many=True).data for rows from client_values()."""
+    fields = client_fields(fieldset)
+    columns = [name for name in fields if name != PROGRAMS_FIELD]
+    programs = enrolled_programs([row['id'] for row in rows]) if PROGRAMS_FIELD in fields else None
+
+    data = []
+    for row in rows:
+        item = {name: row[name] for name in columns}
+        if 'date_of_birth' in item:
+            item['date_of_birth'] = date_field.to_representation(item['date_of_birth'])
+        if programs is not None:
+            item[PROGRAMS_FIELD] = programs.get(row['id'], [])
+        data.append(item)
+    return data
@@ -0,0 +1,81 @@
+#@juma_samwel
+"""
+Sparse fieldsets for client responses.
+
+?fields=id,name returns only the listed fields. The nested program list
+(enrolled_programs) is included when it is named in ?fields= or in
+?expand=enrolled_programs. Without ?fields= responses are unchanged.
+
+Fields that are not returned are not fetched either: the query loads only
+the requested columns (plus the pagination position and the ETag source),
+and the enrolled_programs prefetch is dropped when programs are not wanted.
+"""
+from rest_framework.exceptions import ValidationError
+
+EXPANDABLE_FIELDS = frozenset({'enrolled_programs'})
+
+# Always loaded: the keyset pagination position (name, id) and the retrieve ETag source
+REQUIRED_COLUMNS = ('id', 'name', 'updated_at')
+
+
+def split_names(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def parse_fieldset(query_params, available):
+    """
+    The set of field names requested through ?fields= and ?expand=, or None
+    when ?fields= is absent. Raises ValidationError (400) for unknown names.
+    """
+    fields = query_params.get('fields', None)
+    if fields is None:
+        return None
+
+    requested = split_names(fields)
+    expand = split_names(query_params.get('expand', ''))
+    if not requested:
+        raise ValidationError({'fields': "List at least one field."})
+    unknown = requested - set(available)
+    if unknown:
+        raise ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}."})
+    unknown = expand - EXPANDABLE_FIELDS
+    if unknown:
+        raise ValidationError({'expand': f"Cannot expand: {', '.join(sorted(unknown))}."})
+    return requested | expand
+
+
+def trim_queryset(queryset, fieldset):
+    """Load only the columns `fieldset` needs, and prefetch programs only when requested."""
+    model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+    columns = set(REQUIRED_COLUMNS) | (fieldset & model_fields)
+    if not fieldset & EXPANDABLE_FIELDS:
+        queryset = queryset.prefetch_related(None)
+    return queryset.only(*sorted(columns))
+
+
+class SparseFieldsetMixin:
+    """
+    ViewSet mixin applying ?fields= / ?expand= to the read actions listed in
+    `fieldset_actions`. The serializer must accept a 'fieldset' in its context
+    (see afiya.serializers.SparseFieldsMixin).
+    """
+    fieldset_actions = ('list', 'retrieve', 'search', 'batch')
+
+    def get_fieldset(self):
+        if self.action not in self.fieldset_actions:
+            return None
+        if not hasattr(self, '_fieldset'):
+            # The class attribute: actions such as batch set their own input serializer_class
+            available = type(self).serializer_class.Meta.fields
+            self._fieldset = parse_fieldset(self.request.query_params, available)
+        return self._fieldset
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fieldset = self.get_fieldset()
+        return queryset if fieldset is None else trim_queryset(queryset, fieldset)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fieldset'] = self.get_fieldset()
+        return context
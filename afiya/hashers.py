@@ -0,0 +1,22 @@
+#@juma_samwel
+"""
+PBKDF2 password hasher whose work factor comes from settings.
+
+Django's default PBKDF2 iteration count is tuned for a single login, not for
+a clinic-wide login storm. AFIYA_PBKDF2_ITERATIONS sets the cost for new
+hashes. Existing hashes keep verifying with the iteration count stored in
+them, and are re-hashed at the configured cost on the user's next
+successful login (Django's must_update), so the setting can be raised or
+lowered without a migration.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # Same algorithm name as Django's hasher, so it handles existing pbkdf2_sha256 hashes.
+    algorithm = 'pbkdf2_sha256'
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'AFIYA_PBKDF2_ITERATIONS', None) or PBKDF2PasswordHasher.iterations
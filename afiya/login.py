@@ -0,0 +1,111 @@
+#@juma_samwel
+"""
+The login pipeline: one query to load the user together with their token,
+password verification with a cap on concurrent hashes, and a token insert
+only on a user's first login.
+
+PBKDF2 spends its time in hashlib, which releases the GIL, so hashes on
+different request threads run in parallel. Under ASGI each request to a sync
+view gets its own thread, so during a login storm unbounded hashing would
+take every core. The hash still runs on the request thread (handing it to
+another thread would only make this one wait), but AFIYA_LOGIN_HASH_WORKERS
+caps how many threads hash at once, and AFIYA_LOGIN_MAX_PENDING caps how many
+logins may wait for a turn before the rest are turned away with 503. Under
+WSGI the worker process is the bound, so hashes are not limited unless
+AFIYA_LOGIN_HASH_LIMIT_UNDER_WSGI is set.
+"""
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException
+
+
+class LoginBusy(APIException):
+    status_code = 503
+    default_detail = 'Too many logins in progress, please retry shortly.'
+    default_code = 'login_busy'
+
+
+class PasswordHashLimiter:
+    """Caps concurrent password checks, created lazily from settings."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashing = None
+        self._slots = None
+
+    def _start(self):
+        with self._lock:
+            if self._hashing is None:
+                workers = settings.AFIYA_LOGIN_HASH_WORKERS
+                self._slots = threading.BoundedSemaphore(workers + settings.AFIYA_LOGIN_MAX_PENDING)
+                self._hashing = threading.BoundedSemaphore(workers)
+        return self._hashing, self._slots
+
+    def run(self, function, *args):
+        """Run function(*args) on this thread once a hashing slot is free; LoginBusy if too many wait."""
+        hashing, slots = self._start()
+        if not slots.acquire(blocking=False):
+            raise LoginBusy()
+        try:
+            with hashing:
+                return function(*args)
+        finally:
+            slots.release()
+
+
+password_hash_limiter = PasswordHashLimiter()
+
+
+def limit_hashing(request):
+    """Whether password checks for this (Django or DRF) request are limited."""
+    if request is None or settings.AFIYA_LOGIN_HASH_WORKERS <= 0:
+        return False
+    request = getattr(request, '_request', request)
+    return isinstance(request, ASGIRequest) or settings.AFIYA_LOGIN_HASH_LIMIT_UNDER_WSGI
+
+
+def load_user(username):
+    """The user with this username and their token (or None) in a single query."""
+    return User.objects.select_related('auth_token').filter(username=username).first()
+
+
+def verify_password(user, password, limit=False):
+    """
+    Check a password, waiting for a hashing slot when `limit` is set. A missing user
+    still costs one hash, so response times do not reveal which usernames exist.
+    Hashes made at an outdated cost are upgraded here, on the request thread.
+    """
+    if user is None:
+        check, args = make_password, (password,)
+    else:
+        check, args = check_password, (password, user.password)
+    if limit:
+        valid = password_hash_limiter.run(check, *args)
+    else:
+        valid = check(*args)
+    if user is None or valid is not True:
+        return False
+    if identify_hasher(user.password).must_update(user.password):
+        user.set_password(password)
+        user.save(update_fields=['password'])
+    return True
+
+
+def token_for(user):
+    """The user's token; only a first login writes."""
+    try:
+        return user.auth_token
+    except Token.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            return Token.objects.create(user=user)
+    except IntegrityError:
+        # A concurrent first login created it
+        return Token.objects.get(user=user)
@@ -0,0 +1,95 @@
+#@juma_samwel
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from afiya.benchmarking import latency_ms
+
+ENDPOINTS = {
+    'clients': ('/afiya/clients/?page_size=50', '/afiya/async/clients/?page_size=50'),
+    'search': ('/afiya/clients/search/?q={query}', '/afiya/async/clients/search/?q={query}'),
+    'programs': ('/afiya/programs/', '/afiya/async/programs/'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/sec and latency (p50/p99) of the hot endpoints served "
+        "three ways, in-process against the configured database: DRF views under "
+        "WSGI, the same DRF views under ASGI, and the native async views under ASGI."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per measurement.')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once.')
+        parser.add_argument(
+            '--endpoint', action='append', choices=sorted(ENDPOINTS),
+            help='Endpoint(s) to measure (default: all).',
+        )
+        parser.add_argument('--query', default='a', help='Search text for the search endpoint.')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f'bench-async-{uuid.uuid4().hex[:12]}')
+        token = Token.objects.create(user=user)
+        headers = {'authorization': f'Token {token.key}'}
+        # The in-process test clients send Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            try:
+                self.measure(headers, options)
+            finally:
+                user.delete()
+
+    def measure(self, headers, options):
+        self.stdout.write(f"{options['requests']} requests, concurrency {options['concurrency']}")
+        for name in options['endpoint'] or sorted(ENDPOINTS):
+            drf_path, async_path = (path.format(query=options['query']) for path in ENDPOINTS[name])
+            self.report(name, 'wsgi + drf', self.run_wsgi(drf_path, headers, options))
+            self.report(name, 'asgi + drf', asyncio.run(self.run_asgi(drf_path, headers, options)))
+            self.report(name, 'asgi + async', asyncio.run(self.run_asgi(async_path, headers, options)))
+
+    def run_wsgi(self, path, headers, options):
+        client = Client(headers=headers)
+
+        def one(_):
+            started = time.perf_counter()
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f'{path}: HTTP {response.status_code}')
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            latencies = list(executor.map(one, range(options['requests'])))
+        return len(latencies) / (time.perf_counter() - started), latency_ms(latencies)
+
+    async def run_asgi(self, path, headers, options):
+        # AsyncClient only sends per-request headers to ASGI views
+        client = AsyncClient()
+        slots = asyncio.Semaphore(options['concurrency'])
+
+        async def one():
+            async with slots:
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                if response.status_code != 200:
+                    raise CommandError(f'{path}: HTTP {response.status_code}')
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(options['requests'])))
+        return len(latencies) / (time.perf_counter() - started), latency_ms(latencies)
+
+    def report(self, endpoint, label, result):
+        rate, latency = result
+        self.stdout.write(
+            f"{endpoint:>9} {label:>13}: {rate:8.1f} req/s  "
+            f"p50 {latency['p50']:7.2f} ms  p99 {latency['p99']:7.2f} ms"
+        )
@@ -0,0 +1,88 @@
+#@juma_samwel
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+
+from afiya.login import load_user, token_for, verify_password
+
+
+def legacy_login(username, password):
+    """The login path as it was: separate user and token queries, hash on the request thread."""
+    user = User.objects.filter(username=username).first()
+    if not user or not user.check_password(password):
+        return False
+    Token.objects.get_or_create(user=user)
+    return True
+
+
+def limited_login(username, password):
+    user = load_user(username)
+    if not verify_password(user, password, limit=True):
+        return False
+    token_for(user)
+    return True
+
+
+def inline_login(username, password):
+    user = load_user(username)
+    if not verify_password(user, password):
+        return False
+    token_for(user)
+    return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure logins/sec (and per core) for the legacy login path and the "
+        "current one, using a temporary user that is removed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=40, help='Logins per measurement.')
+        parser.add_argument(
+            '--threads', type=int, default=os.cpu_count() or 1,
+            help='Concurrent login threads (simulates concurrent requests).',
+        )
+        parser.add_argument(
+            '--iterations', type=int,
+            help='PBKDF2 iterations to hash the test password with (default: AFIYA_PBKDF2_ITERATIONS).',
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations'] or settings.AFIYA_PBKDF2_ITERATIONS
+        username, password = f'bench-login-{uuid.uuid4().hex[:12]}', uuid.uuid4().hex
+        with override_settings(AFIYA_PBKDF2_ITERATIONS=iterations):
+            user = User.objects.create_user(username=username, password=password)
+            try:
+                self.stdout.write(
+                    f"{options['logins']} logins, {options['threads']} threads, "
+                    f"{user.password.split('$')[1]} PBKDF2 iterations, {os.cpu_count()} cores"
+                )
+                for label, login in (('legacy', legacy_login), ('inline', inline_login), ('limited', limited_login)):
+                    self.measure(label, login, username, password, options['logins'], options['threads'])
+            finally:
+                user.delete()
+
+    def measure(self, label, login, username, password, logins, threads):
+        with CaptureQueriesContext(connection) as queries:
+            if not login(username, password):
+                raise CommandError(f'{label}: benchmark login failed')
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(lambda _: login(username, password), range(logins)))
+        elapsed = time.perf_counter() - started
+        rate = logins / elapsed
+        cores = min(threads, os.cpu_count() or 1)
+        self.stdout.write(
+            f'{label:>7}: {rate:8.1f} logins/s, {rate / cores:8.1f} per core, '
+            f'{len(queries)} queries/login, {results.count(False)} failures'
+        )
@@ -0,0 +1,91 @@
+#@juma_samwel
+import statistics
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from afiya.metrics import MetricsMiddleware, registry
+
+ENDPOINTS = {
+    'clients': '/afiya/clients/?page_size=50',
+    'search': '/afiya/clients/search/?q={query}',
+    'programs': '/afiya/programs/',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the overhead of MetricsMiddleware: the same requests, in-process "
+        "against the configured database, with AFIYA_METRICS_ENABLED on and off. "
+        "Rounds alternate between the two so drift affects both equally. The middleware's "
+        "own per-request cost is also timed around a no-op view, which is steadier than "
+        "the difference between two end-to-end timings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per round.')
+        parser.add_argument('--rounds', type=int, default=10, help='Rounds per setting; the median is reported.')
+        parser.add_argument(
+            '--endpoint', action='append', choices=sorted(ENDPOINTS),
+            help='Endpoint(s) to measure (default: all).',
+        )
+        parser.add_argument('--query', default='a', help='Search text for the search endpoint.')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f'bench-metrics-{uuid.uuid4().hex[:12]}')
+        token = Token.objects.create(user=user)
+        client = Client(headers={'authorization': f'Token {token.key}'})
+        # The in-process test client sends Host: testserver
+        cost = self.middleware_cost(options['requests'] * options['rounds'])
+        self.stdout.write(f'middleware cost: {cost * 1e6:.1f} us/request')
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            try:
+                for name in options['endpoint'] or sorted(ENDPOINTS):
+                    path = ENDPOINTS[name].format(query=options['query'])
+                    self.measure(name, client, path, options['requests'], options['rounds'], cost)
+            finally:
+                user.delete()
+                registry.clear()
+
+    def middleware_cost(self, requests):
+        """Seconds MetricsMiddleware adds to each request, timed around a no-op view."""
+        request = RequestFactory().get('/afiya/clients/')
+        bare = lambda request: HttpResponse()
+        wrapped = MetricsMiddleware(bare)
+        timings = {}
+        for label, handler in (('bare', bare), ('wrapped', wrapped)):
+            started = time.perf_counter()
+            for _ in range(requests):
+                handler(request)
+            timings[label] = time.perf_counter() - started
+        registry.clear()
+        return max(0.0, timings['wrapped'] - timings['bare']) / requests
+
+    def measure(self, name, client, path, requests, rounds, cost):
+        self.run_round(client, path, requests) # Warm up caches and the connection
+        timings = {True: [], False: []}
+        for _ in range(rounds):
+            for enabled in (True, False):
+                with override_settings(AFIYA_METRICS_ENABLED=enabled):
+                    timings[enabled].append(self.run_round(client, path, requests))
+        on, off = statistics.median(timings[True]), statistics.median(timings[False])
+        self.stdout.write(
+            f'{name:>9}: off {requests / off:8.1f} req/s  on {requests / on:8.1f} req/s  '
+            f'overhead {(on - off) / off * 100:+.2f}% measured, '
+            f'{cost * requests / off * 100:.2f}% from middleware cost'
+        )
+
+    def run_round(self, client, path, requests):
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f'{path}: HTTP {response.status_code}')
+        return time.perf_counter() - started
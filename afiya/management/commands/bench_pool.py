@@ -0,0 +1,146 @@
+#@juma_samwel
+import statistics
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from afiya.benchmarking import latency_ms
+from afiya.metrics import registry
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what opening database connections adds to request latency. The same "
+        "requests run in-process with: 'connect', a new connection per request "
+        "(CONN_MAX_AGE=0, like connections churning per request under ASGI); "
+        "'persistent', one kept connection per thread; and 'pooled', Django's psycopg "
+        "pool, when AFIYA_DB_POOL is configured for the database. Rounds alternate "
+        "between the modes. Each request is followed by close_old_connections(), which "
+        "real servers run on request_finished and the test client skips."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per round, across all threads.')
+        parser.add_argument('--rounds', type=int, default=5, help='Rounds per mode; latencies are pooled.')
+        parser.add_argument('--concurrency', type=int, default=1, help='Threads sending requests.')
+        parser.add_argument(
+            '--path', default='/afiya/clients/?page_size=20',
+            help='Path to request; pick one that queries the database (cached responses may not).',
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        settings_dict = connection.settings_dict
+        configured = (settings_dict['CONN_MAX_AGE'], settings_dict['OPTIONS'].get('pool'))
+        modes = ['connect', 'persistent'] + (['pooled'] if configured[1] else [])
+
+        user = User.objects.create_user(username=f'bench-pool-{uuid.uuid4().hex[:12]}')
+        token = Token.objects.create(user=user)
+        headers = {'authorization': f'Token {token.key}'}
+        latencies = {mode: [] for mode in modes}
+        opened = {mode: 0 for mode in modes}
+        try:
+            with self.mode('connect', settings_dict, configured):
+                setup = self.connect_cost(connection, 50)
+            self.stdout.write(
+                f"{connection.vendor} '{DEFAULT_DB_ALIAS}': opening a connection takes {setup * 1000:.2f} ms "
+                f"(then its first queries run on cold caches)"
+            )
+            # The in-process test client sends Host: testserver
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for mode in modes: # Warm up caches
+                    with self.mode(mode, settings_dict, configured):
+                        self.run_round(headers, options['path'], options['requests'], options['concurrency'])
+                for _ in range(options['rounds']):
+                    for mode in modes:
+                        with self.mode(mode, settings_dict, configured):
+                            before = registry.connections_opened().get(DEFAULT_DB_ALIAS, 0)
+                            latencies[mode] += self.run_round(
+                                headers, options['path'], options['requests'], options['concurrency']
+                            )
+                            opened[mode] += registry.connections_opened().get(DEFAULT_DB_ALIAS, 0) - before
+        finally:
+            user.delete()
+
+        total = options['requests'] * options['rounds']
+        summaries = {mode: latency_ms(latencies[mode]) for mode in modes}
+        for mode, latency in summaries.items():
+            self.stdout.write(
+                f"{mode:>10}: mean {latency['mean']:7.3f} ms  "
+                f"p50 {latency['p50']:7.3f} ms  p99 {latency['p99']:7.3f} ms  "
+                f"connections opened/request {opened[mode] / total:.2f}"
+            )
+        saved = summaries['connect']['mean'] - summaries['persistent']['mean']
+        self.stdout.write(f'reusing connections saves {saved:.3f} ms per request')
+
+    def connect_cost(self, connection, samples):
+        """Median seconds to open a connection, including Django's per-connection setup."""
+        timings = []
+        for _ in range(samples):
+            connection.close()
+            started = time.perf_counter()
+            connection.ensure_connection()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
+
+    @contextmanager
+    def mode(self, mode, settings_dict, configured):
+        """Switch every thread's connection to `mode`; the settings dict is shared between threads."""
+        conn_max_age, pool = configured
+        connections.close_all() # Under the settings it was opened with
+        if mode == 'pooled':
+            settings_dict['CONN_MAX_AGE'] = 0
+            settings_dict['OPTIONS']['pool'] = pool
+        else:
+            settings_dict['CONN_MAX_AGE'] = 0 if mode == 'connect' else (conn_max_age or 600)
+            settings_dict['OPTIONS'].pop('pool', None)
+        try:
+            yield
+        finally:
+            connections.close_all()
+            settings_dict['CONN_MAX_AGE'] = conn_max_age
+            if pool:
+                settings_dict['OPTIONS']['pool'] = pool
+
+    def run_round(self, headers, path, requests, concurrency):
+        """Latency of each request, sent by `concurrency` fresh threads."""
+        latencies, failures = [], []
+        lock = threading.Lock()
+
+        def worker(count):
+            client = Client(headers=headers)
+            mine = []
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    response = client.get(path)
+                    close_old_connections()
+                    mine.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        failures.append(f'{path}: HTTP {response.status_code}')
+                        return
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(mine)
+
+        threads = [
+            threading.Thread(target=worker, args=(requests // concurrency + (index < requests % concurrency),))
+            for index in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise CommandError(failures[0])
+        return latencies
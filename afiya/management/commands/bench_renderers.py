@@ -0,0 +1,46 @@
+#@juma_samwel
+import io
+from itertools import cycle, islice
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from afiya.benchmarking import best_of
+from afiya.fast_serializers import client_rows, client_values
+from afiya.models import Client
+from afiya.parsers import FastJSONParser
+from afiya.renderers import FastJSONRenderer, orjson
+
+
+class Command(BaseCommand):
+    help = (
+        "Render (and parse back) one large client page with DRF's JSON renderer/parser "
+        "and with the orjson-backed ones the API uses, and report ms per page and MB/s. "
+        "Clients come from the configured database and are repeated to fill the page."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Clients on the page.')
+        parser.add_argument('--repeat', type=int, default=10, help='Measurements per variant; the best is reported.')
+
+    def handle(self, *args, **options):
+        rows = client_rows(list(client_values(Client.objects.order_by('name', 'id')[:options['rows']])))
+        if not rows:
+            raise CommandError('No clients to render; import some first (see import_clients).')
+        page = {'next': None, 'previous': None, 'results': list(islice(cycle(rows), options['rows']))}
+
+        self.stdout.write(f"{len(page['results'])} clients per page, orjson {'installed' if orjson else 'missing'}")
+        body = self.measure('render', 'drf', lambda: JSONRenderer().render(page), options['repeat'])
+        fast_body = self.measure('render', 'fast', lambda: FastJSONRenderer().render(page), options['repeat'])
+        self.measure('parse', 'drf', lambda: JSONParser().parse(io.BytesIO(body)), options['repeat'], len(body))
+        self.measure('parse', 'fast', lambda: FastJSONParser().parse(io.BytesIO(body)), options['repeat'], len(body))
+        self.stdout.write(f'identical JSON: {body == fast_body}')
+
+    def measure(self, operation, label, run, repeat, size=None):
+        result, best = best_of(run, repeat)
+        size = size or len(result)
+        self.stdout.write(
+            f'{operation:>6} {label:>4}: {best * 1000:8.2f} ms/page  {size / best / 1e6:8.1f} MB/s'
+        )
+        return result
@@ -0,0 +1,55 @@
+#@juma_samwel
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from afiya.benchmarking import best_of
+from afiya.fast_serializers import client_rows, client_values, program_rows
+from afiya.models import Client, Program
+from afiya.serializers import ClientSerializer, ProgramSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows/sec of the DRF serializers and the read-only fast path "
+        "(afiya/fast_serializers.py) on clients and programs from the configured "
+        "database, including the queries and JSON rendering, and check that both "
+        "render identical bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Clients per measurement (a page of this size).')
+        parser.add_argument('--repeat', type=int, default=5, help='Measurements per path; the best is reported.')
+
+    def handle(self, *args, **options):
+        clients = Client.objects.prefetch_related('enrolled_programs').order_by('name', 'id')[:options['rows']]
+        programs = Program.objects.order_by('name')
+        if not clients.exists():
+            raise CommandError('No clients to serialize; import some first (see import_clients).')
+
+        paths = {
+            'clients': (
+                lambda: ClientSerializer(list(clients), many=True).data,
+                lambda: client_rows(list(client_values(clients))),
+            ),
+            'programs': (
+                lambda: ProgramSerializer(programs, many=True).data,
+                lambda: program_rows(programs),
+            ),
+        }
+        renderer = JSONRenderer()
+        for name, (drf, fast) in paths.items():
+            drf_body, drf_rate = self.measure(drf, renderer, options['repeat'])
+            fast_body, fast_rate = self.measure(fast, renderer, options['repeat'])
+            self.stdout.write(
+                f'{name:>8}: drf {drf_rate:10.0f} rows/s  fast {fast_rate:10.0f} rows/s  '
+                f'x{fast_rate / drf_rate:.1f}  identical JSON: {drf_body == fast_body}'
+            )
+
+    def measure(self, produce, renderer, repeat):
+        def once():
+            data = produce()
+            return data, renderer.render(data)
+
+        produce() # Warm up (program name map, connection)
+        (data, body), best = best_of(once, repeat)
+        return body, len(data) / best
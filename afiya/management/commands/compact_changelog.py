@@ -0,0 +1,31 @@
+#@juma_samwel
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Exists, OuterRef
+
+from afiya.models import ChangeLog
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete change log entries superseded by a later entry for the same client, "
+        "program or enrollment, leaving one entry per object. /afiya/sync/ returns the "
+        "same data afterwards, so it is safe to run at any time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database alias to compact (default: "default").',
+        )
+
+    def handle(self, *args, **options):
+        log = ChangeLog.objects.using(options['database'])
+        later = log.filter(
+            kind=OuterRef('kind'), object_id=OuterRef('object_id'),
+            related_id=OuterRef('related_id'), seq__gt=OuterRef('seq'),
+        )
+        removed, _ = log.filter(Exists(later)).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {removed} superseded change log entries on '{options['database']}'."
+        ))
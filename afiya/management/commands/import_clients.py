@@ -0,0 +1,274 @@
+#@juma_samwel
+import csv
+import gzip
+import json
+import sys
+import time
+from collections import ChainMap, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework import serializers
+
+from afiya.bulk import chunked, insert_clients
+from afiya.models import Client, ImportCheckpoint, Program
+from afiya.serializers import ClientSerializer
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+def open_input(path):
+    """Open the input as text, transparently decompressing .gz files."""
+    if path == '-':
+        return nullcontext(sys.stdin) # Leave stdin open for the caller
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def iter_rows(handle, input_format):
+    """
+    Stream-parse the input into row dicts, one line at a time.
+    Rows that cannot be parsed are yielded as {'_parse_error': message}.
+    """
+    if input_format == 'csv':
+        for record in csv.DictReader(handle):
+            yield record
+        return
+    for line_number, line in enumerate(handle, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            yield {'_parse_error': f'Invalid JSON on line {line_number}: {exc}'}
+
+
+def program_names_of(row):
+    """
+    Program names for a row: CSV cells hold names joined by ';' (as written by
+    the export endpoint); NDJSON may hold names or {"id", "name"} objects.
+    """
+    programs = row.get('enrolled_programs') or []
+    if isinstance(programs, str):
+        programs = programs.split(';')
+    names = []
+    for program in programs:
+        name = program.get('name') if isinstance(program, dict) else program
+        if isinstance(name, str) and name.strip():
+            names.append(name.strip())
+    return list(dict.fromkeys(names))
+
+
+def validate_chunk(rows):
+    """
+    Validate a chunk of raw rows without touching the database, so it can
+    run in a worker process. Returns one (ok, payload) pair per row where
+    payload is (validated_data, program_names) or a plain error dict.
+    """
+    serializer = ClientSerializer()
+    results = []
+    for row in rows:
+        if not isinstance(row, dict):
+            results.append((False, {'non_field_errors': ['Expected an object.']}))
+            continue
+        if '_parse_error' in row:
+            results.append((False, {'non_field_errors': [row['_parse_error']]}))
+            continue
+        try:
+            validated_data = serializer.run_validation({
+                'name': row.get('name'),
+                'date_of_birth': row.get('date_of_birth'),
+                'contact_info': row.get('contact_info') or '',
+            })
+        except serializers.ValidationError as exc:
+            # Plain data only, so results pickle cleanly across processes
+            results.append((False, json.loads(json.dumps(exc.detail))))
+            continue
+        results.append((True, (dict(validated_data), program_names_of(row))))
+    return results
+
+
+def _init_worker():
+    """Make sure Django is configured in spawned (non-forked) workers."""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Import clients and their enrollments from a CSV or NDJSON file "
+        "(optionally .gz), streaming it in batches so files larger than RAM work."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin.")
+        parser.add_argument(
+            '--format', choices=['csv', 'ndjson'],
+            help='Input format (default: guessed from the file extension).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.AFIYA_BULK_BATCH_SIZE,
+            help='Rows validated and inserted per batch / transaction.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=0,
+            help='Parse/validate batches in this many worker processes (0 = in-process).',
+        )
+        parser.add_argument(
+            '--create-programs', action='store_true',
+            help='Create programs that do not exist yet instead of rejecting the row.',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Name under which the number of committed input rows is recorded in the database.',
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Skip the rows already committed according to --checkpoint.',
+        )
+        parser.add_argument(
+            '--skip', type=int, default=0,
+            help='Skip this many input rows before importing.',
+        )
+        parser.add_argument(
+            '--error-file',
+            help='Write rejected rows here as NDJSON ({"row", "errors"}) instead of stderr.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or FORMATS.get(Path(path.removesuffix('.gz')).suffix.lower())
+        if not input_format:
+            raise CommandError('Cannot guess the input format; pass --format csv|ndjson.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        offset = options['skip']
+        checkpoint = options['checkpoint']
+        if options['resume']:
+            if not checkpoint:
+                raise CommandError('--resume needs --checkpoint.')
+            recorded = ImportCheckpoint.objects.filter(name=checkpoint).first()
+            if recorded is not None:
+                offset = recorded.rows
+                self.stdout.write(f'Resuming after {offset} rows.')
+
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.create_programs = options['create_programs']
+        self.program_ids = dict(Program.objects.values_list('name', 'id'))
+        self.error_file = open(options['error_file'], 'a', encoding='utf-8') if options['error_file'] else None
+        self.created = self.rejected = 0
+
+        started = time.perf_counter()
+        processed = offset
+        try:
+            with open_input(path) as handle:
+                rows = islice(iter_rows(handle, input_format), offset, None)
+                for batch_start, results in self.validated_batches(rows, offset, options['workers']):
+                    self.save_batch(batch_start, results, checkpoint, path)
+                    processed = batch_start + len(results)
+                    self.report(processed - offset, started)
+        finally:
+            if self.error_file:
+                self.error_file.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.created} clients ({self.rejected} rejected) from '
+            f'{processed - offset} rows in {elapsed:.1f}s '
+            f'({(processed - offset) / elapsed if elapsed else 0:.0f} rows/s).'
+        ))
+
+    def validated_batches(self, rows, offset, workers):
+        """
+        Yield (first_row_number, validation results) per batch, in input order.
+        With workers, a bounded number of batches is in flight at once so
+        memory stays flat however large the file is.
+        """
+        batches = chunked(rows, self.batch_size)
+        position = offset
+        if workers <= 0:
+            for batch in batches:
+                yield position, validate_chunk(batch)
+                position += len(batch)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            in_flight = deque()
+            for batch in batches:
+                in_flight.append((len(batch), executor.submit(validate_chunk, batch)))
+                if len(in_flight) >= workers * 2:
+                    size, future = in_flight.popleft()
+                    yield position, future.result()
+                    position += size
+            while in_flight:
+                size, future = in_flight.popleft()
+                yield position, future.result()
+                position += size
+
+    def resolve_programs(self, names, program_ids):
+        """
+        Map program names to ids via `program_ids`, a ChainMap over the
+        preloaded dict; None if any is unknown. Programs created here land in
+        its first map, which the caller merges only once the batch commits.
+        """
+        missing = [name for name in names if name not in program_ids]
+        if missing and not self.create_programs:
+            return None, missing
+        for name in missing:
+            program_ids[name] = Program.objects.get_or_create(name=name)[0].pk
+        return [program_ids[name] for name in names], []
+
+    def save_batch(self, batch_start, results, checkpoint=None, path=None):
+        pending = []
+        known = ChainMap({}, self.program_ids)
+        with transaction.atomic():
+            # A rolled-back batch takes its new programs with it: don't cache their ids
+            transaction.on_commit(lambda: self.program_ids.update(known.maps[0]))
+            for row_number, (ok, payload) in enumerate(results, start=batch_start + 1):
+                if not ok:
+                    self.reject(row_number, payload)
+                    continue
+                validated_data, names = payload
+                program_ids, missing = self.resolve_programs(names, known)
+                if program_ids is None:
+                    self.reject(row_number, {
+                        'enrolled_programs': [f"Program '{name}' not found." for name in missing]
+                    })
+                    continue
+                pending.append((Client(**validated_data), program_ids))
+            if pending:
+                insert_clients(pending, self.batch_size)
+            if checkpoint:
+                # Committed with the batch, so --resume neither repeats nor skips rows
+                ImportCheckpoint.objects.update_or_create(
+                    name=checkpoint, defaults={'path': path, 'rows': batch_start + len(results)},
+                )
+        self.created += len(pending)
+
+    def reject(self, row_number, errors):
+        self.rejected += 1
+        line = json.dumps({'row': row_number, 'errors': errors})
+        if self.error_file:
+            self.error_file.write(line + '\n')
+        else:
+            self.stderr.write(line)
+
+    def report(self, rows, started):
+        if self.verbosity < 1:
+            return
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'  {rows} rows ({self.created} created, {self.rejected} rejected), '
+            f'{rows / elapsed if elapsed else 0:.0f} rows/s'
+        )
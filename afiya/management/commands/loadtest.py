@@ -0,0 +1,331 @@
+#@juma_samwel
+import datetime
+import http.client
+import json
+import platform
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client as TestClient
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from afiya.benchmarking import latency_ms
+from afiya.bulk import chunked, insert_clients
+from afiya.models import Client, Program
+
+SCENARIOS = ('list', 'search', 'retrieve', 'enroll', 'login', 'programs')
+PERCENTILES = (50, 90, 95, 99)
+NAME_PREFIX = 'Loadtest'
+
+
+class InProcessTarget:
+    """Requests through Django's test client, one per worker thread."""
+    label = 'in-process'
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            # Count server errors (e.g. SQLite lock timeouts) instead of raising them
+            client = self.local.client = TestClient(headers=self.headers, raise_request_exception=False)
+        content = json.dumps(body) if body is not None else ''
+        return client.generic(method, path, content, content_type='application/json').status_code
+
+
+class HTTPTarget:
+    """Requests over HTTP to a running server, one keep-alive connection per worker thread."""
+
+    def __init__(self, url, headers):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise CommandError(f'--url must be an http(s) URL, got {url!r}')
+        self.label = url
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.headers = {key.title(): value for key, value in headers.items()}
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        headers = dict(self.headers)
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        for attempt in (1, 2):
+            conn = getattr(self.local, 'connection', None)
+            if conn is None:
+                conn = self.local.connection = self.connection_class(self.netloc, timeout=30)
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                return response.status
+            except (ConnectionError, http.client.HTTPException):
+                # The server closed an idle keep-alive connection; reconnect once
+                conn.close()
+                self.local.connection = None
+                if attempt == 2:
+                    raise
+
+
+def summarize(latencies, statuses, elapsed):
+    """
+    Report on the requests that were served; throttled ones (429) answer
+    without doing the work, so they are only counted.
+    """
+    if not latencies:
+        raise CommandError('Every request was throttled (429); raise the rates on the server under test.')
+    errors = sum(count for status, count in statuses.items() if status >= 400 and status != 429)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throttled': statuses.get(429, 0),
+        'status': {str(status): count for status, count in sorted(statuses.items())},
+        'elapsed_s': round(elapsed, 3),
+        'req_per_sec': round(len(latencies) / elapsed, 1),
+        'latency_ms': {key: round(value, 2) for key, value in latency_ms(latencies, PERCENTILES).items()},
+    }
+
+
+def percent_change(new, old):
+    return (new - old) / old * 100 if old else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the API: seed a dataset of clients, programs and enrollments, "
+        "drive the list, search, retrieve, enroll, login and program-list routes "
+        "concurrently, and report req/s and latency percentiles as JSON. Runs "
+        "in-process by default, or against a running server with --url (which "
+        "must use the same database, since the dataset is seeded from here). "
+        "The seeded data and the temporary user are removed afterwards unless --keep."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10000, help='Clients to seed.')
+        parser.add_argument('--programs', type=int, default=20, help='Programs to seed.')
+        parser.add_argument(
+            '--enrollments', type=float, default=2.0,
+            help='Mean programs per seeded client (enrollment density).',
+        )
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per seeding INSERT.')
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded dataset in place.')
+        parser.add_argument(
+            '--scenario', action='append', choices=SCENARIOS,
+            help='Scenario(s) to run (default: all).',
+        )
+        parser.add_argument('--requests', type=int, default=500, help='Measured requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario first.')
+        parser.add_argument('--concurrency', type=int, default=10, help='Requests in flight at once.')
+        parser.add_argument('--url', help='Base URL of a running server, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--random-seed', type=int, default=0, help='Seed for the dataset and request mix.')
+        parser.add_argument('--output', help="Write the JSON report here ('-' for stdout instead of the table).")
+        parser.add_argument('--baseline', help='A previous JSON report to compare against.')
+        parser.add_argument(
+            '--max-regression', type=float,
+            help='With --baseline, fail if any scenario loses more than this %% of req/s or p95 grows by more.',
+        )
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['programs'] < 1:
+            raise CommandError('--clients and --programs must be at least 1.')
+        baseline = self.load_baseline(options['baseline'])
+        self.rng = random.Random(options['random_seed'])
+        self.quiet = options['output'] == '-'
+        self.run_id = uuid.uuid4().hex[:8]
+
+        password = uuid.uuid4().hex
+        user = User.objects.create_user(username=f'loadtest-{self.run_id}', password=password)
+        token = Token.objects.create(user=user)
+        headers = {'authorization': f'Token {token.key}'}
+        self.login_body = {'username': user.username, 'password': password}
+        try:
+            self.seed(options)
+            if options['url']:
+                target = HTTPTarget(options['url'], headers)
+                results = self.run(target, options)
+            else:
+                target = InProcessTarget(headers)
+                # The in-process test client sends Host: testserver, and every
+                # login comes from one user and one address: lift the login throttles
+                rates = {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'login_username': None, 'login_ip': None}
+                with override_settings(
+                    ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                    REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates},
+                ):
+                    results = self.run(target, options)
+        finally:
+            if not options['keep']:
+                self.cleanup()
+            user.delete()
+
+        report = {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'target': target.label,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'dataset': {
+                'clients': options['clients'],
+                'programs': options['programs'],
+                'enrollments_per_client': options['enrollments'],
+            },
+            'concurrency': options['concurrency'],
+            'scenarios': results,
+        }
+        self.write_report(report, options['output'])
+        if baseline is not None:
+            self.compare(report, baseline, options['max_regression'])
+
+    def log(self, message):
+        if not self.quiet:
+            self.stdout.write(message)
+
+    def load_baseline(self, path):
+        if not path:
+            return None
+        try:
+            with open(path, encoding='utf-8') as handle:
+                return json.load(handle)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read baseline {path}: {exc}')
+
+    def seed(self, options):
+        """Bulk-insert the dataset through the same path as bulk registration (signals, stats, index)."""
+        started = time.perf_counter()
+        prefix = f'{NAME_PREFIX} {self.run_id}'
+        self.programs = [
+            Program.objects.create(name=f'{prefix} Program {number:04d}').pk
+            for number in range(options['programs'])
+        ]
+        whole, fraction = divmod(options['enrollments'], 1)
+        born = datetime.date(1940, 1, 1)
+        self.clients = []
+        for numbers in chunked(range(options['clients']), options['batch_size']):
+            pending = []
+            for number in numbers:
+                count = min(len(self.programs), int(whole) + (self.rng.random() < fraction))
+                pending.append((
+                    Client(
+                        name=f'{prefix} Client {number:07d}',
+                        date_of_birth=born + datetime.timedelta(days=self.rng.randrange(30000)),
+                        contact_info=f'07{self.rng.randrange(10 ** 8):08d}',
+                    ),
+                    self.rng.sample(self.programs, count),
+                ))
+            with transaction.atomic():
+                self.clients.extend(client.pk for client in insert_clients(pending, options['batch_size']))
+        if len(self.clients) != options['clients']:
+            # Backends without bulk RETURNING leave unenrolled clients without ids
+            self.clients = list(Client.objects.filter(name__startswith=prefix).values_list('pk', flat=True))
+        self.log(
+            f"Seeded {options['clients']} clients, {options['programs']} programs "
+            f"({options['enrollments']} enrollments/client) in {time.perf_counter() - started:.1f}s"
+        )
+
+    def cleanup(self):
+        prefix = f'{NAME_PREFIX} {self.run_id}'
+        # Programs first: their enrollments and counters go with them, so deleting clients is cheap
+        for program in Program.objects.filter(name__startswith=prefix):
+            program.delete()
+        for ids in chunked(Client.objects.filter(name__startswith=prefix).values_list('pk', flat=True), 1000):
+            Client.objects.filter(pk__in=ids).delete()
+
+    def requests_for(self, scenario):
+        """A callable returning (method, path, body) for one request of `scenario`."""
+        rng = random.Random(self.rng.random())
+        lock = threading.Lock()
+
+        def pick(sequence):
+            with lock:
+                return rng.choice(sequence)
+
+        prefix = f'{NAME_PREFIX} {self.run_id}'
+        numbers = range(len(self.clients))
+        return {
+            'list': lambda: ('GET', '/afiya/clients/?page_size=50', None),
+            # One seeded client's full name: a selective search, as a user looking someone up
+            'search': lambda: (
+                'GET', '/afiya/clients/search/?' + urlencode({'q': f'{prefix} Client {pick(numbers):07d}'}), None,
+            ),
+            'retrieve': lambda: ('GET', f'/afiya/clients/{pick(self.clients)}/', None),
+            'enroll': lambda: (
+                'POST', f'/afiya/clients/{pick(self.clients)}/enroll/', {'program_id': pick(self.programs)},
+            ),
+            'login': lambda: ('POST', '/afiya/login/', self.login_body),
+            'programs': lambda: ('GET', '/afiya/programs/', None),
+        }[scenario]
+
+    def run(self, target, options):
+        self.log(f"{options['requests']} requests per scenario, concurrency {options['concurrency']}, {target.label}")
+        results = {}
+        for scenario in options['scenario'] or SCENARIOS:
+            next_request = self.requests_for(scenario)
+
+            def one(_):
+                method, path, body = next_request()
+                started = time.perf_counter()
+                status = target.request(method, path, body)
+                return time.perf_counter() - started, status
+
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                list(executor.map(one, range(options['warmup'])))
+                started = time.perf_counter()
+                timings = list(executor.map(one, range(options['requests'])))
+                elapsed = time.perf_counter() - started
+            statuses = Counter(status for _, status in timings)
+            served = [latency for latency, status in timings if status != 429]
+            results[scenario] = summarize(served, statuses, elapsed)
+            self.report(scenario, results[scenario])
+            if statuses.get(429):
+                self.log(
+                    f'  ({statuses[429]} throttled, left out of the figures: raise '
+                    'AFIYA_LOGIN_USERNAME_RATE / AFIYA_LOGIN_IP_RATE on the server under test)'
+                )
+        return results
+
+    def report(self, scenario, result):
+        latency = result['latency_ms']
+        self.log(
+            f"{scenario:>9}: {result['req_per_sec']:8.1f} req/s  p50 {latency['p50']:7.2f}  "
+            f"p95 {latency['p95']:7.2f}  p99 {latency['p99']:7.2f} ms  errors {result['errors']}"
+        )
+
+    def write_report(self, report, output):
+        text = json.dumps(report, indent=2) + '\n'
+        if output == '-':
+            self.stdout.write(text, ending='')
+        elif output:
+            with open(output, 'w', encoding='utf-8') as handle:
+                handle.write(text)
+            self.log(f'Wrote {output}')
+
+    def compare(self, report, baseline, max_regression):
+        regressions = []
+        self.log(f"Compared with baseline from {baseline.get('created', '?')} ({baseline.get('target', '?')}):")
+        for scenario, result in report['scenarios'].items():
+            before = baseline.get('scenarios', {}).get(scenario)
+            if before is None:
+                self.log(f'{scenario:>9}: not in baseline')
+                continue
+            rate = percent_change(result['req_per_sec'], before['req_per_sec'])
+            p95 = percent_change(result['latency_ms']['p95'], before['latency_ms']['p95'])
+            self.log(f'{scenario:>9}: req/s {rate:+7.1f}%  p95 {p95:+7.1f}%')
+            if max_regression is not None and (-rate > max_regression or p95 > max_regression):
+                regressions.append(scenario)
+        if regressions:
+            raise CommandError(f"Regressed by more than {max_regression}%: {', '.join(regressions)}")
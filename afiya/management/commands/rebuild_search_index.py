@@ -0,0 +1,37 @@
+#@juma_samwel
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from afiya.search import install_search_index, uninstall_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Build or rebuild the client search index "
+        "(pg_trgm GIN indexes on PostgreSQL, the FTS5 shadow table on SQLite)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database alias to index (default: "default").',
+        )
+        parser.add_argument(
+            '--drop', action='store_true',
+            help='Drop the existing index objects before building them again.',
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if options['drop']:
+            uninstall_search_index(connection)
+            self.stdout.write('Dropped existing search index.')
+
+        if not install_search_index(connection, rebuild=True):
+            raise CommandError(
+                f"Indexed search is not supported on the '{connection.vendor}' backend; "
+                "client search will fall back to icontains filtering."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Client search index rebuilt on '{connection.alias}' ({connection.vendor})."
+        ))
@@ -0,0 +1,25 @@
+#@juma_samwel
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from afiya.stats import reconcile_birth_year_counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-program enrollment counters behind /afiya/programs/stats/ "
+        "from the enrollment table. Daily new-enrollment counts have no source "
+        "to rebuild from and are left as they are."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database alias to reconcile (default: "default").',
+        )
+
+    def handle(self, *args, **options):
+        counters = reconcile_birth_year_counts(options['database'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {counters} program/birth-year counters on '{options['database']}'."
+        ))
@@ -0,0 +1,298 @@
+#@juma_samwel
+"""
+Per-endpoint request metrics, exported in Prometheus text format.
+
+MetricsMiddleware times every request and counts the database queries it
+runs (and their time) through connection.execute_wrapper, then records
+them under the endpoint that served it: the DRF view and action
+('ClientViewSet.search', 'UserLoginView.post') or the view function
+('async_views.client_list').
+
+Exported per endpoint at /afiya/_metrics:
+  afiya_http_requests_total{endpoint, status}          counter
+  afiya_http_request_duration_seconds{endpoint}        histogram
+  afiya_http_request_latency_seconds{endpoint, quantile}   p50/p95/p99 of
+      the last AFIYA_METRICS_WINDOW requests
+  afiya_db_queries_total{endpoint}                     counter
+  afiya_db_queries_per_request{endpoint, quantile}     same window
+  afiya_db_query_duration_seconds_total{endpoint}      counter
+
+Per database alias:
+  afiya_db_connections_opened_total{database}          counter; checkouts
+      from the pool when pooling (connection_created)
+  afiya_db_pool_size / _in_use / _waiting{database}    gauges, and
+  afiya_db_pool_connections_created_total{database},
+  afiya_db_pool_wait_seconds_total{database},
+  afiya_db_pool_request_errors_total{database}         counters, for
+      databases served through Django's psycopg pool (AFIYA_DB_POOL)
+
+Numbers are per process: with several workers, each serves its own.
+Streaming responses are timed until the response object is returned.
+"""
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+# Latency histogram bucket bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+UNMATCHED = 'unmatched' # Requests that never reached a view (404s, redirects from middleware)
+
+
+class QueryProbe:
+    """Counts the queries (and their time) run while installed."""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.queries += 1
+
+    @contextmanager
+    def installed(self):
+        # What connection.execute_wrapper() does, without one context manager per alias
+        installed_on = connections.all()
+        for connection in installed_on:
+            connection.execute_wrappers.append(self)
+        try:
+            yield self
+        finally:
+            for connection in installed_on:
+                connection.execute_wrappers.remove(self)
+
+
+class EndpointStats:
+    def __init__(self, window):
+        self.statuses = defaultdict(int)
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.query_duration = 0.0
+        self.recent_durations = deque(maxlen=window)
+        self.recent_queries = deque(maxlen=window)
+
+    def record(self, status, duration, queries, query_duration):
+        self.statuses[status] += 1
+        for index, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                self.buckets[index] += 1
+                break
+        self.count += 1
+        self.duration += duration
+        self.queries += queries
+        self.query_duration += query_duration
+        self.recent_durations.append(duration)
+        self.recent_queries.append(queries)
+
+
+def quantile(sorted_values, q):
+    """Nearest-rank quantile of an already sorted, non-empty list."""
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """Thread-safe store of EndpointStats by endpoint name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._connections = Counter()
+
+    def record(self, endpoint, status, duration, queries=0, query_duration=0.0):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats(settings.AFIYA_METRICS_WINDOW)
+            stats.record(status, duration, queries, query_duration)
+
+    def record_connection(self, alias):
+        with self._lock:
+            self._connections[alias] += 1
+
+    def connections_opened(self):
+        """{database alias: connections opened so far}."""
+        with self._lock:
+            return dict(self._connections)
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._connections.clear()
+
+    def snapshot(self):
+        """{endpoint: EndpointStats copy}, safe to read without the lock."""
+        with self._lock:
+            snapshot = {}
+            for endpoint, stats in self._endpoints.items():
+                copy = EndpointStats(stats.recent_durations.maxlen)
+                copy.__dict__.update(stats.__dict__)
+                copy.statuses = dict(stats.statuses)
+                copy.buckets = list(stats.buckets)
+                copy.recent_durations = sorted(stats.recent_durations)
+                copy.recent_queries = sorted(stats.recent_queries)
+                snapshot[endpoint] = copy
+            return snapshot
+
+    def render(self):
+        """All metrics in Prometheus text exposition format (version 0.0.4)."""
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        family('afiya_http_requests_total', 'counter', 'Requests served, by endpoint and status code.')
+        for endpoint, stats in snapshot:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f'afiya_http_requests_total{{endpoint="{escape_label(endpoint)}",status="{status}"}} {count}')
+
+        family('afiya_http_request_duration_seconds', 'histogram', 'Request latency.')
+        for endpoint, stats in snapshot:
+            label = f'endpoint="{escape_label(endpoint)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'afiya_http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'afiya_http_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats.count}')
+            lines.append(f'afiya_http_request_duration_seconds_sum{{{label}}} {stats.duration:.6f}')
+            lines.append(f'afiya_http_request_duration_seconds_count{{{label}}} {stats.count}')
+
+        family('afiya_http_request_latency_seconds', 'summary', 'Request latency quantiles over recent requests.')
+        for endpoint, stats in snapshot:
+            label = f'endpoint="{escape_label(endpoint)}"'
+            for q in QUANTILES:
+                lines.append(
+                    f'afiya_http_request_latency_seconds{{{label},quantile="{q}"}} '
+                    f'{quantile(stats.recent_durations, q):.6f}'
+                )
+            lines.append(f'afiya_http_request_latency_seconds_sum{{{label}}} {sum(stats.recent_durations):.6f}')
+            lines.append(f'afiya_http_request_latency_seconds_count{{{label}}} {len(stats.recent_durations)}')
+
+        family('afiya_db_queries_total', 'counter', 'Database queries run while serving requests.')
+        for endpoint, stats in snapshot:
+            lines.append(f'afiya_db_queries_total{{endpoint="{escape_label(endpoint)}"}} {stats.queries}')
+
+        family('afiya_db_queries_per_request', 'summary', 'Database queries per request, over recent requests.')
+        for endpoint, stats in snapshot:
+            label = f'endpoint="{escape_label(endpoint)}"'
+            for q in QUANTILES:
+                lines.append(f'afiya_db_queries_per_request{{{label},quantile="{q}"}} {quantile(stats.recent_queries, q)}')
+            lines.append(f'afiya_db_queries_per_request_sum{{{label}}} {sum(stats.recent_queries)}')
+            lines.append(f'afiya_db_queries_per_request_count{{{label}}} {len(stats.recent_queries)}')
+
+        family('afiya_db_query_duration_seconds_total', 'counter', 'Time spent in database queries.')
+        for endpoint, stats in snapshot:
+            lines.append(
+                f'afiya_db_query_duration_seconds_total{{endpoint="{escape_label(endpoint)}"}} {stats.query_duration:.6f}'
+            )
+
+        family('afiya_db_connections_opened_total', 'counter', 'Database connections opened (pool checkouts when pooled).')
+        for alias, count in sorted(self.connections_opened().items()):
+            lines.append(f'afiya_db_connections_opened_total{{database="{escape_label(alias)}"}} {count}')
+
+        pools = sorted(pool_stats().items())
+        for name, kind, help_text, value in POOL_METRICS:
+            family(name, kind, help_text)
+            for alias, stats in pools:
+                number = value(stats)
+                number = f'{number:.6f}' if isinstance(number, float) else number
+                lines.append(f'{name}{{database="{escape_label(alias)}"}} {number}')
+        return '\n'.join(lines) + '\n'
+
+
+# (name, type, help, value from psycopg_pool's get_stats()); counters are absent until non-zero
+POOL_METRICS = (
+    ('afiya_db_pool_size', 'gauge', 'Connections held by the pool.',
+     lambda stats: stats.get('pool_size', 0)),
+    ('afiya_db_pool_in_use', 'gauge', 'Pool connections checked out.',
+     lambda stats: stats.get('pool_size', 0) - stats.get('pool_available', 0)),
+    ('afiya_db_pool_waiting', 'gauge', 'Requests waiting for a pool connection.',
+     lambda stats: stats.get('requests_waiting', 0)),
+    ('afiya_db_pool_connections_created_total', 'counter', 'Connections the pool has opened to the database.',
+     lambda stats: stats.get('connections_num', 0)),
+    ('afiya_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pool connection.',
+     lambda stats: stats.get('requests_wait_ms', 0) / 1000),
+    ('afiya_db_pool_request_errors_total', 'counter', 'Pool checkouts that failed (timeout or queue full).',
+     lambda stats: stats.get('requests_errors', 0)),
+)
+
+
+def pool_stats():
+    """{database alias: psycopg_pool stats} for the databases using Django's connection pool."""
+    return {
+        alias: connections[alias].pool.get_stats()
+        for alias in connections
+        if connections[alias].settings_dict.get('OPTIONS', {}).get('pool')
+    }
+
+
+registry = MetricsRegistry()
+
+
+def endpoint_name(view_func, method):
+    """'ViewSet.action', 'APIView.method' or 'module.function' for a resolved view."""
+    cls = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if cls is not None:
+        actions = getattr(view_func, 'actions', None) or {}
+        return f'{cls.__name__}.{actions.get(method.lower(), method.lower())}'
+    module = getattr(view_func, '__module__', '').rsplit('.', 1)[-1]
+    return f'{module}.{getattr(view_func, "__name__", type(view_func).__name__)}'
+
+
+class MetricsMiddleware:
+    """
+    Record latency, status and database work for every request in `registry`.
+    Works under WSGI and ASGI; AFIYA_METRICS_ENABLED=False turns it into a pass-through.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.AFIYA_METRICS_ENABLED:
+            return self.get_response(request)
+        started = time.perf_counter()
+        with QueryProbe().installed() as probe:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, probe)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.AFIYA_METRICS_ENABLED:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with QueryProbe().installed() as probe:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, probe)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.afiya_endpoint = endpoint_name(view_func, request.method)
+
+    def record(self, request, response, duration, probe):
+        endpoint = getattr(request, 'afiya_endpoint', UNMATCHED)
+        registry.record(endpoint, response.status_code, duration, probe.queries, probe.duration)
@@ -0,0 +1,25 @@
+# Search index for Client.name / Client.contact_info (see afiya/search.py).
+# PostgreSQL gets pg_trgm GIN indexes, SQLite an FTS5 shadow table with triggers.
+
+from django.db import migrations
+
+from afiya.search import install_search_index, uninstall_search_index
+
+
+def install(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afiya', '0003_doctor'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
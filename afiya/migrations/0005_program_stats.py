@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-18 10:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+
+def backfill_birth_year_counts(apps, schema_editor):
+    """Seed the counters from existing enrollments (same query as reconcile_program_stats)."""
+    Client = apps.get_model('afiya', 'Client')
+    ProgramBirthYearCount = apps.get_model('afiya', 'ProgramBirthYearCount')
+    using = schema_editor.connection.alias
+    rows = (
+        Client.enrolled_programs.through.objects.using(using)
+        .annotate(year=ExtractYear('client__date_of_birth'))
+        .order_by().values('program_id', 'year').annotate(clients=Count('pk'))
+        .values_list('program_id', 'year', 'clients')
+    )
+    ProgramBirthYearCount.objects.using(using).bulk_create(
+        ProgramBirthYearCount(program_id=program_id, birth_year=year, count=clients)
+        for program_id, year, clients in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afiya', '0004_client_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgramBirthYearCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('birth_year', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('program', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='birth_year_counts', to='afiya.program')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('program', 'birth_year'), name='unique_program_birth_year')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProgramDailyEnrollment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('program', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_enrollments', to='afiya.program')),
+            ],
+            options={
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('program', 'date'), name='unique_program_enrollment_date')],
+            },
+        ),
+        migrations.RunPython(backfill_birth_year_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 10:59
+
+from django.db import migrations, models
+
+from afiya.search import install_search_index
+
+
+def reinstall_search_index(apps, schema_editor):
+    # SQLite adds the column by rebuilding afiya_client, which drops the FTS
+    # triggers with the old table; put them back and resync the index.
+    connection = schema_editor.connection
+    install_search_index(connection, rebuild=connection.vendor == 'sqlite')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afiya', '0005_program_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Last change to the client or its enrollments (drives ETag/Last-Modified).'),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afiya', '0006_client_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['name', 'id'], name='afiya_client_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['date_of_birth'], name='afiya_client_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['contact_info'], name='afiya_client_contact_idx'),
+        ),
+    ]
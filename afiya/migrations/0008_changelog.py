@@ -0,0 +1,53 @@
+# Generated by Django 5.2 on 2026-10-18 12:12
+
+from django.db import migrations, models
+
+
+def backfill_change_log(apps, schema_editor):
+    """
+    Log every existing program, client and enrollment as saved, so a sync
+    from token 0 returns the whole dataset. One INSERT ... SELECT per table.
+    """
+    Client = apps.get_model('afiya', 'Client')
+    Program = apps.get_model('afiya', 'Program')
+    ChangeLog = apps.get_model('afiya', 'ChangeLog')
+    Enrollment = Client.enrolled_programs.through
+    quote = schema_editor.connection.ops.quote_name
+    sources = [
+        ('program', quote('id'), '0', Program._meta.db_table),
+        ('client', quote('id'), '0', Client._meta.db_table),
+        ('enrollment', quote('client_id'), quote('program_id'), Enrollment._meta.db_table),
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        for kind, object_id, related_id, table in sources:
+            cursor.execute(
+                f"INSERT INTO {quote(ChangeLog._meta.db_table)} "
+                f"({quote('kind')}, {quote('object_id')}, {quote('related_id')}, {quote('action')}, {quote('changed_at')}) "
+                f"SELECT %s, {object_id}, {related_id}, 'saved', CURRENT_TIMESTAMP FROM {quote(table)} ORDER BY {object_id}",
+                [kind],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afiya', '0007_client_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('client', 'Client'), ('program', 'Program'), ('enrollment', 'Enrollment')], max_length=10)),
+                ('object_id', models.BigIntegerField(help_text='Client or program id; the client id for enrollments.')),
+                ('related_id', models.BigIntegerField(default=0, help_text='The program id for enrollments, 0 otherwise.')),
+                ('action', models.CharField(choices=[('saved', 'Saved'), ('deleted', 'Deleted')], max_length=7)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id', 'related_id'], name='afiya_changelog_object_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_change_log, migrations.RunPython.noop),
+    ]
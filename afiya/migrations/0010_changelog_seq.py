@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 13:35
+# Sync tokens move from ChangeLog.id to seq, numbered at commit (see afiya/changelog.py).
+
+from django.db import migrations, models
+from django.db.models import F
+
+from afiya.changelog import install_numbering, uninstall_numbering
+
+
+def number_existing(apps, schema_editor):
+    """Existing entries keep their id as seq, so tokens already handed out stay valid."""
+    ChangeLog = apps.get_model('afiya', 'ChangeLog')
+    ChangeLog.objects.using(schema_editor.connection.alias).update(seq=F('id'))
+    install_numbering(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    uninstall_numbering(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afiya', '0009_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelog',
+            name='seq',
+            field=models.BigIntegerField(help_text='Sync token; set when the writing transaction commits (NULL until then).', null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(condition=models.Q(('seq__isnull', True)), fields=['id'], name='afiya_changelog_pending_idx'),
+        ),
+        migrations.RunPython(number_existing, uninstall),
+    ]
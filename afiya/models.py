@@ -1,8 +1,22 @@
 # @JUMA_SAMWEL
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
 
-class Program(models.Model):
+class ChangeTrackedModel(models.Model):
+    """
+    Saves run in one transaction with their post_save receivers, so the
+    change log entry (afiya/changelog.py) commits or rolls back with the row.
+    Deletes already do: the deletion collector wraps its signals.
+    """
+    def save(self, *args, using=None, **kwargs):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, using=using, **kwargs)
+
+    class Meta:
+        abstract = True
+
+class Program(ChangeTrackedModel):
     """
     Represents a health program offered (e.g., TB, HIV, Malaria).
     """
@@ -19,7 +33,7 @@ class Program(models.Model):
     class Meta:
         ordering = ['name'] # Keep programs ordered alphabetically by default
 
-class Client(models.Model):
+class Client(ChangeTrackedModel):
     """
     Represents a client registered in the health system.
     """
@@ -42,14 +56,136 @@ class Client(models.Model):
         blank=True, # A client might not be enrolled in any program initially
         help_text="Programs this client is enrolled in."
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        help_text="Last change to the client or its enrollments (drives ETag/Last-Modified)."
+    )
     # Django automatically adds an 'id' primary key field
 
     def __str__(self):
         """String representation of the Client model."""
         return f"{self.name} (ID: {self.id})" 
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the stored date of birth so enrollment statistics can follow edits."""
+        instance = super().from_db(db, field_names, values)
+        if 'date_of_birth' in field_names:
+            value = values[field_names.index('date_of_birth')]
+            if value is not models.DEFERRED:
+                instance._loaded_date_of_birth = value
+        return instance
+
     class Meta:
         ordering = ['name'] 
+        indexes = [
+            # Every list, search page and admin changelist sorts by (name, id)
+            models.Index(fields=['name', 'id'], name='afiya_client_name_id_idx'),
+            # Age (date of birth) range filters
+            models.Index(fields=['date_of_birth'], name='afiya_client_dob_idx'),
+            # Exact contact lookups; substring search uses the index in afiya/search.py
+            models.Index(fields=['contact_info'], name='afiya_client_contact_idx'),
+        ]
+
+class ProgramBirthYearCount(models.Model):
+    """
+    Denormalized count of clients enrolled in a program, per birth year.
+    Maintained incrementally from enrollment signals (see afiya/stats.py) so
+    program statistics never have to scan clients.
+    """
+    program = models.ForeignKey(
+        Program,
+        on_delete=models.CASCADE,
+        related_name='birth_year_counts'
+    )
+    birth_year = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.program} / {self.birth_year}: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['program', 'birth_year'], name='unique_program_birth_year'),
+        ]
+
+class ProgramDailyEnrollment(models.Model):
+    """
+    Number of new enrollments into a program on a given day.
+    """
+    program = models.ForeignKey(
+        Program,
+        on_delete=models.CASCADE,
+        related_name='daily_enrollments'
+    )
+    date = models.DateField()
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.program} / {self.date}: {self.count}"
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['program', 'date'], name='unique_program_enrollment_date'),
+        ]
+
+class ChangeLog(models.Model):
+    """
+    One row per change to a client, program or enrollment, written by signal
+    receivers in the same transaction as the change. `seq` is the monotonic
+    token the sync API (/afiya/sync/) hands out, assigned in commit order;
+    see afiya/changelog.py.
+    """
+    CLIENT = 'client'
+    PROGRAM = 'program'
+    ENROLLMENT = 'enrollment'
+    KIND_CHOICES = [(CLIENT, 'Client'), (PROGRAM, 'Program'), (ENROLLMENT, 'Enrollment')]
+
+    SAVED = 'saved'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [(SAVED, 'Saved'), (DELETED, 'Deleted')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField(
+        help_text="Client or program id; the client id for enrollments."
+    )
+    related_id = models.BigIntegerField(
+        default=0,
+        help_text="The program id for enrollments, 0 otherwise."
+    )
+    action = models.CharField(max_length=7, choices=ACTION_CHOICES)
+    changed_at = models.DateTimeField(auto_now_add=True)
+    seq = models.BigIntegerField(
+        null=True, unique=True,
+        help_text="Sync token; set when the writing transaction commits (NULL until then)."
+    )
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind} {self.object_id}/{self.related_id} {self.action}"
+
+    class Meta:
+        indexes = [
+            # compact_changelog finds superseded entries per object
+            models.Index(fields=['kind', 'object_id', 'related_id'], name='afiya_changelog_object_idx'),
+            # Entries still waiting for their seq: only the writing transaction's own
+            models.Index(fields=['id'], condition=models.Q(seq__isnull=True), name='afiya_changelog_pending_idx'),
+        ]
+
+class ImportCheckpoint(models.Model):
+    """
+    Progress of a resumable `import_clients` run: the number of input rows
+    handled so far, written in the same transaction as each batch, so a crash
+    can never leave it ahead of or behind the committed clients.
+    """
+    name = models.CharField(max_length=255, unique=True, help_text="The --checkpoint name.")
+    path = models.TextField(help_text="The input being imported.")
+    rows = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.rows} rows of {self.path}"
 
 class Doctor(User):
     """
@@ -0,0 +1,225 @@
+#@juma_samwel
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def keyset_filter(ordering, position):
+    """
+    Build the "rows strictly after `position`" predicate for an ordering tuple.
+
+    For ordering (a, b) and position (x, y) this is
+    a >= x AND (a > x OR (a = x AND b > y)), with comparisons flipped for
+    descending ('-field') entries. The leading bound lets the database seek
+    straight into an index on the first column instead of scanning.
+    """
+    after = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clause = Q(**{f'{name}__{lookup}': position[index]})
+        for previous_field, value in zip(ordering[:index], position):
+            clause &= Q(**{previous_field.lstrip('-'): value})
+        after |= clause
+
+    first = ordering[0]
+    lead_lookup = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{lead_lookup}': position[0]}) & after
+
+
+def reverse_ordering(ordering):
+    """Flip the direction of every field in an ordering tuple."""
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+def get_position(item, ordering):
+    """Read the keyset position of a model instance or a .values() row."""
+    names = [field.lstrip('-') for field in ordering]
+    if isinstance(item, dict):
+        return [item[name] for name in names]
+    return [getattr(item, name) for name in names]
+
+
+def encode_cursor(position, reverse=False):
+    """Encode a keyset position as an opaque, URL-safe cursor string."""
+    payload = {'p': position}
+    if reverse:
+        payload['r'] = 1
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(encoded, ordering):
+    """
+    Decode a cursor produced by `encode_cursor`.
+    Returns (reverse, position) or raises ValueError if it is malformed.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError) as exc:
+        raise ValueError('Malformed cursor') from exc
+    if not isinstance(payload, dict):
+        raise ValueError('Malformed cursor')
+    position = payload.get('p')
+    if not isinstance(position, list) or len(position) != len(ordering):
+        raise ValueError('Malformed cursor')
+    return bool(payload.get('r')), position
+
+
+def clean_position(queryset, ordering, position):
+    """
+    Convert the raw JSON values of a decoded position with each ordering
+    field's to_python(), so a tampered cursor cannot reach the query as the
+    wrong type. Raises ValueError if a value does not fit its field.
+    """
+    cleaned = []
+    for field, value in zip(ordering, position):
+        if isinstance(value, (dict, list)): # CharField.to_python() would str() them
+            raise ValueError('Malformed cursor')
+        name = field.lstrip('-')
+        if name in queryset.query.annotations:
+            model_field = queryset.query.annotations[name].output_field
+        else:
+            try:
+                model_field = queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                model_field = queryset.model._meta.pk # 'pk'
+        try:
+            value = model_field.to_python(value)
+        except (TypeError, ValidationError) as exc:
+            raise ValueError('Malformed cursor') from exc
+        if value is None: # Ordering columns are never NULL
+            raise ValueError('Malformed cursor')
+        cleaned.append(value)
+    return cleaned
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Opaque cursor pagination keyed on a unique ordering tuple (keyset / seek
+    pagination). Each page is fetched with an index-friendly WHERE clause
+    instead of an OFFSET, so page latency stays flat however deep you go.
+
+    Views may override the ordering with a `keyset_ordering` attribute; the
+    last entry must be unique (normally 'id') so positions never tie.
+    """
+    ordering = ('id',)
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'keyset_ordering', None) or self.ordering)
+
+    def get_page_size(self, request):
+        page_size = self.page_size
+        if self.page_size_query_param:
+            try:
+                requested = int(request.query_params[self.page_size_query_param])
+            except (KeyError, ValueError):
+                requested = None
+            if requested and requested > 0:
+                page_size = requested
+        return min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request, view)))
+
+    def page_queryset(self, queryset, request, view=None):
+        """
+        Order and filter the queryset for the requested page, sliced to one
+        extra row (which tells whether another page follows). Split from
+        set_page() so async views can fetch the rows with the async ORM.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.keyset = self.get_ordering(view)
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        self.reverse, self.position = False, None
+        if encoded:
+            try:
+                self.reverse, self.position = decode_cursor(encoded, self.keyset)
+                self.position = clean_position(queryset, self.keyset, self.position)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+
+        ordering = reverse_ordering(self.keyset) if self.reverse else self.keyset
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(keyset_filter(ordering, self.position))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        """Trim the fetched rows to one page and work out the next/previous links."""
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        cursor = encode_cursor(get_position(self.page[-1], self.keyset))
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        cursor = encode_cursor(get_position(self.page[0], self.keyset), reverse=True)
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ClientCursorPagination(KeysetCursorPagination):
+    """
+    Cursor pagination for client listings, keyed on (name, id) to match
+    Client.Meta.ordering. Page sizes come from AFIYA_CLIENT_PAGE_SIZE and
+    AFIYA_CLIENT_MAX_PAGE_SIZE; clients may ask for less via ?page_size=.
+    """
+    ordering = ('name', 'id')
+
+    def get_page_size(self, request):
+        self.page_size = getattr(settings, 'AFIYA_CLIENT_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'AFIYA_CLIENT_MAX_PAGE_SIZE', 500)
+        return super().get_page_size(request)
@@ -0,0 +1,68 @@
+#@juma_samwel
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from .renderers import FastJSONRenderer, orjson
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser that decodes with orjson when it is installed (see
+    FastJSONRenderer). orjson only reads UTF-8 and never accepts NaN or
+    Infinity, so other encodings and STRICT_JSON=False use the stdlib parser.
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class NDJSONLineError:
+    """Placeholder yielded by NDJSONParser for a line that is not valid JSON."""
+
+    def __init__(self, line_number, message):
+        self.line_number = line_number
+        self.message = message
+
+    def __repr__(self):
+        return f'NDJSONLineError(line {self.line_number}: {self.message})'
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON (one object per line).
+
+    Returns a lazy generator rather than a list, so a large upload is read
+    from the request stream one line at a time. Blank lines are skipped and
+    a malformed line yields an NDJSONLineError instead of failing the whole
+    body, so callers can report it as a per-row error.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return self._iter_rows(stream, encoding)
+
+    def _iter_rows(self, stream, encoding):
+        if stream is None:
+            return
+        for line_number, raw_line in enumerate(stream, start=1):
+            line = raw_line.decode(encoding).strip() if isinstance(raw_line, bytes) else raw_line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield NDJSONLineError(line_number, str(exc))
@@ -0,0 +1,64 @@
+#@juma_samwel
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError: # Optional: FastJSONRenderer falls back to the stdlib json module
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+
+    The output is the JSON DRF's renderer would produce (compact, UTF-8, UTC
+    datetimes ending in 'Z', U+2028/U+2029 escaped); dates, datetimes and
+    UUIDs are encoded natively, anything else orjson does not know (Decimal,
+    lazy strings, timedelta) goes through DRF's encoder. Falls back to the
+    stdlib renderer when orjson is missing, when the client asks for an
+    indented response, when UNICODE_JSON or COMPACT_JSON is turned off, or
+    when orjson cannot encode the data (e.g. integers wider than 64 bits).
+    """
+    default = staticmethod(encoders.JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=self.default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same as JSONRenderer: these are valid JSON but break JavaScript string literals
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class StreamingExportRenderer(BaseRenderer):
+    """
+    Content-negotiation stand-in for export formats.
+
+    Export actions build their own StreamingHttpResponse, so these renderers
+    only exist to let DRF accept ?format=csv / ?format=ndjson. Anything that
+    does go through render() (errors such as 401/404) is emitted as JSON.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data).encode(self.charset)
+
+
+class CSVRenderer(StreamingExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONRenderer(StreamingExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
@@ -0,0 +1,149 @@
+#@juma_samwel
+"""
+Read-replica routing.
+
+Each URL in DATABASE_REPLICA_URLS becomes a database alias listed in
+AFIYA_READ_REPLICAS (see settings). ReplicaRouter sends every query to
+`default` except reads of afiya models in a request that opted in: safe
+requests (GET, HEAD, OPTIONS) to ClientViewSet and ProgramViewSet, stats
+included (ReplicaReadsMixin), and to the async views. Such a request does
+all its replica reads on one replica, picked round-robin.
+
+Replicas lag behind the primary, so reads go back to it:
+  * for the rest of a request once it has written an afiya model;
+  * for AFIYA_REPLICA_PIN_SECONDS after a request that wrote, through a
+    cookie set by ReplicaRoutingMiddleware, so a browser sees its own changes;
+  * while filling shared caches (program responses, the program directory,
+    the autocomplete index): a stale fill would outlive the lag.
+
+Users, sessions and tokens are always read from the primary, so a token
+created at login authenticates the very next request. With no replicas
+configured, everything goes to `default` as before.
+"""
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+APP_LABEL = 'afiya'
+PIN_COOKIE = 'afiya_primary'
+
+
+class RoutingState:
+    """Routing decisions for one request."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned # Read from the primary from now on
+        self.replica_reads = False # The view serves reads from a replica
+        self.replica = None # Chosen on the first replica read
+        self.wrote = False
+
+
+_state = ContextVar('afiya_routing_state', default=None)
+_round_robin = itertools.count()
+
+
+def use_replicas():
+    """Let the current request read afiya models from a replica (safe requests only)."""
+    state = _state.get()
+    if state is not None:
+        state.replica_reads = True
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, e.g. while filling a shared cache."""
+    token = _state.set(None)
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = settings.AFIYA_READ_REPLICAS
+        if state is None or not state.replica_reads or state.pinned or not replicas:
+            return None
+        if model._meta.app_label != APP_LABEL:
+            return None
+        if state.replica is None:
+            state.replica = replicas[next(_round_robin) % len(replicas)]
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label == APP_LABEL:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema through replication
+        return False if db in settings.AFIYA_READ_REPLICAS else None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Track routing per request, and pin the client to the primary for
+    AFIYA_REPLICA_PIN_SECONDS after a request that wrote. A pass-through
+    when no replicas are configured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.AFIYA_READ_REPLICAS:
+            return self.get_response(request)
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        if not settings.AFIYA_READ_REPLICAS:
+            return await self.get_response(request)
+        # Sync views run on a thread with a copy of this context: the state object is shared
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(response, state)
+
+    def pin(self, response, state):
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.AFIYA_REPLICA_PIN_SECONDS, httponly=True,
+                secure=settings.SESSION_COOKIE_SECURE, samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
+        return response
+
+
+class ReplicaReadsMixin:
+    """Serve the reads of safe requests from a read replica (see afiya/routers.py)."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            use_replicas()
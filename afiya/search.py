@@ -0,0 +1,179 @@
+#@juma_samwel
+"""
+Indexed client search on name and contact_info.
+
+PostgreSQL: pg_trgm GIN indexes on UPPER(name) / UPPER(contact_info) serve
+Django's `icontains` lookups, and matches are ranked by trigram similarity.
+
+SQLite: an external-content FTS5 table using the trigram tokenizer shadows
+afiya_client and is kept in sync by triggers (so bulk_create and raw SQL
+writes are indexed too). Ranked searches join afiya_client to a single MATCH
+on it, which yields each match's bm25 score as the rows are found, rather
+than re-running the MATCH per candidate row. Migrations that make
+SQLite rebuild afiya_client (e.g. AddField) drop the triggers and must
+reinstall the index afterwards (see 0006_client_updated_at).
+
+Other backends, and queries shorter than a trigram, fall back to a plain
+`icontains` filter. Every ranked result is annotated with `search_rank`,
+where higher is better, so callers can order by ('-search_rank', 'name', 'id').
+"""
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+
+SEARCH_ORDERING = ('-search_rank', 'name', 'id')
+MIN_TRIGRAM_LENGTH = 3
+
+SQLITE_FTS_TABLE = 'afiya_client_fts'
+
+SQLITE_INSTALL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+        name, contact_info, content='afiya_client', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS afiya_client_fts_ai AFTER INSERT ON afiya_client BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, name, contact_info)
+        VALUES (new.id, new.name, new.contact_info);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS afiya_client_fts_ad AFTER DELETE ON afiya_client BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name, contact_info)
+        VALUES ('delete', old.id, old.name, old.contact_info);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS afiya_client_fts_au AFTER UPDATE OF name, contact_info ON afiya_client BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name, contact_info)
+        VALUES ('delete', old.id, old.name, old.contact_info);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, name, contact_info)
+        VALUES (new.id, new.name, new.contact_info);
+    END""",
+]
+SQLITE_REBUILD = [f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')"]
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS afiya_client_fts_ai',
+    'DROP TRIGGER IF EXISTS afiya_client_fts_ad',
+    'DROP TRIGGER IF EXISTS afiya_client_fts_au',
+    f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}',
+]
+
+POSTGRES_INDEXES = ['afiya_client_name_trgm', 'afiya_client_contact_trgm']
+POSTGRES_INSTALL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS afiya_client_name_trgm '
+    'ON afiya_client USING gin (UPPER(name::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS afiya_client_contact_trgm '
+    'ON afiya_client USING gin (UPPER(contact_info::text) gin_trgm_ops)',
+]
+POSTGRES_REBUILD = [f'REINDEX INDEX {index}' for index in POSTGRES_INDEXES]
+POSTGRES_UNINSTALL = [f'DROP INDEX IF EXISTS {index}' for index in POSTGRES_INDEXES]
+
+# Per-database cache of "is the FTS table there?", filled on first search.
+_sqlite_fts_available = {}
+
+
+def sqlite_supports_trigram(connection):
+    """The trigram tokenizer needs SQLite 3.34+ built with FTS5."""
+    if connection.Database.sqlite_version_info < (3, 34, 0):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        options = {row[0] for row in cursor.fetchall()}
+    return 'ENABLE_FTS5' in options
+
+
+def install_search_index(connection, rebuild=False):
+    """
+    Create the search index for this connection's backend (idempotent).
+    Returns False when the backend has no indexed search support.
+    """
+    if connection.vendor == 'postgresql':
+        statements = POSTGRES_INSTALL + (POSTGRES_REBUILD if rebuild else [])
+    elif connection.vendor == 'sqlite' and sqlite_supports_trigram(connection):
+        statements = SQLITE_INSTALL + SQLITE_REBUILD
+    else:
+        return False
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    _sqlite_fts_available.pop(connection.alias, None)
+    return True
+
+
+def uninstall_search_index(connection):
+    """Drop the search index objects created by install_search_index."""
+    if connection.vendor == 'postgresql':
+        statements = POSTGRES_UNINSTALL
+    elif connection.vendor == 'sqlite':
+        statements = SQLITE_UNINSTALL
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    _sqlite_fts_available.pop(connection.alias, None)
+
+
+def _has_sqlite_fts(connection):
+    if connection.alias not in _sqlite_fts_available:
+        _sqlite_fts_available[connection.alias] = (
+            SQLITE_FTS_TABLE in connection.introspection.table_names()
+        )
+    return _sqlite_fts_available[connection.alias]
+
+
+def _fts_phrase(query):
+    """Quote the query as a single FTS5 phrase so user input is never parsed as syntax."""
+    return '"{}"'.format(query.replace('"', '""'))
+
+
+def search_clients(queryset, query, ranked=True):
+    """
+    Filter a Client queryset down to rows whose name or contact_info contains
+    `query` (case-insensitive), annotated with a `search_rank` float.
+
+    With ranked=False the rows are only filtered, not annotated; use it when
+    the rank is not needed, or to update or delete through the result (the
+    ranked SQLite query joins the FTS table, which UPDATE cannot carry).
+    """
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        matches = queryset.filter(Q(name__icontains=query) | Q(contact_info__icontains=query))
+        if not ranked:
+            return matches
+        return matches.annotate(
+            search_rank=Greatest(
+                TrigramSimilarity('name', query),
+                TrigramSimilarity('contact_info', query),
+            )
+        )
+
+    if (connection.vendor == 'sqlite' and len(query) >= MIN_TRIGRAM_LENGTH
+            and _has_sqlite_fts(connection)):
+        table = connection.ops.quote_name(queryset.model._meta.db_table)
+        pk = connection.ops.quote_name(queryset.model._meta.pk.column)
+        phrase = _fts_phrase(query)
+        if not ranked:
+            return queryset.filter(
+                pk__in=RawSQL(
+                    f'SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s',
+                    (phrase,),
+                )
+            )
+        # bm25() is only defined in a query that MATCHes the FTS table itself, so
+        # join it in: SQLite scans the matches once and seeks each client by id.
+        matches = queryset.extra(
+            tables=[SQLITE_FTS_TABLE],
+            where=[f'{SQLITE_FTS_TABLE} MATCH %s', f'{SQLITE_FTS_TABLE}.rowid = {table}.{pk}'],
+            params=[phrase],
+        )
+        # bm25 is "lower is better"; negate it so every backend sorts rank descending.
+        # Name matches weigh twice as much as contact_info matches.
+        return matches.annotate(
+            search_rank=RawSQL(f'-bm25({SQLITE_FTS_TABLE}, 2.0, 1.0)', (), output_field=FloatField())
+        )
+
+    matches = queryset.filter(Q(name__icontains=query) | Q(contact_info__icontains=query))
+    if not ranked:
+        return matches
+    return matches.annotate(search_rank=Value(0.0, output_field=FloatField()))
@@ -1,15 +1,29 @@
 #@JUMA_SAMWEL
+from django.conf import settings
 from rest_framework import serializers
 from .models import Program, Client, Doctor
 from django.contrib.auth.models import User
 from rest_framework.exceptions import ValidationError
+from .login import limit_hashing, load_user, verify_password
 
 class ProgramSerializer(serializers.ModelSerializer):
     class Meta:
         model = Program
         fields = ['id', 'name'] # Fields to include in the API output
 
-class ClientSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Drop every field not named in context['fieldset'], when one is given
+    (see afiya/fieldsets.py).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fieldset = self.context.get('fieldset')
+        if fieldset is not None:
+            for name in set(self.fields) - fieldset:
+                self.fields.pop(name)
+
+class ClientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # To show program names instead of just IDs in the client profile
     enrolled_programs = ProgramSerializer(many=True, read_only=True)
 
@@ -21,11 +35,38 @@ class ClientEnrollmentSerializer(serializers.Serializer):
     # A specific serializer for the enrollment action
     program_id = serializers.IntegerField()
 
-    def validate_program_id(self, value):
-        """Check that the program exists."""
-        if not Program.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(f"Program with ID {value} not found.")
+    def validate(self, data):
+        """Check that the program exists, and hand it to the view as 'program'."""
+        data['program'] = Program.objects.filter(pk=data['program_id']).first()
+        if data['program'] is None:
+            raise serializers.ValidationError({'program_id': [f"Program with ID {data['program_id']} not found."]})
+        return data
+
+class BulkEnrollmentSerializer(serializers.Serializer):
+    """
+    Input for enrolling many clients into one program: either an explicit
+    list of client IDs or a search query selecting the clients.
+    """
+    client_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    q = serializers.CharField(required=False, allow_blank=False)
+
+    def validate(self, data):
+        if ('client_ids' in data) == ('q' in data):
+            raise ValidationError("Provide exactly one of 'client_ids' or 'q'.")
+        return data
+
+class ClientBatchSerializer(serializers.Serializer):
+    """
+    Input for fetching many clients at once: their IDs, in the order the
+    profiles should come back.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+    def validate_ids(self, value):
+        if len(value) > settings.AFIYA_CLIENT_BATCH_MAX_IDS:
+            raise ValidationError(f"At most {settings.AFIYA_CLIENT_BATCH_MAX_IDS} ids per request.")
         return value
+
 class UserLoginSerializer(serializers.Serializer):
     """
     Serializer for user login.
@@ -38,8 +79,9 @@ class UserLoginSerializer(serializers.Serializer):
         password = data.get('password')
 
         if username and password:
-            user = User.objects.filter(username=username).first()
-            if not user or not user.check_password(password):
+            # One query for the user and their token; concurrent hashes may be capped
+            user = load_user(username)
+            if not verify_password(user, password, limit_hashing(self.context.get('request'))):
                 raise ValidationError("Invalid username or password")
         else:
             raise ValidationError("Must include 'username' and 'password'.")
@@ -0,0 +1,259 @@
+#@juma_samwel
+"""
+Signal receivers for the afiya app. Imported from AfiyaConfig.ready().
+"""
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from collections import Counter
+from itertools import islice
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import changelog, stats
+from .authentication import auth_cache
+from .autocomplete import client_name_index
+from .caching import bump_program_cache_version
+from .events import broker as event_broker
+from .metrics import registry as metrics_registry
+from .models import ChangeLog, Client, Program
+
+# Sent after Client.objects.bulk_create() in our bulk paths, which skips post_save.
+# Arguments: sender (Client), instances (list of saved clients), using (db alias).
+clients_bulk_created = Signal()
+
+
+@receiver(post_save, sender=Client)
+def index_client_name(sender, instance, **kwargs):
+    """Patch the autocomplete index once the save is committed."""
+    transaction.on_commit(
+        lambda: client_name_index.upsert(instance.pk, instance.name),
+        using=kwargs.get('using'),
+    )
+
+
+@receiver(post_delete, sender=Client)
+def unindex_client_name(sender, instance, **kwargs):
+    """Drop a deleted client from the autocomplete index once committed."""
+    client_id = instance.pk
+    transaction.on_commit(
+        lambda: client_name_index.remove(client_id),
+        using=kwargs.get('using'),
+    )
+
+
+@receiver(clients_bulk_created, sender=Client)
+def index_bulk_client_names(sender, instances, **kwargs):
+    """Patch the autocomplete index for bulk-created clients once committed."""
+    entries = [(client.pk, client.name) for client in instances]
+    transaction.on_commit(
+        lambda: client_name_index.upsert_many(entries),
+        using=kwargs.get('using'),
+    )
+
+
+@receiver(m2m_changed, sender=Client.enrolled_programs.through)
+def track_enrollment_stats(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """
+    Keep the per-program counters in step with enrollments, from either side
+    of the relation. Removals are measured before the rows go (only links that
+    actually exist count) and applied after.
+    """
+    if action == 'post_add' and pk_set:
+        stats.apply_birth_year_deltas(stats.enrollment_deltas(instance, reverse, pk_set, 1, using), using)
+        if reverse:
+            stats.record_new_enrollments({instance.pk: len(pk_set)}, using)
+        else:
+            stats.record_new_enrollments(Counter(pk_set), using)
+    elif action in ('pre_remove', 'pre_clear'):
+        linked = stats.linked_ids(instance, reverse, pk_set, using)
+        instance._stats_removed = stats.enrollment_deltas(instance, reverse, linked, -1, using)
+    elif action in ('post_remove', 'post_clear'):
+        stats.apply_birth_year_deltas(instance.__dict__.pop('_stats_removed', {}), using)
+
+
+@receiver(pre_delete, sender=Client)
+def untrack_deleted_client(sender, instance, using, **kwargs):
+    """Deleting a client drops its enrollments without m2m_changed; count them out here."""
+    linked = stats.linked_ids(instance, False, None, using)
+    stats.apply_birth_year_deltas(stats.enrollment_deltas(instance, False, linked, -1, using), using)
+
+
+@receiver(pre_save, sender=Client)
+def remember_birth_year(sender, instance, using, raw=False, **kwargs):
+    """Note the stored birth year of an existing client before it is overwritten."""
+    instance._stats_old_birth_year = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if '_loaded_date_of_birth' in instance.__dict__:
+        stored = instance._loaded_date_of_birth
+    else:
+        stored = Client.objects.using(using).filter(pk=instance.pk).values_list('date_of_birth', flat=True).first()
+    if stored is not None:
+        instance._stats_old_birth_year = stored.year
+
+
+@receiver(post_save, sender=Client)
+def move_birth_year_stats(sender, instance, created, using, raw=False, **kwargs):
+    """Move a client's enrollments to its new birth-year bucket after a date of birth edit."""
+    old_year = instance.__dict__.pop('_stats_old_birth_year', None)
+    if raw:
+        return
+    instance._loaded_date_of_birth = Client._meta.get_field('date_of_birth').to_python(instance.date_of_birth)
+    new_year = instance._loaded_date_of_birth.year
+    if not created and old_year is not None and old_year != new_year:
+        stats.move_birth_year(instance, old_year, new_year, using)
+
+
+@receiver(post_save, sender=Program)
+@receiver(post_delete, sender=Program)
+def invalidate_program_cache(sender, **kwargs):
+    """
+    Orphan cached program responses now, and again on commit so nothing
+    cached from a concurrent read during the transaction survives it.
+    """
+    bump_program_cache_version()
+    transaction.on_commit(bump_program_cache_version, using=kwargs.get('using'))
+
+
+def touch_clients(clients, using):
+    """Move updated_at for the given client queryset, or iterable of ids (in chunks)."""
+    now = timezone.now()
+    if isinstance(clients, QuerySet):
+        clients.using(using).update(updated_at=now)
+        return
+    iterator = iter(clients)
+    while chunk := list(islice(iterator, stats.LOOKUP_CHUNK_SIZE)):
+        Client.objects.using(using).filter(pk__in=chunk).update(updated_at=now)
+
+
+@receiver(m2m_changed, sender=Client.enrolled_programs.through)
+def touch_enrolled_clients(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """Enrollment changes alter a client's profile, so they invalidate its ETag too."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if action != 'pre_clear' and not pk_set:
+        # Re-adding existing enrollments changes nothing
+        return
+    if not reverse:
+        touch_clients(Client.objects.filter(pk=instance.pk), using)
+        instance.updated_at = timezone.now()
+    elif action == 'pre_clear':
+        touch_clients(Client.objects.filter(enrolled_programs=instance), using)
+    else:
+        touch_clients(pk_set, using)
+
+
+@receiver(post_save, sender=Program)
+@receiver(pre_delete, sender=Program)
+def touch_program_clients(sender, instance, using, created=False, **kwargs):
+    """Client profiles embed program names: renaming or deleting a program changes them."""
+    if not created:
+        touch_clients(Client.objects.filter(enrolled_programs=instance), using)
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    """Connection churn for /afiya/_metrics (afiya/metrics.py)."""
+    metrics_registry.record_connection(connection.alias)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    """A deleted token must stop authenticating straight away."""
+    auth_cache.invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_changed_user(sender, instance, update_fields=None, **kwargs):
+    """
+    Password changes, is_active flips and other account edits invalidate the
+    user's cached credentials. The last_login update on every login does not.
+    """
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    auth_cache.invalidate_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, user, **kwargs):
+    if user is not None:
+        auth_cache.invalidate_user(user.pk)
+
+
+def publish_on_commit(events, using):
+    """Publish (kind, data) change events once the current transaction commits."""
+    transaction.on_commit(lambda: event_broker.publish_many(events), using=using)
+
+
+@receiver(post_save, sender=Client)
+def publish_client_saved(sender, instance, created, using, raw=False, **kwargs):
+    if not raw:
+        kind = 'client.created' if created else 'client.updated'
+        publish_on_commit([(kind, {'id': instance.pk, 'name': instance.name})], using)
+
+
+@receiver(clients_bulk_created, sender=Client)
+def publish_clients_bulk_created(sender, instances, using=None, **kwargs):
+    publish_on_commit([('client.created', {'id': client.pk, 'name': client.name}) for client in instances], using)
+
+
+@receiver(post_delete, sender=Client)
+def publish_client_deleted(sender, instance, using, **kwargs):
+    publish_on_commit([('client.deleted', {'id': instance.pk})], using)
+
+
+@receiver(m2m_changed, sender=Client.enrolled_programs.through)
+def publish_enrollments_added(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        data = {'client_ids': sorted(pk_set), 'program_ids': [instance.pk]}
+    else:
+        data = {'client_ids': [instance.pk], 'program_ids': sorted(pk_set)}
+    publish_on_commit([('enrollment.added', data)], using)
+
+
+CHANGE_LOG_KINDS = {Client: ChangeLog.CLIENT, Program: ChangeLog.PROGRAM}
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Program)
+def log_saved(sender, instance, using, **kwargs):
+    """Sync change log (afiya/changelog.py); written before the save's transaction commits."""
+    changelog.record([(CHANGE_LOG_KINDS[sender], instance.pk, 0, ChangeLog.SAVED)], using)
+
+
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Program)
+def log_deleted(sender, instance, using, **kwargs):
+    changelog.record([(CHANGE_LOG_KINDS[sender], instance.pk, 0, ChangeLog.DELETED)], using)
+
+
+@receiver(clients_bulk_created, sender=Client)
+def log_clients_bulk_created(sender, instances, using=None, **kwargs):
+    changelog.record([(ChangeLog.CLIENT, client.pk, 0, ChangeLog.SAVED) for client in instances], using)
+
+
+@receiver(m2m_changed, sender=Client.enrolled_programs.through)
+def log_enrollments(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """Log (client, program) pairs as saved or deleted; clear() is measured before the rows go."""
+    if action == 'pre_clear':
+        instance._changelog_cleared = stats.linked_ids(instance, reverse, None, using)
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_changelog_cleared', ())
+    elif action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    kind = ChangeLog.SAVED if action == 'post_add' else ChangeLog.DELETED
+    if reverse:
+        pairs = [(client_id, instance.pk) for client_id in pk_set]
+    else:
+        pairs = [(instance.pk, program_id) for program_id in pk_set]
+    changelog.record([(ChangeLog.ENROLLMENT, client_id, program_id, kind) for client_id, program_id in pairs], using)
@@ -0,0 +1,226 @@
+#@juma_samwel
+"""
+Incrementally maintained enrollment statistics.
+
+Two counter tables are updated from enrollment signals inside the same
+transaction as the enrollment itself:
+
+* ProgramBirthYearCount: enrolled clients per (program, birth year). The
+  program total and its age-band histogram are derived from these rows at
+  read time, so ages stay current without rewriting counters every year.
+* ProgramDailyEnrollment: new enrollments per (program, day).
+
+Reading statistics is therefore O(programs x birth years), independent of
+the number of clients. `reconcile_program_stats` rebuilds the birth-year
+counters from the through-table if they ever drift.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from .models import Client, Program, ProgramBirthYearCount, ProgramDailyEnrollment
+
+Enrollment = Client.enrolled_programs.through
+
+# Keep IN (...) lists under every backend's bound-parameter limit.
+LOOKUP_CHUNK_SIZE = 900
+
+
+def _bump(model, using, lookup, delta):
+    """Atomically add `delta` to model.count for the row matching `lookup`, creating it if needed."""
+    manager = model.objects.using(using)
+    if manager.filter(**lookup).update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic(using=using):
+            manager.create(count=delta, **lookup)
+    except IntegrityError:
+        # Another transaction created the row first; add to it instead
+        manager.filter(**lookup).update(count=F('count') + delta)
+
+
+def _bump_many(model, using, key_fields, deltas):
+    """
+    Add each delta of {key: delta} to model.count for the row whose `key_fields`
+    equal key, creating rows as needed. Backends with INSERT ... ON CONFLICT
+    (PostgreSQL, SQLite) take one statement per LOOKUP_CHUNK_SIZE values
+    however many rows change; others fall back to _bump per row.
+    """
+    deltas = sorted((key, delta) for key, delta in deltas.items() if delta) # Sorted: a stable lock order
+    if not deltas:
+        return
+    connection = connections[using]
+    if not connection.features.supports_update_conflicts_with_target:
+        for key, delta in deltas:
+            _bump(model, using, dict(zip(key_fields, key)), delta)
+        return
+
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in (*key_fields, 'count')]
+    table, count = quote(model._meta.db_table), quote('count')
+    keys = ', '.join(quote(field.column) for field in fields[:-1])
+    row = '({})'.format(', '.join(['%s'] * len(fields)))
+    per_statement = LOOKUP_CHUNK_SIZE // len(fields)
+    with connection.cursor() as cursor:
+        for start in range(0, len(deltas), per_statement):
+            chunk = deltas[start:start + per_statement]
+            params = [
+                field.get_db_prep_save(value, connection)
+                for key, delta in chunk for field, value in zip(fields, (*key, delta))
+            ]
+            cursor.execute(
+                f'INSERT INTO {table} ({keys}, {count}) VALUES {", ".join([row] * len(chunk))} '
+                f'ON CONFLICT ({keys}) DO UPDATE SET {count} = {table}.{count} + EXCLUDED.{count}',
+                params,
+            )
+
+
+def apply_birth_year_deltas(deltas, using):
+    """Apply a Counter of {(program_id, birth_year): delta} to the counter table."""
+    _bump_many(ProgramBirthYearCount, using, ('program', 'birth_year'), deltas)
+
+
+def record_new_enrollments(per_program, using):
+    """Add today's new enrollments, given as {program_id: count}."""
+    today = timezone.localdate()
+    _bump_many(
+        ProgramDailyEnrollment, using, ('program', 'date'),
+        {(program_id, today): count for program_id, count in per_program.items()},
+    )
+
+
+def birth_years_of(client_ids, using):
+    """Counter of {birth_year: clients} for the given client ids, one grouped query per chunk."""
+    years = Counter()
+    iterator = iter(client_ids)
+    while chunk := list(islice(iterator, LOOKUP_CHUNK_SIZE)):
+        rows = (
+            Client.objects.using(using).filter(pk__in=chunk)
+            .annotate(year=ExtractYear('date_of_birth'))
+            .order_by().values('year').annotate(clients=Count('id'))
+            .values_list('year', 'clients')
+        )
+        years.update(dict(rows))
+    return years
+
+
+def birth_year(client):
+    """The client's birth year, even if date_of_birth was assigned as an ISO string."""
+    return Client._meta.get_field('date_of_birth').to_python(client.date_of_birth).year
+
+
+def enrollment_deltas(instance, reverse, pk_set, sign, using):
+    """
+    Birth-year deltas for links between `instance` and `pk_set`, in either
+    direction of the Client.enrolled_programs relation.
+    """
+    deltas = Counter()
+    if not pk_set:
+        return deltas
+    if reverse:
+        # instance is a Program, pk_set holds client ids
+        for year, clients in birth_years_of(pk_set, using).items():
+            deltas[(instance.pk, year)] += sign * clients
+    else:
+        # instance is a Client, pk_set holds program ids
+        for program_id in pk_set:
+            deltas[(program_id, birth_year(instance))] += sign
+    return deltas
+
+
+def linked_ids(instance, reverse, pk_set, using):
+    """The subset of pk_set currently linked to instance (None pk_set means all links)."""
+    if reverse:
+        links = Enrollment.objects.using(using).filter(program_id=instance.pk)
+        column = 'client_id'
+    else:
+        links = Enrollment.objects.using(using).filter(client_id=instance.pk)
+        column = 'program_id'
+    if pk_set is not None:
+        links = links.filter(**{f'{column}__in': pk_set})
+    return set(links.values_list(column, flat=True))
+
+
+def move_birth_year(client, old_year, new_year, using):
+    """Shift a client's enrollments from one birth-year bucket to another."""
+    deltas = Counter()
+    for program_id in linked_ids(client, False, None, using):
+        deltas[(program_id, old_year)] -= 1
+        deltas[(program_id, new_year)] += 1
+    apply_birth_year_deltas(deltas, using)
+
+
+def age_band_labels(bounds):
+    """[0, 5, 15] -> ['0-4', '5-14', '15+']"""
+    labels = [f'{low}-{high - 1}' for low, high in zip(bounds, bounds[1:])]
+    return labels + [f'{bounds[-1]}+']
+
+
+def age_band_index(age, bounds):
+    index = 0
+    for position, low in enumerate(bounds):
+        if age >= low:
+            index = position
+    return index
+
+
+def program_stats(days):
+    """
+    Statistics for every program: total enrolled, an age-band histogram (age
+    as of this calendar year, from birth year) and new enrollments per day
+    over the last `days` days.
+    """
+    bounds = settings.AFIYA_STATS_AGE_BANDS
+    labels = age_band_labels(bounds)
+    current_year = timezone.localdate().year
+    since = timezone.localdate() - timedelta(days=days - 1)
+
+    histograms = defaultdict(lambda: [0] * len(labels))
+    for program_id, birth_year, count in ProgramBirthYearCount.objects.filter(count__gt=0).values_list(
+            'program_id', 'birth_year', 'count'):
+        band = age_band_index(max(current_year - birth_year, 0), bounds)
+        histograms[program_id][band] += count
+
+    daily = defaultdict(list)
+    for program_id, date, count in ProgramDailyEnrollment.objects.filter(date__gte=since).order_by(
+            'date').values_list('program_id', 'date', 'count'):
+        daily[program_id].append({'date': date, 'count': count})
+
+    results = []
+    for program_id, name in Program.objects.order_by('name').values_list('id', 'name'):
+        histogram = histograms[program_id]
+        results.append({
+            'id': program_id,
+            'name': name,
+            'enrolled': sum(histogram),
+            'age_bands': dict(zip(labels, histogram)),
+            'new_enrollments_per_day': daily[program_id],
+        })
+    return results
+
+
+def reconcile_birth_year_counts(using):
+    """
+    Recompute ProgramBirthYearCount from the enrollment through-table.
+    Daily enrollment counts cannot be rebuilt (enrollments carry no
+    timestamp) and are left untouched.
+    """
+    rows = (
+        Enrollment.objects.using(using)
+        .annotate(year=ExtractYear('client__date_of_birth'))
+        .order_by().values('program_id', 'year').annotate(clients=Count('pk'))
+        .values_list('program_id', 'year', 'clients')
+    )
+    with transaction.atomic(using=using):
+        ProgramBirthYearCount.objects.using(using).all().delete()
+        counters = ProgramBirthYearCount.objects.using(using).bulk_create(
+            ProgramBirthYearCount(program_id=program_id, birth_year=year, count=clients)
+            for program_id, year, clients in rows
+        )
+    return len(counters)
@@ -0,0 +1,189 @@
+#@juma_samwel
+"""
+Test helpers for query performance.
+
+assert_indexed() captures the SQL run inside a block (a request, a view
+call), EXPLAINs each statement and fails if the database would read any
+of the watched tables with a sequential scan. It checks the queries that
+actually ran, so it covers the viewset querysets, the paginator's keyset
+filters, prefetches and the admin changelist alike.
+
+Plans depend on table size and statistics: seed enough rows first (see
+seed_clients) or the planner may rightly prefer scanning a tiny table.
+
+assert_constant_queries() (or the @query_budget decorator) runs one
+request scenario against several sizes of seeded data and fails if the
+number of queries grows with the data (an N+1) or exceeds a budget.
+"""
+import datetime
+import functools
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .models import Client, Program
+
+# An unfiltered COUNT(*) has to read every row whatever the indexes
+UNFILTERED_COUNT = re.compile(r'^SELECT COUNT\(\*\) AS "__count" FROM "\w+"$', re.IGNORECASE)
+
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+POSTGRES_SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def explain(sql, using=DEFAULT_DB_ALIAS):
+    """The query plan for `sql`, one line per step."""
+    connection = connections[using]
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        rows = cursor.fetchall()
+    # SQLite rows are (id, parent, notused, detail); other backends return the text as the last column
+    return [str(row[-1]) for row in rows]
+
+
+def sequential_scans(plan, tables, vendor):
+    """The watched tables that `plan` reads with a full table scan."""
+    scanned = []
+    for line in plan:
+        if vendor == 'sqlite':
+            match = SQLITE_SCAN.match(line.strip())
+            if match and 'USING' not in match.group(2) and 'VIRTUAL TABLE' not in match.group(2):
+                scanned.append(match.group(1))
+        else:
+            scanned.extend(POSTGRES_SEQ_SCAN.findall(line))
+    return [table for table in scanned if table in tables]
+
+
+@contextmanager
+def assert_indexed(testcase, tables=(Client._meta.db_table,), using=DEFAULT_DB_ALIAS):
+    """
+    Fail `testcase` if any SELECT run inside the block reads one of `tables`
+    with a sequential scan. Unfiltered COUNT(*) queries are exempt.
+    """
+    connection = connections[using]
+    with CaptureQueriesContext(connection) as captured:
+        yield captured
+
+    failures = []
+    for query in captured.captured_queries:
+        sql = query['sql']
+        if not sql.lstrip().upper().startswith('SELECT') or UNFILTERED_COUNT.match(sql.strip()):
+            continue
+        plan = explain(sql, using)
+        if sequential_scans(plan, tables, connection.vendor):
+            failures.append(sql + '\n    ' + '\n    '.join(plan))
+    if failures:
+        testcase.fail('Sequential scan in:\n' + '\n\n'.join(failures))
+
+
+def seed_clients(count, batch_size=5000, using=DEFAULT_DB_ALIAS):
+    """
+    Insert `count` synthetic clients (bulk_create, no signals) and refresh
+    the planner statistics.
+    """
+    start = datetime.date(1940, 1, 1)
+    for offset in range(0, count, batch_size):
+        Client.objects.using(using).bulk_create([
+            Client(
+                name=f'Seed {number * 7919 % count:06d} Client',
+                date_of_birth=start + datetime.timedelta(days=number % 30000),
+                contact_info=f'07{number:08d}',
+            )
+            for number in range(offset, min(offset + batch_size, count))
+        ])
+    with connections[using].cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+# (clients, programs) seeded for each run of a query-budget scenario
+QUERY_BUDGET_SIZES = ((3, 5), (20, 8), (60, 16))
+
+Seeded = namedtuple('Seeded', 'clients programs')
+
+
+def seed_enrolled_clients(clients, programs, per_client=3, using=DEFAULT_DB_ALIAS):
+    """
+    Insert `programs` programs and `clients` clients (bulk_create, no signals),
+    each client enrolled in up to `per_client` of the programs. Every client
+    name contains "Budget". Returns Seeded(clients, programs), ordered by id.
+    """
+    seeded_programs = Program.objects.using(using).bulk_create([
+        Program(name=f'Budget Program {number:04d}') for number in range(programs)
+    ])
+    seeded_clients = Client.objects.using(using).bulk_create([
+        Client(
+            name=f'Budget Client {number:05d}',
+            date_of_birth=datetime.date(1950, 1, 1) + datetime.timedelta(days=number * 97 % 20000),
+            contact_info=f'budget{number}@example.com',
+        )
+        for number in range(clients)
+    ])
+    # bulk_create sets primary keys on SQLite and PostgreSQL; refetch elsewhere
+    if seeded_clients and seeded_clients[0].pk is None:
+        seeded_clients = list(Client.objects.using(using).filter(name__startswith='Budget Client ').order_by('id'))
+        seeded_programs = list(Program.objects.using(using).filter(name__startswith='Budget Program ').order_by('id'))
+    enrollment = Client.enrolled_programs.through
+    enrollment.objects.using(using).bulk_create([
+        enrollment(client_id=client.pk, program_id=seeded_programs[(index + offset) % programs].pk)
+        for index, client in enumerate(seeded_clients)
+        for offset in range(min(per_client, programs))
+    ])
+    return Seeded(seeded_clients, seeded_programs)
+
+
+def assert_constant_queries(testcase, scenario, sizes=QUERY_BUDGET_SIZES, budget=None, using=DEFAULT_DB_ALIAS):
+    """
+    Run `scenario(seeded)` once per (clients, programs) size in `sizes` and
+    fail `testcase` unless every run makes the same number of queries (and no
+    more than `budget`, if given). Returns that number.
+
+    Each run gets freshly seeded data and an empty cache, and its writes are
+    rolled back afterwards. One unmeasured run first warms per-process state
+    (connection setup, lazily built indexes) so it isn't counted against the
+    first size.
+    """
+    connection = connections[using]
+    counts = {}
+    for index, (clients, programs) in enumerate([sizes[0], *sizes]):
+        with transaction.atomic(using=using):
+            seeded = seed_enrolled_clients(clients, programs, using=using)
+            cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                scenario(seeded)
+            if index:
+                last_queries = list(captured.captured_queries)
+                counts[clients, programs] = len(last_queries)
+            transaction.set_rollback(True, using=using)
+        cache.clear()
+
+    summary = ', '.join(f'{c} clients/{p} programs: {n}' for (c, p), n in counts.items())
+    if len(set(counts.values())) > 1:
+        testcase.fail(f'Query count grows with the data ({summary})')
+    count = next(iter(counts.values()))
+    if budget is not None and count > budget:
+        queries = '\n'.join(f'  {query["sql"]}' for query in last_queries)
+        testcase.fail(f'{count} queries, over the budget of {budget} ({summary}):\n{queries}')
+    return count
+
+
+def query_budget(budget=None, sizes=QUERY_BUDGET_SIZES, using=DEFAULT_DB_ALIAS):
+    """
+    Decorate an APITestCase method taking `seeded` (see seed_enrolled_clients)
+    to run it through assert_constant_queries:
+
+        @query_budget(3)
+        def test_list_clients(self, seeded):
+            self.assertEqual(self.client.get(self.list_url).status_code, 200)
+    """
+    def decorator(test_method):
+        @functools.wraps(test_method)
+        def wrapper(self):
+            assert_constant_queries(
+                self, lambda seeded: test_method(self, seeded), sizes=sizes, budget=budget, using=using,
+            )
+        return wrapper
+    return decorator
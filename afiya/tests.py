@@ -1,10 +1,52 @@
 #@JUMA_SAMWEL
 from django.urls import reverse
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import User # Import User model
 from rest_framework import status, serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
-from .models import Program, Client
+from asgiref.sync import sync_to_async
+from .authentication import auth_cache
+from .events import RESET, broker as event_broker
+from .autocomplete import ClientNameIndex, client_name_index
+from .metrics import registry as metrics_registry
+from .login import LoginBusy, PasswordHashLimiter
+from .management.commands.import_clients import Command as ImportClientsCommand
+from .management.commands.loadtest import summarize
+from .pagination import encode_cursor
+from .bulk import insert_clients, insert_enrollments
+from .changelog import changes_since, parse_token
+from .models import ChangeLog, ImportCheckpoint, Program, Client, ProgramBirthYearCount
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+from .search import search_clients
+from .signals import clients_bulk_created
+from .routers import PIN_COOKIE, ReplicaRouter, ReplicaRoutingMiddleware, primary_reads, use_replicas
+from .testing import assert_constant_queries, assert_indexed, query_budget, seed_clients
+import asyncio
+import csv
 import datetime
+import decimal
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest.mock
+from collections import Counter
 
 class ProgramAPITests(APITestCase):
     def setUp(self):
@@ -154,10 +196,11 @@ class ClientAPITests(APITestCase):
         url = self.list_url
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        results = response.data['results'] # List responses are cursor-paginated
+        self.assertEqual(len(results), 2)
         # Note: Order depends on default ordering ('name'), client2 comes before client1
-        self.assertEqual(response.data[0]['name'], self.client2.name)
-        self.assertEqual(response.data[1]['name'], self.client1.name)
+        self.assertEqual(results[0]['name'], self.client2.name)
+        self.assertEqual(results[1]['name'], self.client1.name)
 
     def test_retrieve_client(self):
         """
@@ -296,8 +339,8 @@ class ClientAPITests(APITestCase):
         """
         response = self.client.get(self.search_url + '?q=One', format='json') # Search for 'One'
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], self.client1.name)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], self.client1.name)
 
     def test_search_client_multiple_results(self):
         """
@@ -305,9 +348,9 @@ class ClientAPITests(APITestCase):
         """
         response = self.client.get(self.search_url + '?q=Test Client', format='json') # Should match both
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
         # Check names are present (order depends on default ordering)
-        names = {client['name'] for client in response.data}
+        names = {client['name'] for client in response.data['results']}
         self.assertEqual(names, {self.client1.name, self.client2.name})
 
     def test_search_client_case_insensitive(self):
@@ -316,8 +359,8 @@ class ClientAPITests(APITestCase):
         """
         response = self.client.get(self.search_url + '?q=test client one', format='json') # Lowercase search
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], self.client1.name)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], self.client1.name)
 
     def test_search_client_no_results(self):
         """
@@ -325,7 +368,7 @@ class ClientAPITests(APITestCase):
         """
         response = self.client.get(self.search_url + '?q=NonExistentName', format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0) # Should be an empty list
+        self.assertEqual(len(response.data['results']), 0) # Should be an empty list
 
     def test_search_client_no_query_param(self):
         """
@@ -343,7 +386,2438 @@ class ClientAPITests(APITestCase):
         # The view was updated to handle empty 'q' by returning all clients
         response = self.client.get(self.search_url + '?q=', format='json') # Empty query
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2) # Returns all clients
+        self.assertEqual(len(response.data['results']), 2) # Returns all clients
+
+
+class ClientPaginationTests(APITestCase):
+    def setUp(self):
+        """Set up enough clients to span several pages, including duplicate names."""
+        self.user = User.objects.create_user(username='testuser_pages', password='password123')
+        dob = datetime.date(1990, 1, 1)
+        for name in ['Alice', 'Bob', 'Bob', 'Bob', 'Carol', 'Dan', 'Eve']:
+            Client.objects.create(name=name, date_of_birth=dob)
+        self.list_url = reverse('client-list')
+        self.search_url = reverse('client-search')
+        self.client.force_authenticate(user=self.user)
+
+    def _collect(self, url):
+        """Follow 'next' cursors from url and return every page's results."""
+        pages = []
+        while url:
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data['results'])
+            url = response.data['next']
+        return pages
+
+    def test_page_size_and_next_cursor(self):
+        """
+        Ensure ?page_size= limits the page and next cursors walk every client once.
+        """
+        pages = self._collect(self.list_url + '?page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        ids = [client['id'] for page in pages for client in page]
+        self.assertEqual(len(ids), len(set(ids))) # No duplicates across pages
+        expected = list(Client.objects.order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_cursor_returns_prior_page(self):
+        """
+        Ensure the previous cursor of page two returns exactly page one.
+        """
+        first = self.client.get(self.list_url + '?page_size=3', format='json')
+        second = self.client.get(first.data['next'], format='json')
+        self.assertIsNone(first.data['previous'])
+        back = self.client.get(second.data['previous'], format='json')
+        self.assertEqual(
+            [client['id'] for client in back.data['results']],
+            [client['id'] for client in first.data['results']]
+        )
+
+    @override_settings(AFIYA_CLIENT_PAGE_SIZE=3, AFIYA_CLIENT_MAX_PAGE_SIZE=4)
+    def test_page_size_settings(self):
+        """
+        Ensure the default and maximum page sizes come from settings.
+        """
+        response = self.client.get(self.list_url, format='json')
+        self.assertEqual(len(response.data['results']), 3)
+        response = self.client.get(self.list_url + '?page_size=100', format='json')
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_search_is_paginated(self):
+        """
+        Ensure search results are cursor-paginated as well.
+        """
+        pages = self._collect(self.search_url + '?q=Bob&page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 1])
+
+    def test_invalid_cursor(self):
+        """
+        Ensure a tampered cursor is rejected with 404 instead of a server error.
+        """
+        response = self.client.get(self.list_url + '?cursor=not-a-cursor', format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_wrongly_typed_cursor(self):
+        """
+        Ensure a well-formed cursor holding values of the wrong type is rejected with 404.
+        """
+        for url, position in [
+            (self.list_url, ['Bob', 'not-an-id']),
+            (self.list_url, [None, 1]),
+            (self.list_url, [{'name': 'Bob'}, 1]),
+            (self.search_url, ['not-a-rank', 'Bob', 1]),
+        ]:
+            with self.subTest(url=url, position=position):
+                response = self.client.get(url, {'q': 'Bob', 'cursor': encode_cursor(position)}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ClientSearchIndexTests(APITestCase):
+    def setUp(self):
+        """Set up clients for indexed search tests."""
+        self.user = User.objects.create_user(username='testuser_search', password='password123')
+        dob = datetime.date(1990, 1, 1)
+        self.wanjiku = Client.objects.create(name='Wanjiku Kamau', date_of_birth=dob, contact_info='0712 000111')
+        self.kamau = Client.objects.create(name='Peter Otieno', date_of_birth=dob, contact_info='kamau@example.com')
+        self.search_url = reverse('client-search')
+        self.client.force_authenticate(user=self.user)
+
+    def _names(self, query):
+        response = self.client.get(self.search_url, {'q': query}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [client['name'] for client in response.data['results']]
+
+    def test_search_matches_contact_info(self):
+        """
+        Ensure search also matches contact information.
+        """
+        self.assertEqual(self._names('0712'), [self.wanjiku.name])
+
+    def test_search_ranks_name_matches_first(self):
+        """
+        Ensure a name match outranks a contact-info match for the same term.
+        """
+        self.assertEqual(self._names('kamau'), [self.wanjiku.name, self.kamau.name])
+
+    def test_search_index_follows_updates_and_deletes(self):
+        """
+        Ensure the index reflects renamed and deleted clients.
+        """
+        self.wanjiku.name = 'Achieng Njeri'
+        self.wanjiku.save()
+        self.assertEqual(self._names('Achieng'), [self.wanjiku.name])
+        self.kamau.delete()
+        self.assertEqual(self._names('kamau'), [])
+
+    def test_short_query_falls_back(self):
+        """
+        Ensure queries shorter than a trigram still match.
+        """
+        self.assertEqual(self._names('Pe'), [self.kamau.name])
+
+    def test_query_syntax_is_not_interpreted(self):
+        """
+        Ensure search operators in the query are treated as plain text.
+        """
+        self.assertEqual(self._names('"kamau OR'), [])
+
+    def test_sqlite_ranks_in_one_match(self):
+        """
+        Ensure SQLite ranks results from a single FTS MATCH, not one per candidate row.
+        """
+        if connection.vendor != 'sqlite' or 'afiya_client_fts' not in connection.introspection.table_names():
+            self.skipTest('SQLite FTS5 search index not installed')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._names('kamau'), [self.wanjiku.name, self.kamau.name])
+        [search] = [query['sql'] for query in queries if 'MATCH' in query['sql']]
+        self.assertEqual(search.count('MATCH'), 1)
+        self.assertEqual(search.count('bm25'), 1)
+
+    def test_unranked_search_can_update(self):
+        """
+        Ensure unranked search results can be updated and deleted through, as admin actions do.
+        """
+        matches = search_clients(Client.objects.all(), 'kamau', ranked=False)
+        self.assertEqual(matches.update(contact_info='0700 000000'), 2)
+        self.assertEqual(search_clients(Client.objects.all(), '0700', ranked=False).delete()[0], 2)
+
+
+class ClientAutocompleteTests(APITestCase):
+    def setUp(self):
+        """Set up clients and a fresh in-memory name index."""
+        self.user = User.objects.create_user(username='testuser_autocomplete', password='password123')
+        dob = datetime.date(1990, 1, 1)
+        self.amina = Client.objects.create(name='Amina Hassan', date_of_birth=dob)
+        self.amos = Client.objects.create(name='amos Kiprop', date_of_birth=dob)
+        self.brian = Client.objects.create(name='Brian Mwangi', date_of_birth=dob)
+        self.url = reverse('client-autocomplete')
+        client_name_index.invalidate() # The index is per-process; start each test clean
+        self.client.force_authenticate(user=self.user)
+
+    def test_autocomplete_prefix_case_insensitive(self):
+        """
+        Ensure autocomplete returns id/name pairs for a case-insensitive prefix.
+        """
+        response = self.client.get(self.url, {'prefix': 'AM'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'id': self.amina.id, 'name': self.amina.name},
+            {'id': self.amos.id, 'name': self.amos.name},
+        ])
+
+    def test_autocomplete_limit(self):
+        """
+        Ensure the limit parameter caps the number of suggestions.
+        """
+        response = self.client.get(self.url, {'prefix': 'a', 'limit': 1}, format='json')
+        self.assertEqual([item['id'] for item in response.data], [self.amina.id])
+
+    def test_autocomplete_warm_lookup_skips_database(self):
+        """
+        Ensure lookups after the index is built do not query the database.
+        """
+        self.client.get(self.url, {'prefix': 'b'}, format='json') # Builds the index
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'prefix': 'bri'}, format='json')
+        self.assertEqual(response.data, [{'id': self.brian.id, 'name': self.brian.name}])
+
+    def test_autocomplete_patched_on_save_and_delete(self):
+        """
+        Ensure saves and deletes patch the built index incrementally.
+        """
+        self.client.get(self.url, {'prefix': 'a'}, format='json') # Builds the index
+        with self.captureOnCommitCallbacks(execute=True):
+            zawadi = Client.objects.create(name='Zawadi Achieng', date_of_birth=datetime.date(2001, 2, 3))
+            self.brian.name = 'Amani Brian'
+            self.brian.save()
+            self.amos.delete()
+        with self.assertNumQueries(0):
+            names = [item['name'] for item in self.client.get(self.url, {'prefix': 'am'}, format='json').data]
+            zawadi_match = self.client.get(self.url, {'prefix': 'zaw'}, format='json').data
+        self.assertEqual(names, ['Amani Brian', 'Amina Hassan'])
+        self.assertEqual(zawadi_match, [{'id': zawadi.id, 'name': zawadi.name}])
+
+    def test_concurrent_first_lookups_build_once(self):
+        """
+        Ensure lookups racing to build a cold index load it only once.
+        """
+        index = ClientNameIndex()
+        loading, release, loads, results = threading.Event(), threading.Event(), [], []
+        def load():
+            loads.append(1)
+            loading.set()
+            release.wait(5)
+            return [('Amina Hassan', 1)]
+        index._load = load
+        threads = [threading.Thread(target=lambda: results.append(index.lookup('am'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        loading.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, [[(1, 'Amina Hassan')]] * 4)
+
+    @override_settings(AFIYA_AUTOCOMPLETE_MAX_AGE=60)
+    def test_stale_index_answers_during_rebuild(self):
+        """
+        Ensure a stale index keeps answering from its old arrays while one thread rebuilds it.
+        """
+        index = ClientNameIndex()
+        index._load = lambda: [('Amina Hassan', 1)]
+        index.build()
+        index._built_at -= 120
+        loading, release = threading.Event(), threading.Event()
+        def load():
+            loading.set()
+            release.wait(5)
+            return [('Amani Brian', 2), ('Amina Hassan', 1)]
+        index._load = load
+        rebuild = threading.Thread(target=index.lookup, args=('am',))
+        rebuild.start()
+        loading.wait(5)
+        self.assertEqual(index.lookup('am'), [(1, 'Amina Hassan')]) # Does not wait for the rebuild
+        release.set()
+        rebuild.join()
+        self.assertEqual(index.lookup('am'), [(2, 'Amani Brian'), (1, 'Amina Hassan')])
+
+    def test_patches_during_a_build_are_replayed(self):
+        """
+        Ensure saves and deletes committed while a build reads the table survive the swap.
+        """
+        index = ClientNameIndex()
+        loading, release = threading.Event(), threading.Event()
+        def load():
+            loading.set()
+            release.wait(5)
+            return [('Amina Hassan', 1), ('Brian Mwangi', 2)]
+        index._load = load
+        def build_while(patch):
+            loading.clear()
+            release.clear()
+            build = threading.Thread(target=index.build)
+            build.start()
+            loading.wait(5)
+            patch()
+            release.set()
+            build.join()
+
+        build_while(lambda: (index.upsert(3, 'Amos Kiprop'), index.remove(2)))
+        self.assertEqual(index.lookup('a'), [(1, 'Amina Hassan'), (3, 'Amos Kiprop')])
+        self.assertEqual(index.lookup('b'), [])
+        build_while(index.invalidate) # e.g. a large bulk upload committed mid-build
+        self.assertTrue(index._is_stale()) # The invalidation outlives the build it raced
+
+    def test_patches_match_a_fresh_build(self):
+        """
+        Ensure renames and removals among equal folded names leave the index as a rebuild would.
+        """
+        rows = {1: 'Amina', 2: 'AMINA', 3: 'amina', 4: 'Brian', 5: 'Amos'}
+        index = ClientNameIndex()
+        index._load = lambda: sorted(((name, client_id) for client_id, name in rows.items()),
+                                     key=lambda row: (row[0].casefold(), row[1]))
+        index.build()
+        for client_id, name in ((2, 'Zawadi'), (6, 'Amina'), (3, 'brian'), (2, 'aMiNa')):
+            rows[client_id] = name
+            index.upsert(client_id, name)
+        for client_id in (1, 5, 99):
+            rows.pop(client_id, None)
+            index.remove(client_id)
+        patched = (list(index._names), list(index._ids))
+        index.build()
+        self.assertEqual(patched, (index._names, list(index._ids)))
+        self.assertEqual(index.lookup('amina'), [(2, 'aMiNa'), (6, 'Amina')])
+
+    def test_autocomplete_requires_prefix(self):
+        """
+        Ensure the prefix parameter is required.
+        """
+        response = self.client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ClientBulkRegistrationTests(APITestCase):
+    def setUp(self):
+        """Set up a user and programs for bulk registration tests."""
+        self.user = User.objects.create_user(username='testuser_bulk', password='password123')
+        self.program_tb = Program.objects.create(name="TB Care")
+        self.program_hiv = Program.objects.create(name="HIV Support")
+        self.url = reverse('client-bulk')
+        self.client.force_authenticate(user=self.user)
+
+    def test_bulk_json_array_with_enrollments(self):
+        """
+        Ensure a JSON array registers every client and their enrollments.
+        """
+        rows = [
+            {'name': 'Bulk One', 'date_of_birth': '1990-01-01', 'enrolled_program_ids': [self.program_tb.id]},
+            {'name': 'Bulk Two', 'date_of_birth': '1991-02-02', 'contact_info': 'two@example.com',
+             'enrolled_program_ids': [self.program_tb.id, self.program_hiv.id]},
+            {'name': 'Bulk Three', 'date_of_birth': '1992-03-03'},
+        ]
+        response = self.client.post(self.url + '?batch_size=2', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created_count'], 3)
+        self.assertEqual([item['index'] for item in response.data['created']], [0, 1, 2])
+        two = Client.objects.get(name='Bulk Two')
+        self.assertEqual(two.contact_info, 'two@example.com')
+        self.assertEqual(set(two.enrolled_programs.values_list('id', flat=True)),
+                         {self.program_tb.id, self.program_hiv.id})
+        self.assertEqual(self.program_tb.clients.count(), 2)
+
+    def test_bulk_without_returning_sends_signal(self):
+        """
+        Ensure backends without INSERT ... RETURNING still get ids and the bulk-created signal.
+        """
+        rows = [
+            {'name': 'No Returning One', 'date_of_birth': '1990-01-01'},
+            {'name': 'No Returning Two', 'date_of_birth': '1991-01-01', 'enrolled_program_ids': [self.program_tb.id]},
+            {'name': 'No Returning One', 'date_of_birth': '1990-01-01'}, # Same fields, another row
+        ]
+        received = []
+        def receiver(sender, instances, **kwargs):
+            received.extend(client.pk for client in instances)
+        clients_bulk_created.connect(receiver, sender=Client)
+        self.addCleanup(clients_bulk_created.disconnect, receiver, sender=Client)
+        no_returning = unittest.mock.PropertyMock(return_value=False)
+        with unittest.mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', no_returning):
+            response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ids = [item['id'] for item in response.data['created']]
+        self.assertEqual(len(set(ids)), 3)
+        names = Client.objects.in_bulk(ids)
+        self.assertEqual([names[client_id].name for client_id in ids], [row['name'] for row in rows])
+        self.assertEqual(received, [ids[0], ids[2]])
+        logged = ChangeLog.objects.filter(kind=ChangeLog.CLIENT, action=ChangeLog.SAVED)
+        self.assertEqual(set(logged.values_list('object_id', flat=True)), set(ids))
+
+    def test_bulk_reports_row_errors_without_aborting(self):
+        """
+        Ensure invalid rows are reported by index while valid rows are still created.
+        """
+        rows = [
+            {'name': 'Good Row', 'date_of_birth': '1990-01-01'},
+            {'date_of_birth': '1990-01-01'}, # Missing name
+            {'name': 'Bad Program', 'date_of_birth': '1990-01-01', 'enrolled_program_ids': [9999]},
+            'not an object',
+        ]
+        response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created_count'], 1)
+        errors = {item['index']: item['errors'] for item in response.data['errors']}
+        self.assertEqual(set(errors), {1, 2, 3})
+        self.assertIn('name', errors[1])
+        self.assertIn("Program with ID 9999 not found.", str(errors[2]['enrolled_program_ids']))
+        self.assertEqual(list(Client.objects.values_list('name', flat=True)), ['Good Row'])
+
+    def test_bulk_ndjson(self):
+        """
+        Ensure NDJSON bodies are accepted and malformed lines reported.
+        """
+        body = (
+            '{"name": "Line One", "date_of_birth": "1990-01-01"}\n'
+            '\n'
+            '{"name": "Line Two", "date_of_birth": \n'
+            '{"name": "Line Three", "date_of_birth": "1993-01-01"}\n'
+        )
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created_count'], 2)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertIn('line 3', str(response.data['errors'][0]['errors']))
+
+    def test_bulk_rejects_non_list_body(self):
+        """
+        Ensure a single JSON object is rejected.
+        """
+        response = self.client.post(self.url, {'name': 'Solo'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_rejects_null_and_scalar_bodies(self):
+        """
+        Ensure a null or scalar JSON body is rejected with 400 instead of a server error.
+        """
+        for body in ('null', '5', '"text"', 'true'):
+            with self.subTest(body=body):
+                response = self.client.post(self.url, body, content_type='application/json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Client.objects.exists())
+
+
+class ProgramBulkEnrollmentTests(APITestCase):
+    def setUp(self):
+        """Set up a program and clients for bulk enrollment tests."""
+        self.user = User.objects.create_user(username='testuser_enroll_bulk', password='password123')
+        self.program = Program.objects.create(name="Malaria Nets")
+        dob = datetime.date(1990, 1, 1)
+        self.clients = [
+            Client.objects.create(name=f'Net Client {index}', date_of_birth=dob)
+            for index in range(5)
+        ]
+        self.other = Client.objects.create(name='Unrelated Person', date_of_birth=dob)
+        self.url = reverse('program-enroll-bulk', kwargs={'pk': self.program.pk})
+        self.client.force_authenticate(user=self.user)
+
+    def test_enroll_bulk_by_ids(self):
+        """
+        Ensure clients are enrolled by id with counts for new, existing and unknown ids.
+        """
+        self.clients[0].enrolled_programs.add(self.program)
+        ids = [client.id for client in self.clients[:3]] + [9999]
+        response = self.client.post(self.url, {'client_ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['requested'], 4)
+        self.assertEqual(response.data['enrolled'], 2)
+        self.assertEqual(response.data['already_enrolled'], 1)
+        self.assertEqual(response.data['not_found'], [9999])
+        self.assertEqual(self.program.clients.count(), 3)
+        self.assertNotIn('enrolled_programs', response.data) # Counts only, no profiles
+
+    def test_enroll_bulk_by_search(self):
+        """
+        Ensure a search query selects the clients to enroll.
+        """
+        response = self.client.post(self.url, {'q': 'Net Client'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['enrolled'], 5)
+        self.assertFalse(self.other.enrolled_programs.exists())
+
+    def test_enroll_bulk_query_count_is_constant(self):
+        """
+        Ensure the number of queries does not grow with the number of clients.
+        """
+        few = Program.objects.create(name="Few")
+        many = Program.objects.create(name="Many")
+        ids = [client.id for client in self.clients]
+        with CaptureQueriesContext(connection) as few_queries:
+            self.client.post(reverse('program-enroll-bulk', kwargs={'pk': few.pk}), {'client_ids': ids[:1]}, format='json')
+        with CaptureQueriesContext(connection) as many_queries:
+            self.client.post(reverse('program-enroll-bulk', kwargs={'pk': many.pk}), {'client_ids': ids}, format='json')
+        self.assertEqual(len(few_queries), len(many_queries))
+
+    def test_enroll_bulk_signals_only_inserted_rows(self):
+        """
+        Ensure a pair enrolled concurrently, after the lookup, is not signalled as new.
+        """
+        Enrollment = Client.enrolled_programs.through
+        raced = self.clients[1]
+        real_insert = insert_enrollments
+        def enrolled_meanwhile(program, client_ids, batch_size, using):
+            Enrollment.objects.create(client=raced, program=program) # Sends no signals
+            return real_insert(program, client_ids, batch_size, using)
+        added = []
+        def record(sender, action, pk_set, **kwargs):
+            if action == 'post_add':
+                added.append(set(pk_set))
+        m2m_changed.connect(record, sender=Enrollment)
+        self.addCleanup(m2m_changed.disconnect, record, sender=Enrollment)
+
+        ids = [client.id for client in self.clients[:3]]
+        with unittest.mock.patch('afiya.bulk.insert_enrollments', enrolled_meanwhile):
+            response = self.client.post(self.url, {'client_ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['enrolled'], response.data['already_enrolled']), (2, 1))
+        self.assertEqual(added, [{self.clients[0].id, self.clients[2].id}])
+        self.assertEqual(self.program.clients.count(), 3)
+
+    def test_enroll_bulk_requires_one_selector(self):
+        """
+        Ensure exactly one of client_ids or q must be given.
+        """
+        response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, {'client_ids': [1], 'q': 'x'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ClientExportTests(APITestCase):
+    def setUp(self):
+        """Set up clients and enrollments to export."""
+        self.user = User.objects.create_user(username='testuser_export', password='password123')
+        self.program_tb = Program.objects.create(name="TB Care")
+        self.program_hiv = Program.objects.create(name="HIV Support")
+        self.client1 = Client.objects.create(name='Export, One', date_of_birth=datetime.date(1990, 5, 15),
+                                             contact_info='one@example.com')
+        self.client2 = Client.objects.create(name='Export Two', date_of_birth=datetime.date(1985, 1, 1))
+        self.client1.enrolled_programs.add(self.program_tb, self.program_hiv)
+        self.url = reverse('client-export')
+        self.client.force_authenticate(user=self.user)
+
+    def test_export_csv(self):
+        """
+        Ensure the CSV export streams a header and one row per client.
+        """
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual(rows[0], ['id', 'name', 'date_of_birth', 'contact_info', 'enrolled_programs'])
+        self.assertEqual(rows[1], [str(self.client1.id), 'Export, One', '1990-05-15', 'one@example.com',
+                                   'HIV Support;TB Care'])
+        self.assertEqual(rows[2], [str(self.client2.id), 'Export Two', '1985-01-01', '', ''])
+
+    def test_export_ndjson(self):
+        """
+        Ensure the NDJSON export emits one client object per line.
+        """
+        response = self.client.get(self.url, {'format': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([record['id'] for record in records], [self.client1.id, self.client2.id])
+        self.assertEqual(records[0]['enrolled_programs'], [
+            {'id': self.program_hiv.id, 'name': 'HIV Support'},
+            {'id': self.program_tb.id, 'name': 'TB Care'},
+        ])
+
+    def test_export_gzip(self):
+        """
+        Ensure the export is gzip-compressed when the client accepts it.
+        """
+        response = self.client.get(self.url, {'format': 'ndjson'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8')
+        self.assertEqual(len(body.splitlines()), 2)
+
+    def test_export_unknown_format(self):
+        """
+        Ensure unsupported formats are rejected.
+        """
+        response = self.client.get(self.url, {'format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ImportClientsCommandTests(TestCase):
+    def setUp(self):
+        """Set up an existing program and a scratch directory for input files."""
+        self.program_tb = Program.objects.create(name="TB Care")
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+
+    def _import(self, *args, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_clients', *args, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_csv_with_programs(self):
+        """
+        Ensure CSV rows (in the export format) are imported with their enrollments.
+        """
+        path = self._write('clients.csv', (
+            'id,name,date_of_birth,contact_info,enrolled_programs\n'
+            '7,Imported One,1990-01-01,one@example.com,TB Care\n'
+            '8,Imported Two,1991-01-01,,TB Care;HIV Support\n'
+            '9,Bad Date,not-a-date,,\n'
+        ))
+        out, err = self._import(path, batch_size=2, create_programs=True)
+        self.assertIn('rows/s', out)
+        self.assertEqual(Client.objects.count(), 2)
+        self.assertEqual(Program.objects.filter(name='HIV Support').count(), 1) # Created once
+        two = Client.objects.get(name='Imported Two')
+        self.assertEqual(set(two.enrolled_programs.values_list('name', flat=True)), {'TB Care', 'HIV Support'})
+        self.assertEqual(json.loads(err.strip())['row'], 3)
+
+    def test_import_rejects_unknown_programs_by_default(self):
+        """
+        Ensure unknown program names reject the row unless --create-programs is given.
+        """
+        path = self._write('clients.ndjson', (
+            '{"name": "Known", "date_of_birth": "1990-01-01", "enrolled_programs": [{"id": 1, "name": "TB Care"}]}\n'
+            '{"name": "Unknown", "date_of_birth": "1990-01-01", "enrolled_programs": ["Polio"]}\n'
+        ))
+        out, err = self._import(path)
+        self.assertEqual(list(Client.objects.values_list('name', flat=True)), ['Known'])
+        self.assertIn("Program 'Polio' not found.", err)
+
+    def test_import_resumes_from_checkpoint(self):
+        """
+        Ensure --resume skips the rows recorded in the checkpoint.
+        """
+        path = self._write('clients.ndjson', ''.join(
+            json.dumps({'name': f'Row {index}', 'date_of_birth': '1990-01-01'}) + '\n'
+            for index in range(5)
+        ))
+        ImportCheckpoint.objects.create(name='clients', path=path, rows=3)
+        self._import(path, checkpoint='clients', resume=True, batch_size=1)
+        self.assertEqual(sorted(Client.objects.values_list('name', flat=True)), ['Row 3', 'Row 4'])
+        self.assertEqual(ImportCheckpoint.objects.get(name='clients').rows, 5)
+
+    def test_checkpoint_commits_with_its_batch(self):
+        """
+        Ensure a batch that fails to commit leaves the checkpoint at the previous batch.
+        """
+        path = self._write('clients.ndjson', ''.join(
+            json.dumps({'name': f'Row {index}', 'date_of_birth': '1990-01-01'}) + '\n'
+            for index in range(4)
+        ))
+        real_insert = insert_clients
+        def crash_on_second_batch(pending, batch_size):
+            if pending[0][0].name == 'Row 2':
+                raise RuntimeError('crash')
+            return real_insert(pending, batch_size)
+        with unittest.mock.patch('afiya.management.commands.import_clients.insert_clients', crash_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                self._import(path, checkpoint='clients', batch_size=2)
+        self.assertEqual(ImportCheckpoint.objects.get(name='clients').rows, 2)
+        self._import(path, checkpoint='clients', resume=True, batch_size=2)
+        self.assertEqual(sorted(Client.objects.values_list('name', flat=True)), [f'Row {index}' for index in range(4)])
+
+    def test_failed_batch_does_not_cache_its_programs(self):
+        """
+        Ensure programs created by a batch are cached only once that batch commits.
+        """
+        command = ImportClientsCommand(stdout=io.StringIO(), stderr=io.StringIO())
+        command.batch_size, command.create_programs, command.program_ids = 10, True, {}
+        command.error_file, command.created, command.rejected = None, 0, 0
+        results = [(True, ({'name': 'New', 'date_of_birth': datetime.date(1990, 1, 1)}, ['Polio']))]
+        with unittest.mock.patch(
+            'afiya.management.commands.import_clients.insert_clients', side_effect=RuntimeError('crash'),
+        ):
+            with self.assertRaises(RuntimeError):
+                command.save_batch(0, results)
+        self.assertNotIn('Polio', command.program_ids)
+        self.assertFalse(Program.objects.filter(name='Polio').exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            command.save_batch(0, results)
+        polio = Program.objects.get(name='Polio')
+        self.assertEqual(command.program_ids['Polio'], polio.pk)
+        self.assertEqual(list(polio.clients.values_list('name', flat=True)), ['New'])
+
+    def test_import_from_stdin_leaves_it_open(self):
+        """
+        Ensure importing from '-' reads stdin without closing it.
+        """
+        stdin = io.StringIO(json.dumps({'name': 'Piped', 'date_of_birth': '1990-01-01'}) + '\n')
+        with unittest.mock.patch('sys.stdin', stdin):
+            self._import('-', format='ndjson')
+        self.assertFalse(stdin.closed)
+        self.assertEqual(list(Client.objects.values_list('name', flat=True)), ['Piped'])
+
+    def test_import_with_worker_processes(self):
+        """
+        Ensure parsing and validation can run in a process pool.
+        """
+        path = self._write('clients.ndjson', ''.join(
+            json.dumps({'name': f'Worker {index}', 'date_of_birth': '1990-01-01'}) + '\n'
+            for index in range(10)
+        ))
+        self._import(path, workers=2, batch_size=3)
+        self.assertEqual(Client.objects.count(), 10)
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    """The load test drives the API from worker threads, which only see committed rows."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _loadtest(self, *args, **options):
+        out = io.StringIO()
+        options = {'clients': 30, 'programs': 4, 'requests': 6, 'warmup': 1, 'concurrency': 1, **options}
+        call_command('loadtest', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_report_covers_scenarios_and_cleans_up(self):
+        """
+        Ensure every scenario is reported as JSON with req/s and latency percentiles,
+        and the seeded dataset and temporary user are removed afterwards.
+        """
+        path = os.path.join(self.tmpdir.name, 'report.json')
+        self._loadtest(scenario=['list', 'search', 'retrieve', 'enroll', 'programs'], output=path)
+        with open(path, encoding='utf-8') as handle:
+            report = json.load(handle)
+        self.assertEqual(report['dataset']['clients'], 30)
+        self.assertEqual(set(report['scenarios']), {'list', 'search', 'retrieve', 'enroll', 'programs'})
+        for result in report['scenarios'].values():
+            self.assertEqual(result['requests'], 6)
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['req_per_sec'], 0)
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+        self.assertFalse(Client.objects.exists())
+        self.assertFalse(Program.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+    def test_in_process_login_is_not_throttled(self):
+        """
+        Ensure in-process login requests all succeed, well beyond the per-username login rate.
+        """
+        path = os.path.join(self.tmpdir.name, 'report.json')
+        self._loadtest(scenario=['login'], requests=15, output=path)
+        with open(path, encoding='utf-8') as handle:
+            login = json.load(handle)['scenarios']['login']
+        self.assertEqual(login['status'], {'200': 15})
+        self.assertEqual((login['requests'], login['throttled']), (15, 0))
+
+    def test_throttled_requests_are_left_out_of_latency(self):
+        """
+        Ensure 429 answers are counted separately from the served requests' figures.
+        """
+        result = summarize([0.2, 0.1], Counter({200: 2, 429: 3}), 1.0)
+        self.assertEqual((result['requests'], result['errors'], result['throttled']), (2, 0, 3))
+        self.assertEqual(result['latency_ms']['max'], 200.0)
+
+    def test_baseline_regression_fails(self):
+        """
+        Ensure --max-regression fails the run when a scenario is slower than the baseline.
+        """
+        baseline = os.path.join(self.tmpdir.name, 'baseline.json')
+        with open(baseline, 'w', encoding='utf-8') as handle:
+            json.dump({'scenarios': {'programs': {'req_per_sec': 10 ** 9, 'latency_ms': {'p95': 0.001}}}}, handle)
+        with self.assertRaisesMessage(CommandError, 'Regressed by more than 10'):
+            self._loadtest(scenario=['programs'], baseline=baseline, max_regression=10)
+        output = self._loadtest(scenario=['programs'], baseline=baseline)
+        self.assertIn('programs: req/s', output)
+
+
+class ProgramStatsTests(APITestCase):
+    def setUp(self):
+        """Set up programs, clients and enrollments through the usual ORM paths."""
+        self.user = User.objects.create_user(username='testuser_stats', password='password123')
+        self.tb = Program.objects.create(name='TB')
+        self.hiv = Program.objects.create(name='HIV')
+        this_year = datetime.date.today().year
+        self.child = Client.objects.create(name='Child Client', date_of_birth=datetime.date(this_year - 3, 1, 1))
+        self.adult = Client.objects.create(name='Adult Client', date_of_birth=datetime.date(this_year - 40, 6, 1))
+        self.child.enrolled_programs.add(self.tb, self.hiv)
+        self.tb.clients.add(self.adult)
+        self.url = reverse('program-stats')
+        self.client.force_authenticate(user=self.user)
+
+    def _stats(self, **params):
+        response = self.client.get(self.url, params, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {program['name']: program for program in response.data}
+
+    def test_stats_counts_age_bands_and_daily_enrollments(self):
+        """
+        Ensure the stats endpoint reports totals, age bands and today's enrollments.
+        """
+        stats = self._stats()
+        self.assertEqual(stats['TB']['enrolled'], 2)
+        self.assertEqual(stats['TB']['age_bands']['0-4'], 1)
+        self.assertEqual(stats['TB']['age_bands']['35-49'], 1)
+        self.assertEqual(stats['HIV']['enrolled'], 1)
+        self.assertEqual(
+            stats['TB']['new_enrollments_per_day'],
+            [{'date': datetime.date.today(), 'count': 2}]
+        )
+
+    def test_stats_query_count_is_independent_of_clients(self):
+        """
+        Ensure the endpoint reads counters rather than clients.
+        """
+        with self.assertNumQueries(3):
+            self.client.get(self.url, format='json')
+        for index in range(20):
+            client = Client.objects.create(name=f'Extra {index}', date_of_birth=datetime.date(2000, 1, 1))
+            client.enrolled_programs.add(self.hiv)
+        with self.assertNumQueries(3):
+            self.assertEqual(self._stats()['HIV']['enrolled'], 21)
+
+    def test_stats_follow_removals_deletes_and_birth_date_edits(self):
+        """
+        Ensure unenrolling, deleting clients and editing a birth date keep counters in step.
+        """
+        self.tb.clients.remove(self.child, self.child) # Repeated ids count once
+        self.child.enrolled_programs.remove(self.tb) # Not enrolled any more: no change
+        self.assertEqual(self._stats()['TB']['enrolled'], 1)
+
+        self.adult.date_of_birth = datetime.date(datetime.date.today().year - 10, 1, 1)
+        self.adult.save()
+        self.assertEqual(self._stats()['TB']['age_bands']['5-14'], 1)
+        self.assertEqual(self._stats()['TB']['age_bands']['35-49'], 0)
+
+        self.child.enrolled_programs.clear()
+        self.adult.delete()
+        stats = self._stats()
+        self.assertEqual(stats['TB']['enrolled'], 0)
+        self.assertEqual(stats['HIV']['enrolled'], 0)
+
+    def test_stats_follow_bulk_enrollment(self):
+        """
+        Ensure the bulk enrollment endpoint updates the counters too.
+        """
+        url = reverse('program-enroll-bulk', kwargs={'pk': self.hiv.pk})
+        self.client.post(url, {'client_ids': [self.child.id, self.adult.id]}, format='json')
+        self.assertEqual(self._stats()['HIV']['enrolled'], 2)
+
+    def test_reconcile_command_rebuilds_counters(self):
+        """
+        Ensure reconcile_program_stats recomputes counters from enrollments.
+        """
+        ProgramBirthYearCount.objects.update(count=99)
+        call_command('reconcile_program_stats', stdout=io.StringIO())
+        stats = self._stats()
+        self.assertEqual(stats['TB']['enrolled'], 2)
+        self.assertEqual(stats['HIV']['enrolled'], 1)
+
+    def test_stats_invalid_days(self):
+        """
+        Ensure a non-integer days parameter is rejected.
+        """
+        response = self.client.get(self.url, {'days': 'abc'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProgramCacheTests(APITestCase):
+    def setUp(self):
+        """Set up programs and an empty cache."""
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser_cache', password='password123')
+        self.tb = Program.objects.create(name='TB')
+        self.hiv = Program.objects.create(name='HIV')
+        self.list_url = reverse('program-list')
+        self.detail_url = reverse('program-detail', kwargs={'pk': self.tb.pk})
+        self.client.force_authenticate(user=self.user)
+
+    def test_list_served_from_cache(self):
+        """
+        Ensure a repeated program list is answered without touching the database.
+        """
+        first = self.client.get(self.list_url, format='json')
+        with self.assertNumQueries(0):
+            second = self.client.get(self.list_url, format='json')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        """
+        Ensure a matching If-None-Match gets an empty 304 with the same ETag.
+        """
+        etag = self.client.get(self.detail_url, format='json')['ETag']
+        response = self.client.get(self.detail_url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_writes_invalidate_cached_responses(self):
+        """
+        Ensure saving or deleting a program invalidates cached list and detail responses.
+        """
+        old_etag = self.client.get(self.list_url, format='json')['ETag']
+        self.client.get(self.detail_url, format='json')
+        self.client.patch(self.detail_url, {'name': 'Tuberculosis'}, format='json')
+
+        response = self.client.get(self.list_url, format='json', HTTP_IF_NONE_MATCH=old_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Tuberculosis', [program['name'] for program in response.data])
+        self.assertEqual(self.client.get(self.detail_url, format='json').data['name'], 'Tuberculosis')
+
+        self.tb.delete()
+        self.assertEqual(self.client.get(self.detail_url, format='json').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cache_still_requires_authentication(self):
+        """
+        Ensure cached responses are not served to unauthenticated requests.
+        """
+        self.client.get(self.list_url, format='json')
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.list_url, format='json')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+
+class ClientConditionalGetTests(APITestCase):
+    def setUp(self):
+        """Set up an enrolled client."""
+        self.user = User.objects.create_user(username='testuser_conditional', password='password123')
+        self.tb = Program.objects.create(name='TB')
+        self.hiv = Program.objects.create(name='HIV')
+        self.test_client = Client.objects.create(name='Neema Atieno', date_of_birth=datetime.date(1992, 4, 5))
+        self.test_client.enrolled_programs.add(self.tb)
+        self.url = reverse('client-detail', kwargs={'pk': self.test_client.pk})
+        self.client.force_authenticate(user=self.user)
+
+    def _etag(self):
+        response = self.client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['ETag']
+
+    def test_if_none_match_returns_304_after_one_query(self):
+        """
+        Ensure an unchanged client is answered with 304 from a single lookup.
+        """
+        etag = self._etag()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_if_modified_since(self):
+        """
+        Ensure If-Modified-Since is honoured using the Last-Modified header.
+        """
+        last_modified = self.client.get(self.url, format='json')['Last-Modified']
+        response = self.client.get(self.url, format='json', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, format='json', HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_edits_and_enrollment_changes_change_etag(self):
+        """
+        Ensure field edits, enrollment changes and program renames all produce a new ETag.
+        """
+        etags = [self._etag()]
+        self.client.patch(self.url, {'contact_info': '0722 000000'}, format='json')
+        etags.append(self._etag())
+        self.hiv.clients.add(self.test_client)
+        etags.append(self._etag())
+        self.test_client.enrolled_programs.remove(self.tb)
+        etags.append(self._etag())
+        self.hiv.name = 'HIV/AIDS'
+        self.hiv.save()
+        etags.append(self._etag())
+        self.assertEqual(len(set(etags)), len(etags))
+
+        response = self.client.get(self.url, format='json', HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['enrolled_programs'], [{'id': self.hiv.id, 'name': 'HIV/AIDS'}])
+
+    def test_unchanged_enrollments_keep_etag(self):
+        """
+        Ensure re-adding an existing enrollment runs no update and keeps the ETag.
+        """
+        etag = self._etag()
+        updated_at = Client.objects.get(pk=self.test_client.pk).updated_at
+        with CaptureQueriesContext(connection) as queries:
+            self.test_client.enrolled_programs.add(self.tb)
+            self.tb.clients.add(self.test_client)
+        self.assertFalse(any(query['sql'].startswith('UPDATE') for query in queries.captured_queries))
+        self.assertEqual(Client.objects.get(pk=self.test_client.pk).updated_at, updated_at)
+        self.assertEqual(self._etag(), etag)
+
+    def test_missing_client_with_validators(self):
+        """
+        Ensure conditional requests for a missing client still return 404.
+        """
+        url = reverse('client-detail', kwargs={'pk': 99999})
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH='"anything"')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CachedAuthenticationTests(APITestCase):
+    def setUp(self):
+        """Set up a user with a token and empty caches."""
+        cache.clear()
+        auth_cache.clear()
+        self.user = User.objects.create_user(username='testuser_authcache', password='password123')
+        self.token = Token.objects.create(user=self.user)
+        Program.objects.create(name='TB')
+        self.url = reverse('program-list')
+
+    def test_warm_token_request_makes_no_queries(self):
+        """
+        Ensure a repeated token-authenticated request skips the token lookup.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(self.client.get(self.url, format='json').status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_warm_session_request_makes_no_queries(self):
+        """
+        Ensure a repeated session-authenticated request skips the session and user reads.
+        """
+        self.client.login(username='testuser_authcache', password='password123')
+        self.assertEqual(self.client.get(self.url, format='json').status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deleted_token_is_rejected(self):
+        """
+        Ensure deleting a token invalidates its cached user.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.client.get(self.url, format='json')
+        self.token.delete()
+        response = self.client.get(self.url, format='json')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    def test_deactivation_and_password_change_invalidate(self):
+        """
+        Ensure flipping is_active or changing the password drops cached credentials.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.client.get(self.url, format='json')
+        self.user.is_active = False
+        self.user.save()
+        self.assertIn(
+            self.client.get(self.url, format='json').status_code,
+            (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+        )
+
+        self.client.credentials()
+        self.user.is_active = True
+        self.user.save()
+        self.client.login(username='testuser_authcache', password='password123')
+        self.client.get(self.url, format='json')
+        self.user.set_password('new-password456')
+        self.user.save()
+        self.assertIn(
+            self.client.get(self.url, format='json').status_code,
+            (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+        )
+
+    @override_settings(AFIYA_AUTH_CACHE_SHARED=True)
+    def test_shared_cache_serves_other_processes(self):
+        """
+        Ensure shared mode finds users cached by another process, and honours invalidation.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.client.get(self.url, format='json')
+        auth_cache.clear() # Simulate a fresh worker process sharing the cache
+        with self.assertNumQueries(0):
+            self.client.get(self.url, format='json')
+        auth_cache.clear()
+        self.token.delete()
+        self.assertIn(
+            self.client.get(self.url, format='json').status_code,
+            (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+        )
+
+
+@override_settings(AFIYA_PBKDF2_ITERATIONS=1000)
+class LoginTests(APITestCase):
+    def setUp(self):
+        """Set up a user with a cheap password hash and clear throttle counters."""
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser_login', password='password123')
+        self.url = reverse('api-login')
+
+    def test_login_returns_token_in_one_query(self):
+        """
+        Ensure a returning user logs in with a single query and keeps their token.
+        """
+        token = Token.objects.create(user=self.user)
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {'username': 'testuser_login', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['token'], token.key)
+
+    def test_first_login_creates_token(self):
+        """
+        Ensure a first login creates the user's token.
+        """
+        response = self.client.post(self.url, {'username': 'testuser_login', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['token'], Token.objects.get(user=self.user).key)
+
+    def test_invalid_credentials(self):
+        """
+        Ensure wrong passwords and unknown usernames are rejected alike.
+        """
+        for username in ('testuser_login', 'nobody'):
+            response = self.client.post(self.url, {'username': username, 'password': 'wrong'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(AFIYA_LOGIN_HASH_LIMIT_UNDER_WSGI=True)
+    def test_login_with_hash_limit(self):
+        """
+        Ensure logins work when concurrent password checks are limited, on the request thread.
+        """
+        threads = []
+        def check(*args):
+            threads.append(threading.get_ident())
+            return check_password(*args)
+        with unittest.mock.patch('afiya.login.check_password', check):
+            response = self.client.post(self.url, {'username': 'testuser_login', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(threads, [threading.get_ident()])
+
+    def test_hash_limit_turns_away_excess_logins(self):
+        """
+        Ensure logins beyond the hashing and waiting slots get 503 instead of queueing.
+        """
+        limiter = PasswordHashLimiter()
+        with override_settings(AFIYA_LOGIN_HASH_WORKERS=1, AFIYA_LOGIN_MAX_PENDING=0):
+            hashing = threading.Event()
+            release = threading.Event()
+            def slow_check():
+                hashing.set()
+                release.wait(5)
+                return True
+            worker = threading.Thread(target=limiter.run, args=(slow_check,))
+            worker.start()
+            try:
+                hashing.wait(5)
+                with self.assertRaises(LoginBusy):
+                    limiter.run(lambda: True)
+            finally:
+                release.set()
+                worker.join()
+            self.assertTrue(limiter.run(lambda: True))
+
+    def test_outdated_hash_is_upgraded(self):
+        """
+        Ensure a hash made at another cost is re-hashed at the configured cost on login.
+        """
+        with override_settings(AFIYA_PBKDF2_ITERATIONS=2000):
+            self.user.set_password('password123')
+            self.user.save()
+        self.client.post(self.url, {'username': 'testuser_login', 'password': 'password123'}, format='json')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password.split('$')[1], '1000')
+
+    def test_login_throttled_per_username(self):
+        """
+        Ensure repeated attempts against one username are throttled.
+        """
+        statuses = [
+            self.client.post(self.url, {'username': 'testuser_login', 'password': 'wrong'}, format='json').status_code
+            for _ in range(11)
+        ]
+        self.assertEqual(statuses[:10], [status.HTTP_400_BAD_REQUEST] * 10)
+        self.assertEqual(statuses[10], status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_successful_logins_are_not_throttled(self):
+        """
+        Ensure only failed attempts count towards a username's limit.
+        """
+        for _ in range(12):
+            response = self.client.post(self.url, {'username': 'testuser_login', 'password': 'password123'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        statuses = [
+            self.client.post(self.url, {'username': 'testuser_login', 'password': 'wrong'}, format='json').status_code
+            for _ in range(11)
+        ]
+        self.assertEqual(statuses[:10], [status.HTTP_400_BAD_REQUEST] * 10)
+        self.assertEqual(statuses[10], status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        """Set up clients, programs and a token user for the async endpoints."""
+        cache.clear()
+        auth_cache.clear()
+        self.user = User.objects.create_user(username='testuser_async', password='password123')
+        self.token = Token.objects.create(user=self.user)
+        self.tb = Program.objects.create(name='TB')
+        dob = datetime.date(1985, 3, 2)
+        self.amina = Client.objects.create(name='Amina Hassan', date_of_birth=dob, contact_info='0711 222333')
+        self.brian = Client.objects.create(name='Brian Mwangi', date_of_birth=dob)
+        self.amina.enrolled_programs.add(self.tb)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_async_list_and_search_match_drf(self):
+        """
+        Ensure the async list and search return the same JSON as the DRF views.
+        """
+        for async_name, name, params in (
+                ('async-client-list', 'client-list', {'page_size': 1}),
+                ('async-client-search', 'client-search', {'q': 'Amina'})):
+            async_response = self.client.get(reverse(async_name), params)
+            response = self.client.get(reverse(name), params, format='json')
+            self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+            expected = json.loads(response.content.decode().replace('/afiya/clients/', '/afiya/async/clients/'))
+            self.assertEqual(async_response.json(), expected)
+
+    def test_async_views_honour_fieldsets(self):
+        """
+        Ensure the async list, search and detail apply ?fields= / ?expand= like the DRF views.
+        """
+        detail = {'pk': self.amina.pk}
+        for async_name, name, kwargs, params in (
+                ('async-client-list', 'client-list', {}, {'fields': 'id,name'}),
+                ('async-client-list', 'client-list', {}, {'fields': 'name', 'expand': 'enrolled_programs'}),
+                ('async-client-search', 'client-search', {}, {'q': 'Amina', 'fields': 'contact_info'}),
+                ('async-client-detail', 'client-detail', detail, {'fields': 'id,date_of_birth'}),
+                ('async-client-list', 'client-list', {}, {'fields': 'id,password'})):
+            with self.subTest(view=async_name, params=params):
+                async_response = self.client.get(reverse(async_name, kwargs=kwargs), params)
+                response = self.client.get(reverse(name, kwargs=kwargs), params, format='json')
+                self.assertEqual(async_response.status_code, response.status_code)
+                expected = json.loads(response.content.decode().replace('/afiya/clients/', '/afiya/async/clients/'))
+                self.assertEqual(async_response.json(), expected)
+
+    def test_async_detail_and_conditional_get(self):
+        """
+        Ensure the async detail view serializes the client and honours If-None-Match.
+        """
+        url = reverse('async-client-detail', kwargs={'pk': self.amina.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.json()['enrolled_programs'], [{'id': self.tb.id, 'name': 'TB'}])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        missing = self.client.get(reverse('async-client-detail', kwargs={'pk': 99999}))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_async_enroll(self):
+        """
+        Ensure enrolling through the async view works and validates the program.
+        """
+        url = reverse('async-client-enroll', kwargs={'pk': self.brian.pk})
+        response = self.client.post(url, {'program_id': self.tb.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['enrolled_programs'], [{'id': self.tb.id, 'name': 'TB'}])
+        response = self.client.post(url, {'program_id': 99999}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('program_id', response.json())
+
+    def test_async_program_list_shares_cache_and_etag(self):
+        """
+        Ensure the async program list matches the DRF one, ETag included.
+        """
+        response = self.client.get(reverse('program-list'), format='json')
+        async_response = self.client.get(reverse('async-program-list'))
+        self.assertEqual(async_response.json(), [{'id': self.tb.id, 'name': 'TB'}])
+        self.assertEqual(async_response['ETag'], response['ETag'])
+
+    def test_async_fallback_and_authentication(self):
+        """
+        Ensure unimplemented methods reach the DRF view and anonymous requests are refused.
+        """
+        response = self.client.post(
+            reverse('async-client-list'),
+            {'name': 'Zawadi Achieng', 'date_of_birth': '2001-02-03'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.credentials()
+        response = self.client.get(reverse('async-client-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class EventStreamTests(APITestCase):
+    def setUp(self):
+        """Set up a session user, a program and a client whose changes are published."""
+        cache.clear()
+        auth_cache.clear()
+        self.user = User.objects.create_user(username='testuser_events', password='password123')
+        self.program = Program.objects.create(name='TB Care')
+        self.patient = Client.objects.create(name='Amina Hassan', date_of_birth=datetime.date(1985, 3, 2))
+        self.client.force_authenticate(user=self.user)
+
+    def write_clients(self):
+        """Create, rename, enroll and delete clients through the API, running on-commit callbacks."""
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.client.post(
+                reverse('client-list'), {'name': 'Brian Mwangi', 'date_of_birth': '1990-01-01'}, format='json'
+            ).data
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('client-detail', kwargs={'pk': created['id']}), {'name': 'Brian M.'}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('client-enroll', kwargs={'pk': created['id']}), {'program_id': self.program.pk}, format='json'
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('client-detail', kwargs={'pk': self.patient.pk}))
+        return created['id']
+
+    async def test_writes_publish_compact_events(self):
+        """
+        Ensure client creates, updates, deletes and enrollments publish compact events after commit.
+        """
+        subscription = event_broker.subscribe()
+        try:
+            client_id = await sync_to_async(self.write_clients)()
+            events = await subscription.next_events(1)
+        finally:
+            subscription.close()
+        self.assertEqual([(event.kind, event.data) for event in events], [
+            ('client.created', {'id': client_id, 'name': 'Brian Mwangi'}),
+            ('client.updated', {'id': client_id, 'name': 'Brian M.'}),
+            ('enrollment.added', {'client_ids': [client_id], 'program_ids': [self.program.pk]}),
+            ('client.deleted', {'id': self.patient.pk}),
+        ])
+        self.assertEqual([event.id for event in events], sorted(event.id for event in events))
+
+    @override_settings(AFIYA_SSE_ENABLED=True)
+    async def test_stream_sends_events_as_sse(self):
+        """
+        Ensure /afiya/events/ streams published events to a session-authenticated EventSource.
+        """
+        await self.async_client.aforce_login(self.user)
+        subscribers = event_broker.subscriber_count
+        response = await self.async_client.get(reverse('events'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+
+        event_broker.publish('client.updated', {'id': 7, 'name': 'Amina H.'})
+        chunk = (await anext(stream)).decode()
+        self.assertEqual(
+            chunk, f'id: {event_broker.last_id}\nevent: client.updated\ndata: {{"id":7,"name":"Amina H."}}\n\n'
+        )
+        with override_settings(AFIYA_EVENTS_HEARTBEAT=0):
+            self.assertEqual(await anext(stream), b': keep-alive\n\n')
+        # A disconnect cancels the task streaming the response, which unsubscribes
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(event_broker.subscriber_count, subscribers)
+
+    async def test_resume_and_reset(self):
+        """
+        Ensure a reconnect replays the events after Last-Event-ID, and gets a reset when they are gone
+        or when it falls too far behind.
+        """
+        event_broker.publish_many([('client.deleted', {'id': number}) for number in (1, 2, 3)])
+        last_id = event_broker.last_id
+        resumed = event_broker.subscribe(last_event_id=last_id - 2)
+        unknown = event_broker.subscribe(last_event_id=last_id + 100)
+        with override_settings(AFIYA_EVENTS_QUEUE_SIZE=2):
+            slow = event_broker.subscribe()
+        try:
+            self.assertEqual([event.data['id'] for event in await resumed.next_events(1)], [2, 3])
+            self.assertEqual([event.kind for event in await unknown.next_events(1)], [RESET])
+            event_broker.publish_many([('client.deleted', {'id': number}) for number in (4, 5, 6)])
+            self.assertEqual([event.kind for event in await slow.next_events(1)], [RESET])
+            self.assertEqual(await slow.next_events(0.01), [])
+        finally:
+            for subscription in (resumed, unknown, slow):
+                subscription.close()
+
+    @override_settings(AFIYA_SSE_ENABLED=True)
+    def test_wsgi_request_gets_no_content(self):
+        """
+        Ensure a request through the sync (WSGI) client is answered 204 at once instead of streaming forever.
+        """
+        self.client.force_login(self.user)
+        subscribers = event_broker.subscriber_count
+        response = self.client.get(reverse('events'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(response.streaming)
+        self.assertEqual(event_broker.subscriber_count, subscribers)
+
+    async def test_disabled_stream_gets_no_content(self):
+        """
+        Ensure the stream is off by default, even under ASGI, and the profile tells the dashboard so.
+        """
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('events'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        profile = await self.async_client.get(reverse('user-profile'))
+        self.assertIs(profile.json()['live_updates'], False)
+
+    def test_stream_requires_authentication(self):
+        """
+        Ensure unauthenticated requests cannot subscribe.
+        """
+        self.client.force_authenticate(user=None)
+        response = self.client.get(reverse('events'))
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+
+class SyncTests(APITestCase):
+    def setUp(self):
+        """Set up programs, clients and enrollments, then authenticate."""
+        self.user = User.objects.create_user(username='testuser_sync', password='password123')
+        self.tb = Program.objects.create(name='TB')
+        self.hiv = Program.objects.create(name='HIV')
+        dob = datetime.date(1990, 5, 17)
+        self.alice = Client.objects.create(name='Alice Sync', date_of_birth=dob, contact_info='0700')
+        self.bob = Client.objects.create(name='Bob Sync', date_of_birth=dob)
+        self.alice.enrolled_programs.add(self.tb, self.hiv)
+        self.url = reverse('sync')
+        self.client.force_authenticate(user=self.user)
+
+    def _sync(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_sync_from_start_returns_everything(self):
+        """
+        Ensure a sync without a token returns every client, program and enrollment.
+        """
+        data = self._sync()
+        self.assertFalse(data['more'])
+        self.assertFalse(data['reset'])
+        self.assertEqual(
+            data['clients'][0],
+            {'id': self.alice.id, 'name': 'Alice Sync', 'date_of_birth': '1990-05-17', 'contact_info': '0700'}
+        )
+        self.assertEqual([client['id'] for client in data['clients']], [self.alice.id, self.bob.id])
+        self.assertEqual(data['programs'], [{'id': self.tb.id, 'name': 'TB'}, {'id': self.hiv.id, 'name': 'HIV'}])
+        self.assertEqual(data['enrollments'], [[self.alice.id, self.tb.id], [self.alice.id, self.hiv.id]])
+        self.assertEqual(data['deleted'], {'clients': [], 'programs': [], 'enrollments': []})
+        # Nothing changed since: an empty page and the same token
+        again = self._sync(data['token'])
+        self.assertEqual(again['token'], data['token'])
+        self.assertEqual((again['clients'], again['programs'], again['enrollments']), ([], [], []))
+
+    def test_sync_returns_only_changes_with_tombstones(self):
+        """
+        Ensure an incremental sync returns just what changed since the token, deletions included.
+        """
+        token = self._sync()['token']
+        carol = Client.objects.create(name='Carol Sync', date_of_birth=datetime.date(2001, 1, 1))
+        self.hiv.name = 'HIV Care'
+        self.hiv.save()
+        self.bob.enrolled_programs.add(self.tb)
+        self.alice.enrolled_programs.remove(self.hiv)
+        bob_id = self.bob.id
+        self.bob.delete()
+
+        data = self._sync(token)
+        self.assertEqual([client['id'] for client in data['clients']], [carol.id])
+        self.assertEqual(data['programs'], [{'id': self.hiv.id, 'name': 'HIV Care'}])
+        self.assertEqual(data['enrollments'], []) # Bob's new enrollment went with Bob
+        self.assertEqual(data['deleted']['clients'], [bob_id])
+        self.assertEqual(data['deleted']['enrollments'], [[self.alice.id, self.hiv.id]])
+        self.assertGreater(int(data['token']), int(token))
+
+    def test_cleared_and_bulk_enrollments_are_logged(self):
+        """
+        Ensure clear() and bulk enrollment (sent by hand, not by the ORM) reach the log.
+        """
+        token = self._sync()['token']
+        self.alice.enrolled_programs.clear()
+        url = reverse('program-enroll-bulk', kwargs={'pk': self.hiv.pk})
+        self.client.post(url, {'client_ids': [self.bob.id]}, format='json')
+        data = self._sync(token)
+        self.assertEqual(data['enrollments'], [[self.bob.id, self.hiv.id]])
+        self.assertEqual(data['deleted']['enrollments'], [[self.alice.id, self.tb.id], [self.alice.id, self.hiv.id]])
+
+    def test_sync_pages_with_limit(self):
+        """
+        Ensure a limited sync reports 'more' and the pages add up to the full sync.
+        """
+        full = self._sync()
+        token, pages, client_ids = None, 0, []
+        while True:
+            data = self._sync(token, limit=2)
+            pages += 1
+            client_ids += [client['id'] for client in data['clients']]
+            token = data['token']
+            if not data['more']:
+                break
+        self.assertEqual(pages, 3) # 2 programs, 2 clients, 2 enrollments
+        self.assertEqual(client_ids, [client['id'] for client in full['clients']])
+        self.assertEqual(token, full['token'])
+
+    def test_rolled_back_change_is_not_logged(self):
+        """
+        Ensure the change log entry is written in the same transaction as the change.
+        """
+        token = self._sync()['token']
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Client.objects.create(name='Never Committed', date_of_birth=datetime.date(2000, 1, 1))
+                raise RuntimeError
+        self.assertEqual(self._sync(token)['clients'], [])
+
+    def test_compact_changelog_keeps_sync_results(self):
+        """
+        Ensure compaction drops superseded entries without changing what a sync returns.
+        """
+        for index in range(3):
+            self.bob.name = f'Bob Sync {index}'
+            self.bob.save()
+        before = self._sync()
+        call_command('compact_changelog', stdout=io.StringIO())
+        self.assertEqual(ChangeLog.objects.filter(kind=ChangeLog.CLIENT, object_id=self.bob.id).count(), 1)
+        self.assertEqual(self._sync(), before)
+
+    def test_bulk_batch_appends_log_once(self):
+        """
+        Ensure a bulk registration batch logs its clients and enrollments in one insert, numbered at once.
+        """
+        token = self._sync()['token']
+        rows = [
+            {'name': f'Bulk Sync {index}', 'date_of_birth': '1990-01-01',
+             'enrolled_program_ids': [self.tb.id, self.hiv.id][:index % 2 + 1]}
+            for index in range(4)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('client-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        inserts = [query for query in queries.captured_queries if query['sql'].startswith('INSERT INTO "afiya_changelog"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertFalse(ChangeLog.objects.filter(seq__isnull=True).exists())
+        data = self._sync(token)
+        self.assertEqual(len(data['clients']), 4)
+        self.assertEqual(len(data['enrollments']), 6)
+
+    def test_bad_and_unknown_tokens(self):
+        """
+        Ensure malformed tokens are rejected and tokens from elsewhere ask for a reset.
+        """
+        response = self.client.get(self.url, {'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        last = int(self._sync()['token'])
+        data = self._sync(last + 1000)
+        self.assertTrue(data['reset'])
+        self.assertEqual(data['token'], '0')
+
+    def test_sync_requires_authentication(self):
+        """
+        Ensure unauthenticated users cannot sync.
+        """
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url)
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+
+class ChangeLogCommitOrderTests(TransactionTestCase):
+    """Writers in other threads commit on their own connections (PostgreSQL numbers entries at commit)."""
+
+    def setUp(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Commit-time numbering of change log entries is PostgreSQL-only')
+
+    def test_open_writer_neither_blocks_nor_is_skipped(self):
+        """
+        Ensure a transaction holding log entries open does not block other writers,
+        and a sync that read past them still gets its changes once it commits.
+        """
+        inserted, release = threading.Event(), threading.Event()
+        def slow_writer():
+            try:
+                with transaction.atomic():
+                    Program.objects.create(name='Slow')
+                    inserted.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+        writer = threading.Thread(target=slow_writer)
+        writer.start()
+        self.assertTrue(inserted.wait(10))
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET lock_timeout = '2s'") # Waiting on the writer fails instead of hanging
+            Program.objects.create(name='Fast')
+            first = changes_since(0)
+        finally:
+            release.set()
+            writer.join()
+            with connection.cursor() as cursor:
+                cursor.execute('RESET lock_timeout')
+        self.assertEqual([program['name'] for program in first['programs']], ['Fast'])
+        later = changes_since(parse_token(first['token']))
+        self.assertEqual([program['name'] for program in later['programs']], ['Slow'])
+
+
+@override_settings(AFIYA_READ_REPLICAS=['replica_a', 'replica_b'])
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self):
+        """Set up a user, a client and a program; requests run through the routing middleware."""
+        self.user = User.objects.create_user(username='testuser_replicas', password='password123')
+        self.program = Program.objects.create(name='TB')
+        self.patient = Client.objects.create(name='Replica Client', date_of_birth=datetime.date(1990, 1, 1))
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def _in_request(self, view, cookies=None):
+        """Run `view()` inside ReplicaRoutingMiddleware; returns (view result, response)."""
+        request = self.factory.get('/afiya/clients/')
+        request.COOKIES.update(cookies or {})
+        result = {}
+
+        def get_response(request):
+            result['value'] = view()
+            return HttpResponse()
+        response = ReplicaRoutingMiddleware(get_response)(request)
+        return result['value'], response
+
+    def test_reads_use_one_replica_per_request_round_robin(self):
+        """
+        Ensure opted-in reads of afiya models go to one replica per request, alternating between requests.
+        """
+        def reads():
+            use_replicas()
+            return [self.router.db_for_read(model) for model in (Client, Program, Client)]
+        first, _ = self._in_request(reads)
+        second, _ = self._in_request(reads)
+        self.assertEqual(len(set(first)), 1)
+        self.assertEqual(len(set(second)), 1)
+        self.assertEqual({first[0], second[0]}, {'replica_a', 'replica_b'})
+
+    def test_primary_reads(self):
+        """
+        Ensure reads stay on the primary without opting in, outside requests, for other apps and in primary_reads().
+        """
+        self.assertIsNone(self.router.db_for_read(Client)) # No request
+        self.assertIsNone(self._in_request(lambda: self.router.db_for_read(Client))[0])
+
+        def other_app():
+            use_replicas()
+            return self.router.db_for_read(User)
+        self.assertIsNone(self._in_request(other_app)[0])
+
+        def filling_cache():
+            use_replicas()
+            with primary_reads():
+                return self.router.db_for_read(Client)
+        self.assertIsNone(self._in_request(filling_cache)[0])
+
+    def test_write_pins_request_and_sets_cookie(self):
+        """
+        Ensure a write sends the rest of the request to the primary and pins the browser with a cookie.
+        """
+        def write_then_read():
+            use_replicas()
+            before = self.router.db_for_read(Client)
+            self.assertEqual(self.router.db_for_write(Client), 'default')
+            return before, self.router.db_for_read(Client)
+        (before, after), response = self._in_request(write_then_read)
+        self.assertIn(before, ('replica_a', 'replica_b'))
+        self.assertIsNone(after)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.AFIYA_REPLICA_PIN_SECONDS)
+
+        def read():
+            use_replicas()
+            return self.router.db_for_read(Client)
+        self.assertIsNone(self._in_request(read, cookies={PIN_COOKIE: '1'})[0])
+        # Writing a session or token (other apps) does not pin
+        _, response = self._in_request(lambda: self.router.db_for_write(User))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    @override_settings(AFIYA_READ_REPLICAS=['default'])
+    def test_viewsets_route_safe_requests(self):
+        """
+        Ensure GETs on the client and program endpoints read from the replica, and writes pin to the primary.
+        """
+        routed = []
+        original = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            alias = original(router, model, **hints)
+            routed.append(alias)
+            return alias
+        self.client.force_authenticate(user=self.user)
+        with unittest.mock.patch.object(ReplicaRouter, 'db_for_read', autospec=True, side_effect=spy):
+            for url in (reverse('client-list'), reverse('client-detail', kwargs={'pk': self.patient.pk}), reverse('program-stats')):
+                routed.clear()
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+                self.assertIn('default', routed, url) # Chosen as the replica, not left to the default
+
+            routed.clear()
+            response = self.client.post(
+                reverse('client-list'), {'name': 'New Client', 'date_of_birth': '1999-01-01'}, format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertNotIn('default', routed)
+            self.assertIn(PIN_COOKIE, response.cookies)
+
+            routed.clear()
+            self.client.get(reverse('client-list')) # Carries the pin cookie
+            self.assertNotIn('default', routed)
+
+
+class ClientBatchTests(APITestCase):
+    def setUp(self):
+        """Set up a few enrolled clients."""
+        self.user = User.objects.create_user(username='testuser_batch', password='password123')
+        self.tb = Program.objects.create(name='TB')
+        self.hiv = Program.objects.create(name='HIV')
+        self.clients = [
+            Client.objects.create(name=f'Batch Client {i}', date_of_birth=datetime.date(1990, 1, i + 1))
+            for i in range(5)
+        ]
+        self.clients[0].enrolled_programs.add(self.tb, self.hiv)
+        self.clients[3].enrolled_programs.add(self.hiv)
+        self.url = reverse('client-batch')
+        self.client.force_authenticate(user=self.user)
+
+    def test_get_preserves_order_in_two_queries(self):
+        """
+        Ensure profiles come back in request order, with programs, using two queries.
+        """
+        ids = [self.clients[3].pk, self.clients[0].pk, self.clients[1].pk]
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'ids': ','.join(map(str, ids))}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([client['id'] for client in response.data['results']], ids)
+        self.assertEqual([p['name'] for p in response.data['results'][0]['enrolled_programs']], ['HIV'])
+        self.assertEqual(len(response.data['results'][1]['enrolled_programs']), 2)
+        self.assertEqual(response.data['not_found'], [])
+
+    def test_post_reports_missing_ids(self):
+        """
+        Ensure unknown ids are reported instead of failing, and repeated ids are returned once.
+        """
+        missing = max(client.pk for client in self.clients) + 100
+        ids = [self.clients[2].pk, missing, self.clients[4].pk, self.clients[2].pk]
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([client['id'] for client in response.data['results']], [self.clients[2].pk, self.clients[4].pk])
+        self.assertEqual(response.data['not_found'], [missing])
+
+    def test_invalid_requests(self):
+        """
+        Ensure missing, empty, non-integer and oversized id lists are rejected with 400.
+        """
+        self.assertEqual(self.client.get(self.url, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'ids': ''}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'ids': '1,x'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        with self.settings(AFIYA_CLIENT_BATCH_MAX_IDS=2):
+            response = self.client.post(self.url, {'ids': [1, 2, 3]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_requires_authentication(self):
+        """
+        Ensure the batch endpoint requires authentication.
+        """
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url, {'ids': str(self.clients[0].pk)}, format='json')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+
+class ClientFieldsetTests(APITestCase):
+    def setUp(self):
+        """Set up enrolled clients."""
+        self.user = User.objects.create_user(username='testuser_fieldsets', password='password123')
+        self.tb = Program.objects.create(name='TB')
+        self.clients = [
+            Client.objects.create(name=f'Fieldset Client {i}', date_of_birth=datetime.date(1985, 6, i + 1), contact_info=f'07{i}')
+            for i in range(3)
+        ]
+        for client in self.clients:
+            client.enrolled_programs.add(self.tb)
+        self.url = reverse('client-list')
+        self.client.force_authenticate(user=self.user)
+
+    def test_fields_limit_response_and_skip_program_prefetch(self):
+        """
+        Ensure ?fields= returns only those fields from a single query without the programs prefetch.
+        """
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'fields': 'id,name'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 3)
+        for row in response.data['results']:
+            self.assertEqual(set(row), {'id', 'name'})
+
+    def test_expand_includes_programs(self):
+        """
+        Ensure ?expand=enrolled_programs adds the nested programs back (one more query).
+        """
+        self.client.get(self.url, {'fields': 'name', 'expand': 'enrolled_programs'}, format='json') # Caches program names
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'fields': 'name', 'expand': 'enrolled_programs'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        row = response.data['results'][0]
+        self.assertEqual(set(row), {'name', 'enrolled_programs'})
+        self.assertEqual(row['enrolled_programs'], [{'id': self.tb.pk, 'name': 'TB'}])
+
+    def test_pagination_with_fieldset(self):
+        """
+        Ensure cursor pagination still works when the ordering columns are not requested.
+        """
+        response = self.client.get(self.url, {'fields': 'contact_info', 'page_size': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['contact_info'] for row in response.data['results']], ['070', '071'])
+        response = self.client.get(response.data['next'], format='json')
+        self.assertEqual([row['contact_info'] for row in response.data['results']], ['072'])
+
+    def test_retrieve_search_and_batch(self):
+        """
+        Ensure retrieve, search and batch honour ?fields= too, and the default response is unchanged.
+        """
+        detail_url = reverse('client-detail', kwargs={'pk': self.clients[0].pk})
+        response = self.client.get(detail_url, {'fields': 'id,date_of_birth'}, format='json')
+        self.assertEqual(response.data, {'id': self.clients[0].pk, 'date_of_birth': '1985-06-01'})
+        self.assertIn('ETag', response)
+        response = self.client.get(reverse('client-search'), {'q': 'Fieldset', 'fields': 'name'}, format='json')
+        self.assertEqual({tuple(row) for row in response.data['results']}, {('name',)})
+        response = self.client.get(reverse('client-batch'), {'ids': str(self.clients[1].pk), 'fields': 'id'}, format='json')
+        self.assertEqual(response.data['results'], [{'id': self.clients[1].pk}])
+        response = self.client.get(detail_url, format='json')
+        self.assertEqual(set(response.data), {'id', 'name', 'date_of_birth', 'contact_info', 'enrolled_programs'})
+
+    def test_unknown_fields_rejected(self):
+        """
+        Ensure unknown ?fields= or ?expand= names return 400.
+        """
+        response = self.client.get(self.url, {'fields': 'id,password'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'fields': 'id', 'expand': 'doctor'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FastSerializerTests(APITestCase):
+    def setUp(self):
+        """Set up clients with varied enrollments."""
+        self.user = User.objects.create_user(username='testuser_fast', password='password123')
+        self.programs = [Program.objects.create(name=name) for name in ('Malaria', 'HIV', 'TB', 'Diabetes')]
+        self.clients = []
+        for i in range(7):
+            client = Client.objects.create(
+                name=f'Fast Client {i % 4}', date_of_birth=datetime.date(1970 + i, 12, 31), contact_info=f'contact {i}'
+            )
+            client.enrolled_programs.add(*self.programs[i % 3:i % 3 + i % 4])
+            self.clients.append(client)
+        self.client.force_authenticate(user=self.user)
+
+    def _both(self, url, params=None):
+        """Fetch `url` with the fast path off, then on; return both bodies."""
+        with self.settings(AFIYA_FAST_SERIALIZERS=False):
+            slow = self.client.get(url, params, format='json')
+        cache.clear() # Don't let the program list come back from the cache
+        fast = self.client.get(url, params, format='json')
+        self.assertEqual(slow.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        return slow.content, fast.content
+
+    def test_client_pages_are_byte_identical(self):
+        """
+        Ensure every list page, with and without fieldsets, renders the same bytes on both paths.
+        """
+        url = reverse('client-list')
+        for params in ({'page_size': 3}, {'page_size': 3, 'fields': 'id,date_of_birth'},
+                       {'page_size': 3, 'fields': 'name', 'expand': 'enrolled_programs'}):
+            slow, fast = self._both(url, params)
+            self.assertEqual(slow, fast)
+            next_url = json.loads(fast)['next']
+            slow, fast = self._both(next_url)
+            self.assertEqual(slow, fast)
+
+    def test_search_and_program_list_are_byte_identical(self):
+        """
+        Ensure search results and the program list render the same bytes on both paths.
+        """
+        self.assertEqual(*self._both(reverse('client-search'), {'q': 'Fast Client'}))
+        self.assertEqual(*self._both(reverse('client-search'), {'q': ''}))
+        self.assertEqual(*self._both(reverse('program-list')))
+
+    def test_program_rename_is_picked_up(self):
+        """
+        Ensure renamed programs show their new name (and position) in client pages.
+        """
+        url = reverse('client-list')
+        self.client.get(url, format='json')
+        self.programs[1].name = 'Zika'
+        self.programs[1].save()
+        slow, fast = self._both(url)
+        self.assertEqual(slow, fast)
+        self.assertIn(b'Zika', fast)
+
+    def test_list_uses_two_queries(self):
+        """
+        Ensure a full page costs one client query and one enrollment query once program names are cached.
+        """
+        url = reverse('client-list')
+        self.client.get(url, format='json')
+        with self.assertNumQueries(2):
+            response = self.client.get(url, format='json')
+        self.assertEqual(len(response.data['results']), 7)
+
+
+class FastJSONTests(APITestCase):
+    def setUp(self):
+        """Set up a user and a client with a non-ASCII name."""
+        self.user = User.objects.create_user(username='testuser_json', password='password123')
+        Client.objects.create(name='Wanjirũ Njoroge', date_of_birth=datetime.date(1994, 2, 28))
+        self.client.force_authenticate(user=self.user)
+
+    def test_renderer_matches_drf(self):
+        """
+        Ensure FastJSONRenderer produces the same bytes as DRF's JSONRenderer, natively or via fallbacks.
+        """
+        data = {
+            'date': datetime.date(2025, 1, 31),
+            'utc': datetime.datetime(2025, 1, 31, 8, 30, 0, 123456, tzinfo=datetime.timezone.utc),
+            'eat': datetime.datetime(2025, 1, 31, 8, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=3))),
+            'amount': decimal.Decimal('12.5'),
+            'text': 'Wanjirũ "quoted" \u2028 line',
+            'nested': [{'id': 1, 'values': (1, 2)}],
+            'wide': 2 ** 70,
+        }
+        expected = JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        with unittest.mock.patch('afiya.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_api_uses_fast_json(self):
+        """
+        Ensure API responses go through FastJSONRenderer and JSON bodies through FastJSONParser.
+        """
+        response = self.client.get(reverse('client-list'), format='json')
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        self.assertIn('Wanjirũ Njoroge'.encode('utf-8'), response.content)
+
+        response = self.client.post(
+            reverse('client-list'), '{"name": "Otieno", "date_of_birth": "2001-09-09"}', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('client-list'), '{"name": ', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('JSON parse error', response.data['detail'])
+
+    def test_parser_fallbacks(self):
+        """
+        Ensure the parser rejects NaN like DRF's and falls back to stdlib json without orjson.
+        """
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"value": NaN}'))
+        with unittest.mock.patch('afiya.parsers.orjson', None):
+            self.assertEqual(FastJSONParser().parse(io.BytesIO('{"name": "Wanjirũ"}'.encode('utf-8'))), {'name': 'Wanjirũ'})
+
+    def test_api_without_orjson(self):
+        """
+        Ensure the API reads and writes the same JSON when orjson is not installed.
+        """
+        expected = self.client.get(reverse('client-list'), format='json').content
+        with unittest.mock.patch('afiya.renderers.orjson', None), unittest.mock.patch('afiya.parsers.orjson', None):
+            self.assertEqual(self.client.get(reverse('client-list'), format='json').content, expected)
+            response = self.client.post(
+                reverse('client-list'), '{"name": "Achieng", "date_of_birth": "2002-02-02"}',
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(json.loads(response.content)['name'], 'Achieng')
+
+
+class QueryPlanTests(APITestCase):
+    """
+    EXPLAIN the queries behind the hot client endpoints and the admin
+    changelist on a seeded table (AFIYA_PLAN_TEST_ROWS, default 100000)
+    and fail on any sequential scan of afiya_client.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_clients(int(os.environ.get('AFIYA_PLAN_TEST_ROWS', '100000')))
+        cls.tb = Program.objects.create(name='TB')
+        cls.enrolled = Client.objects.create(name='Plan Enrolled Client', date_of_birth=datetime.date(1980, 3, 3))
+        cls.enrolled.enrolled_programs.add(cls.tb)
+        cls.user = User.objects.create_superuser(username='testadmin_plans', password='password123')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_client_list_pages(self):
+        """
+        Ensure list pages (first, next, sparse and serializer-rendered) walk the (name, id) index.
+        """
+        url = reverse('client-list')
+        with assert_indexed(self):
+            response = self.client.get(url, {'page_size': 50}, format='json')
+            self.client.get(response.data['next'], format='json')
+            self.client.get(url, {'fields': 'id,name'}, format='json')
+            with self.settings(AFIYA_FAST_SERIALIZERS=False):
+                self.client.get(url, format='json')
+
+    def test_client_search_and_lookups(self):
+        """
+        Ensure search, batch and retrieve use an index.
+        """
+        with assert_indexed(self):
+            response = self.client.get(reverse('client-search'), {'q': 'Seed 0042'}, format='json')
+            self.assertTrue(response.data['results'])
+            self.client.get(reverse('client-batch'), {'ids': f'{self.enrolled.pk},1,2'}, format='json')
+            self.client.get(reverse('client-detail', kwargs={'pk': self.enrolled.pk}), format='json')
+
+    def test_hot_filters(self):
+        """
+        Ensure date of birth ranges and exact contact lookups use their indexes.
+        """
+        with assert_indexed(self):
+            list(Client.objects.filter(date_of_birth__range=(datetime.date(1990, 1, 1), datetime.date(1990, 2, 1))))
+            list(Client.objects.filter(contact_info='0700000042'))
+
+    def test_admin_changelist(self):
+        """
+        Ensure the client changelist, its search and its program filter avoid sequential scans.
+        """
+        url = reverse('admin:afiya_client_changelist')
+        with assert_indexed(self):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            response = self.client.get(url, {'q': 'Plan Enrolled'})
+            self.assertContains(response, 'Plan Enrolled Client')
+            self.client.get(url, {'enrolled_programs__id__exact': self.tb.pk})
+
+    def test_detects_sequential_scans(self):
+        """
+        Ensure the helper itself reports an unindexed filter.
+        """
+        with self.assertRaises(AssertionError):
+            with assert_indexed(self):
+                list(Client.objects.filter(name__endswith='x').order_by())
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        """Set up a staff user, a client and a program, with empty metrics."""
+        self.user = User.objects.create_user(username='testuser_metrics', password='password123', is_staff=True)
+        self.program = Program.objects.create(name='TB')
+        self.test_client = Client.objects.create(name='Metric Client', date_of_birth=datetime.date(1991, 7, 7))
+        self.client.force_authenticate(user=self.user)
+        self.client.force_login(self.user)
+        metrics_registry.clear()
+        self.url = reverse('metrics')
+
+    def _metrics(self, **extra):
+        response = self.client.get(self.url, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode('utf-8')
+
+    def test_records_requests_per_view_action(self):
+        """
+        Ensure requests are counted per DRF view and action, with latency, histogram and query lines.
+        """
+        with CaptureQueriesContext(connection) as list_queries:
+            self.client.get(reverse('client-list'), format='json')
+        list_query_count = len(list_queries) # Read now: the next request resets the query log
+        self.client.get(reverse('client-search'), {'q': 'Metric'}, format='json')
+        self.client.post(
+            reverse('client-enroll', kwargs={'pk': self.test_client.pk}), {'program_id': self.program.pk}, format='json'
+        )
+        self.client.get('/afiya/no-such-endpoint/')
+
+        body = self._metrics()
+        self.assertIn('afiya_http_requests_total{endpoint="ClientViewSet.list",status="200"} 1', body)
+        self.assertIn('afiya_http_requests_total{endpoint="ClientViewSet.search",status="200"} 1', body)
+        self.assertIn('afiya_http_requests_total{endpoint="ClientViewSet.enroll",status="200"} 1', body)
+        self.assertIn('afiya_http_requests_total{endpoint="unmatched",status="404"} 1', body)
+        self.assertIn(f'afiya_db_queries_total{{endpoint="ClientViewSet.list"}} {list_query_count}', body)
+        self.assertIn('afiya_http_request_duration_seconds_bucket{endpoint="ClientViewSet.list",le="+Inf"} 1', body)
+        self.assertIn('afiya_http_request_latency_seconds{endpoint="ClientViewSet.search",quantile="0.99"}', body)
+        self.assertIn('afiya_db_queries_per_request{endpoint="ClientViewSet.enroll",quantile="0.5"}', body)
+        self.assertIn('# TYPE afiya_db_query_duration_seconds_total counter', body)
+
+    def test_metrics_access(self):
+        """
+        Ensure metrics need a staff session or the bearer token.
+        """
+        self.client.logout()
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        with self.settings(AFIYA_METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(
+                self.client.get(self.url, HTTP_AUTHORIZATION='Bearer wrong').status_code, status.HTTP_403_FORBIDDEN
+            )
+            self._metrics(HTTP_AUTHORIZATION='Bearer scrape-secret')
+
+    def test_disabled(self):
+        """
+        Ensure AFIYA_METRICS_ENABLED=False records nothing.
+        """
+        with self.settings(AFIYA_METRICS_ENABLED=False):
+            self.client.get(reverse('client-list'), format='json')
+        self.assertNotIn('ClientViewSet.list', self._metrics())
+
+    def test_connections_and_pool_stats(self):
+        """
+        Ensure opened connections are counted per database and connection pool stats are exported.
+        """
+        connection_created.send(sender=type(connection), connection=connection)
+        connection_created.send(sender=type(connection), connection=connection)
+        stats = {
+            'pool_min': 4, 'pool_max': 12, 'pool_size': 6, 'pool_available': 2,
+            'requests_waiting': 3, 'connections_num': 9, 'requests_wait_ms': 1250,
+        }
+        with unittest.mock.patch('afiya.metrics.pool_stats', return_value={'default': stats}):
+            body = self._metrics()
+        self.assertIn('afiya_db_connections_opened_total{database="default"} 2', body)
+        self.assertIn('afiya_db_pool_size{database="default"} 6', body)
+        self.assertIn('afiya_db_pool_in_use{database="default"} 4', body)
+        self.assertIn('afiya_db_pool_waiting{database="default"} 3', body)
+        self.assertIn('afiya_db_pool_connections_created_total{database="default"} 9', body)
+        self.assertIn('afiya_db_pool_wait_seconds_total{database="default"} 1.250000', body)
+        self.assertIn('afiya_db_pool_request_errors_total{database="default"} 0', body)
+        # Without a pool configured (SQLite, psycopg2) there are no pool samples
+        self.assertNotIn('afiya_db_pool_size{', self._metrics())
+
+
+class ProgramQueryBudgetTests(APITestCase):
+    """
+    The ProgramAPITests scenarios, each run against several sizes of seeded
+    clients, programs and enrollments: the number of queries must not grow
+    with the data and must stay within the budget.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser_program_budget', password='password123')
+        self.list_url = reverse('program-list')
+        self.client.force_authenticate(user=self.user)
+
+    def detail_url(self, program):
+        return reverse('program-detail', kwargs={'pk': program.pk})
+
+    @query_budget(
+        1 # Unique name check
+        + 1 # INSERT the program
+        + 1 # Change log entry
+    )
+    def test_create_program(self, seeded):
+        """
+        Ensure creating a program runs a fixed number of queries.
+        """
+        response = self.client.post(self.list_url, {'name': 'TB Care'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @query_budget(1)
+    def test_create_program_duplicate_name(self, seeded):
+        """
+        Ensure rejecting a duplicate program name runs a fixed number of queries.
+        """
+        response = self.client.post(self.list_url, {'name': seeded.programs[0].name}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @query_budget(1)
+    def test_list_programs(self, seeded):
+        """
+        Ensure listing programs runs a fixed number of queries however many programs there are.
+        """
+        response = self.client.get(self.list_url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), len(seeded.programs))
+
+    @query_budget(1)
+    def test_retrieve_program(self, seeded):
+        """
+        Ensure retrieving a program runs a fixed number of queries however many clients it has.
+        """
+        response = self.client.get(self.detail_url(seeded.programs[0]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @query_budget(
+        1 # The program
+        + 1 # Unique name check
+        + 1 # UPDATE the program
+        + 1 # Touch updated_at of its clients, in one UPDATE
+        + 1 # Change log entry
+    )
+    def test_update_program(self, seeded):
+        """
+        Ensure renaming a program (PUT) runs a fixed number of queries however many clients are enrolled.
+        """
+        response = self.client.put(self.detail_url(seeded.programs[0]), {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @query_budget(
+        1 # The program
+        + 1 # Unique name check
+        + 1 # UPDATE the program
+        + 1 # Touch updated_at of its clients, in one UPDATE
+        + 1 # Change log entry
+    )
+    def test_partial_update_program(self, seeded):
+        """
+        Ensure renaming a program (PATCH) runs a fixed number of queries however many clients are enrolled.
+        """
+        response = self.client.patch(self.detail_url(seeded.programs[0]), {'name': 'Patched'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @query_budget(
+        1 # The program
+        + 1 # Touch updated_at of its clients, in one UPDATE
+        + 3 # Cascade: enrollments, birth-year and daily counters
+        + 1 # DELETE the program
+        + 1 # Change log entry
+    )
+    def test_delete_program(self, seeded):
+        """
+        Ensure deleting a program runs a fixed number of queries however many clients are enrolled.
+        """
+        response = self.client.delete(self.detail_url(seeded.programs[0]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class ClientQueryBudgetTests(APITestCase):
+    """
+    The ClientAPITests scenarios under the query-budget harness (see
+    ProgramQueryBudgetTests). List and search fill a page whatever the size.
+    Edits and enrollments change the stats counters of every program the
+    client is in with one upsert per counter table, however many there are.
+    """
+    # One enrollment request
+    ENROLL_QUERIES = (
+        2 # The client and its programs
+        + 1 # The program (validation)
+        + 1 # Existing links, so add() skips duplicates
+        + 1 # INSERT the enrollment
+        + 2 # One upsert each for the birth-year and daily counters
+        + 1 # Touch the client's updated_at
+        + 1 # Change log entry
+        + 1 # Programs for the response
+    )
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser_client_budget', password='password123')
+        self.list_url = reverse('client-list')
+        self.search_url = reverse('client-search')
+        self.client.force_authenticate(user=self.user)
+
+    def detail_url(self, client):
+        return reverse('client-detail', kwargs={'pk': client.pk})
+
+    def enroll(self, client, program_id):
+        return self.client.post(
+            reverse('client-enroll', kwargs={'pk': client.pk}), {'program_id': program_id}, format='json'
+        )
+
+    @query_budget(
+        1 # INSERT the client
+        + 1 # Change log entry
+        + 1 # Programs for the response
+    )
+    def test_create_client(self, seeded):
+        """
+        Ensure creating a client runs a fixed number of queries.
+        """
+        data = {'name': 'New Client', 'date_of_birth': '2000-01-01', 'contact_info': 'new@example.com'}
+        response = self.client.post(self.list_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @query_budget(0)
+    def test_create_client_missing_field(self, seeded):
+        """
+        Ensure rejecting an incomplete client runs no queries.
+        """
+        data = {'date_of_birth': '2000-01-01', 'contact_info': 'invalid@example.com'}
+        response = self.client.post(self.list_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @query_budget(3)
+    def test_list_clients(self, seeded):
+        """
+        Ensure a page of clients, with their programs, takes a fixed number of queries.
+        """
+        response = self.client.get(self.list_url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(all(client['enrolled_programs'] for client in response.data['results']))
+
+    @query_budget(2)
+    def test_retrieve_client(self, seeded):
+        """
+        Ensure retrieving an enrolled client runs a fixed number of queries.
+        """
+        response = self.client.get(self.detail_url(seeded.clients[0]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['enrolled_programs'])
+
+    @query_budget(
+        2 # The client and its programs
+        + 1 # UPDATE the client
+        + 1 # Birth year changed: the client's programs...
+        + 1 # ...and one upsert moving them between birth-year counters
+        + 1 # Change log entry
+        + 1 # Programs for the response
+    )
+    def test_update_client(self, seeded):
+        """
+        Ensure updating an enrolled client (PUT) runs a fixed number of queries.
+        """
+        data = {'name': 'Updated Client', 'date_of_birth': '1990-05-16', 'contact_info': 'updated@example.com'}
+        response = self.client.put(self.detail_url(seeded.clients[0]), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @query_budget(
+        2 # The client and its programs
+        + 1 # UPDATE the client
+        + 1 # Change log entry
+        + 1 # Programs for the response
+    )
+    def test_partial_update_client(self, seeded):
+        """
+        Ensure updating an enrolled client (PATCH) runs a fixed number of queries.
+        """
+        response = self.client.patch(
+            self.detail_url(seeded.clients[0]), {'contact_info': 'patched@example.com'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @query_budget(
+        2 # The client and its programs
+        + 1 # Its enrollments, measured before they go...
+        + 1 # ...and one upsert taking them off the birth-year counters
+        + 2 # DELETE its enrollments, then the client
+        + 1 # Change log entry
+    )
+    def test_delete_client(self, seeded):
+        """
+        Ensure deleting an enrolled client runs a fixed number of queries.
+        """
+        response = self.client.delete(self.detail_url(seeded.clients[0]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    @query_budget(1 + ENROLL_QUERIES) # 1: the test looks up the programs the client is in
+    def test_enroll_client(self, seeded):
+        """
+        Ensure enrolling a client runs a fixed number of queries however many programs it already has.
+        """
+        client = seeded.clients[0]
+        enrolled = set(client.enrolled_programs.values_list('id', flat=True))
+        program = next(program for program in seeded.programs if program.pk not in enrolled)
+        response = self.enroll(client, program.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @query_budget(1 + 2 * ENROLL_QUERIES) # 1: the test looks up the programs the client is in
+    def test_enroll_client_multiple_programs(self, seeded):
+        """
+        Ensure enrolling a client in two more programs runs a fixed number of queries.
+        """
+        client = seeded.clients[-1]
+        enrolled = set(client.enrolled_programs.values_list('id', flat=True))
+        programs = [program for program in seeded.programs if program.pk not in enrolled][:2]
+        for program in programs:
+            self.assertEqual(self.enroll(client, program.pk).status_code, status.HTTP_200_OK)
+
+    @query_budget(
+        2 # The client and its programs
+        + 1 # The program (validation)
+        + 1 # Existing links, so add() skips this one
+        + 1 # Touch the client's updated_at
+        + 1 # Programs for the response
+    )
+    def test_enroll_client_already_enrolled(self, seeded):
+        """
+        Ensure re-enrolling a client in one of its programs runs a fixed number of queries.
+        """
+        response = self.enroll(seeded.clients[0], seeded.programs[0].pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @query_budget(3)
+    def test_enroll_client_non_existent_program(self, seeded):
+        """
+        Ensure rejecting an unknown program runs a fixed number of queries.
+        """
+        response = self.enroll(seeded.clients[0], 999999)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @query_budget(2)
+    def test_enroll_client_invalid_data(self, seeded):
+        """
+        Ensure rejecting an enrollment without program_id runs a fixed number of queries.
+        """
+        response = self.client.post(reverse('client-enroll', kwargs={'pk': seeded.clients[0].pk}), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @query_budget(3)
+    def test_search_client_single_result(self, seeded):
+        """
+        Ensure a single-match search runs a fixed number of queries.
+        """
+        response = self.client.get(self.search_url, {'q': seeded.clients[-1].name}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    @query_budget(3)
+    def test_search_client_multiple_results(self, seeded):
+        """
+        Ensure a search matching every client fills a page in a fixed number of queries.
+        """
+        response = self.client.get(self.search_url, {'q': 'Budget Client'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(len(response.data['results']), 1)
+
+    @query_budget(3)
+    def test_search_client_case_insensitive(self, seeded):
+        """
+        Ensure a lowercase search runs a fixed number of queries.
+        """
+        response = self.client.get(self.search_url, {'q': 'budget client'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(len(response.data['results']), 1)
+
+    @query_budget(2)
+    def test_search_client_no_results(self, seeded):
+        """
+        Ensure a search without matches runs a fixed number of queries.
+        """
+        response = self.client.get(self.search_url, {'q': 'NonExistentName'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+    @query_budget(0)
+    def test_search_client_no_query_param(self, seeded):
+        """
+        Ensure a search without 'q' is rejected without queries.
+        """
+        response = self.client.get(self.search_url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @query_budget(3)
+    def test_search_client_empty_query_param(self, seeded):
+        """
+        Ensure an empty search lists a page of clients in a fixed number of queries.
+        """
+        response = self.client.get(self.search_url, {'q': ''}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['results'])
+
+    def test_harness_detects_n_plus_one(self):
+        """
+        Ensure the harness fails a scenario whose query count grows with the data.
+        """
+        def n_plus_one(seeded):
+            for client in Client.objects.all():
+                list(client.enrolled_programs.all())
+        with self.assertRaisesMessage(AssertionError, 'Query count grows with the data'):
+            assert_constant_queries(self, n_plus_one)
+        with self.assertRaisesMessage(AssertionError, 'over the budget of 0'):
+            assert_constant_queries(self, lambda seeded: list(Client.objects.all()), budget=0)
 
 
 class PermissionTests(APITestCase):
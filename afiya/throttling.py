@@ -0,0 +1,51 @@
+#@juma_samwel
+"""
+Login throttles. Attempts are counted per submitted username and per client
+IP, so password guessing against one account, or from one address, is
+cut off before it can keep worker CPUs busy hashing. A successful login
+clears its username's history, so only failed attempts add up against an
+account; the per-IP count is left alone. Rates are set under
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] ('login_username', 'login_ip'); a
+rate of None turns a throttle off. Counters live in the default cache, i.e. per process unless CACHE_BACKEND
+is shared.
+"""
+import hashlib
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class LoginThrottle(SimpleRateThrottle):
+    def get_rate(self):
+        # DRF binds THROTTLE_RATES at import; read the setting per request so
+        # override_settings (tests, the in-process load test) applies
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured(f"No default throttle rate set for '{self.scope}' scope")
+
+
+class LoginUsernameThrottle(LoginThrottle):
+    scope = 'login_username'
+
+    def get_cache_key(self, request, view):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not isinstance(username, str) or not username:
+            return None # Nothing to hash: the request fails validation cheaply anyway
+        # Hashed so arbitrary usernames make valid cache keys on every backend
+        ident = hashlib.sha256(username.strip().lower().encode('utf-8')).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def reset(self, request, view):
+        """Forget the attempts against the submitted username, after it authenticated."""
+        key = self.get_cache_key(request, view)
+        if key is not None:
+            self.cache.delete(key)
+
+
+class LoginIPThrottle(LoginThrottle):
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
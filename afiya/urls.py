@@ -1,15 +1,37 @@
 # @JUMA_SAMWEL
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProgramViewSet, ClientViewSet, DoctorRegistrationView, UserLoginView, UserProfileView
+from . import async_views
+from .views import ProgramViewSet, ClientViewSet, DoctorRegistrationView, UserLoginView, UserProfileView, SyncView, metrics_view
 router = DefaultRouter()
 
 router.register(r'programs', ProgramViewSet, basename='program')
 router.register(r'clients', ClientViewSet, basename='client')
 
+# Native async versions of the hot endpoints (see afiya/async_views.py)
+async_routes = [
+    ('clients/', async_views.client_list, 'client-list'),
+    ('clients/search/', async_views.client_search, 'client-search'),
+    ('clients/<int:pk>/', async_views.client_detail, 'client-detail'),
+    ('clients/<int:pk>/enroll/', async_views.client_enroll, 'client-enroll'),
+    ('programs/', async_views.program_list, 'program-list'),
+]
+
 urlpatterns = [
+    path(f'async/{route}', view, name=f'async-{name}') for route, view, name in async_routes
+]
+if settings.AFIYA_ASYNC_VIEWS:
+    # Serve the hot endpoints natively under ASGI, ahead of the DRF routes
+    urlpatterns += [path(route, view) for route, view, name in async_routes]
+
+urlpatterns += [
     path('', include(router.urls)),
     path('doctors/register/', DoctorRegistrationView.as_view(), name='doctor-register'),
     path('login/', UserLoginView.as_view(), name='api-login'),
     path('user/profile/', UserProfileView.as_view(), name='user-profile'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('_metrics', metrics_view, name='metrics'),
+    # Server-sent change events; 204 unless AFIYA_SSE_ENABLED under ASGI (see afiya/events.py)
+    path('events/', async_views.event_stream, name='events'),
 ]
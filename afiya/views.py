@@ -1,5 +1,13 @@
 # @juma_samwel
 
+import hmac
+import logging
+import time
+import types
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.shortcuts import render
@@ -8,54 +16,159 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 # Import permissions
 from rest_framework import permissions
+from .autocomplete import client_name_index
+from .changelog import changes_since, parse_token
+from .caching import CachedResponseMixin, ConditionalRetrieveMixin
+from .fieldsets import SparseFieldsetMixin
+from .bulk import bulk_enroll_clients, bulk_register_clients, clients_by_id
+from .export import as_async_iterator, stream_clients
+from .fast_serializers import client_rows, client_values, program_rows
 from .models import Program, Client
+from .pagination import ClientCursorPagination
+from .parsers import FastJSONParser, NDJSONParser
+from .renderers import CSVRenderer, NDJSONRenderer
+from .routers import ReplicaReadsMixin
+from .search import SEARCH_ORDERING, search_clients
+from .stats import program_stats
+from .login import token_for
+from .metrics import registry as metrics_registry
+from .throttling import LoginIPThrottle, LoginUsernameThrottle
 from .serializers import (
     ProgramSerializer,
     ClientSerializer,
     ClientEnrollmentSerializer,
+    BulkEnrollmentSerializer,
+    ClientBatchSerializer,
     DoctorRegistrationSerializer,
     UserLoginSerializer # Keep this for validation
 )
-from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 
+logger = logging.getLogger(__name__)
+
 @ensure_csrf_cookie
 def login_page_view(request):
     """Ensures the CSRF cookie is set when serving the login page."""
     return render(request, 'login.html')
 
 
-class ProgramViewSet(viewsets.ModelViewSet):
+def metrics_view(request):
+    """
+    Per-endpoint request metrics for this process in Prometheus text format
+    (see afiya/metrics.py). Scrapers send 'Authorization: Bearer <AFIYA_METRICS_TOKEN>';
+    staff users may also read it from a logged-in browser.
+    Maps to GET /afiya/_metrics
+    """
+    authorization = request.headers.get('Authorization', '')
+    token = settings.AFIYA_METRICS_TOKEN
+    allowed = (
+        bool(token) and hmac.compare_digest(authorization, f'Bearer {token}')
+    ) or request.user.is_staff
+    if not allowed:
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class ProgramViewSet(ReplicaReadsMixin, CachedResponseMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows programs to be viewed or edited.
     Requires authentication.
     Provides list, create, retrieve, update, partial_update, destroy actions.
+    List and retrieve responses are cached and carry an ETag (see afiya/caching.py).
+    Safe requests read from a replica when replicas are configured (see afiya/routers.py).
     """
     queryset = Program.objects.all().order_by('name')
     serializer_class = ProgramSerializer
     # Require authentication for all program actions
     permission_classes = [permissions.IsAuthenticated]
 
+    def list(self, request, *args, **kwargs):
+        if not settings.AFIYA_FAST_SERIALIZERS:
+            return super().list(request, *args, **kwargs)
+        # Read-only fast path (afiya/fast_serializers.py); same JSON, cached like any list
+        return self.cached_response(request, lambda: Response(program_rows(self.filter_queryset(self.get_queryset()))))
 
-class ClientViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['post'], url_path='enroll-bulk', serializer_class=BulkEnrollmentSerializer)
+    def enroll_bulk(self, request, pk=None):
+        """
+        Enroll many clients into this program in one request, selected either
+        by 'client_ids' or by a search query 'q' (same matching as client search).
+        Returns counts rather than client profiles.
+        Maps to POST /afiya/programs/{program_pk}/enroll-bulk/
+        """
+        program = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if 'client_ids' in serializer.validated_data:
+            client_ids = serializer.validated_data['client_ids']
+        else:
+            matches = search_clients(Client.objects.all(), serializer.validated_data['q'], ranked=False)
+            client_ids = matches.order_by().values_list('pk', flat=True)
+
+        result = bulk_enroll_clients(program, client_ids, settings.AFIYA_BULK_BATCH_SIZE)
+        return Response(result.as_dict(), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='stats')
+    def stats(self, request):
+        """
+        Enrollment statistics for every program: total enrolled, an age-band
+        histogram and new enrollments per day over the last ?days= days.
+        Served from incrementally maintained counters, never by scanning clients.
+        Maps to GET /afiya/programs/stats/?days=30
+        """
+        try:
+            days = int(request.query_params.get('days', settings.AFIYA_STATS_DAYS))
+        except ValueError:
+            return Response(
+                {"detail": "Query parameter 'days' must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        days = min(max(days, 1), settings.AFIYA_STATS_MAX_DAYS)
+        return Response(program_stats(days), status=status.HTTP_200_OK)
+
+
+class ClientViewSet(ReplicaReadsMixin, SparseFieldsetMixin, ConditionalRetrieveMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows clients to be viewed, edited, searched, and enrolled.
     Requires authentication.
     Provides list, create, retrieve, update, partial_update, destroy actions,
     plus custom 'search' and 'enroll' actions.
+    List and search responses are cursor-paginated on (name, id).
+    Retrieve answers If-None-Match / If-Modified-Since with 304 (see afiya/caching.py).
+    List, retrieve, search and batch take ?fields= and ?expand= (see afiya/fieldsets.py).
+    List and search pages are rendered by the read-only fast path (afiya/fast_serializers.py).
+    Safe requests read from a replica when replicas are configured (see afiya/routers.py).
     """
     queryset = Client.objects.prefetch_related('enrolled_programs').all().order_by('name')
     serializer_class = ClientSerializer
     # Require authentication for all client actions
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ClientCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        if not settings.AFIYA_FAST_SERIALIZERS:
+            return super().list(request, *args, **kwargs)
+        return self.fast_page(self.filter_queryset(self.get_queryset()))
+
+    def fast_page(self, queryset):
+        """
+        One cursor page of `queryset` built from .values() rows, without
+        ClientSerializer: the client columns in one query, their programs in another.
+        """
+        fieldset = self.get_fieldset()
+        position = [field.lstrip('-') for field in self.paginator.get_ordering(self)]
+        rows = self.paginate_queryset(client_values(queryset, fieldset, extra=position))
+        return self.get_paginated_response(client_rows(rows, fieldset))
 
     @action(detail=False, methods=['get'], url_path='search')
     def search(self, request):
         """
-        Search for clients by name (case-insensitive).
+        Search for clients by name or contact info (case-insensitive).
         Requires 'q' query parameter. If 'q' is empty, returns all clients.
+        Matches come back best-ranked first, cursor-paginated like the list endpoint.
         Maps to GET /afiya/clients/search/?q=...
         """
         query = request.query_params.get('q', None)
@@ -66,16 +179,139 @@ class ClientViewSet(viewsets.ModelViewSet):
                  status=status.HTTP_400_BAD_REQUEST
              )
 
+        started = time.perf_counter()
         # Handle empty query string - return all clients in this case
         if not query:
              clients = self.get_queryset() # Use the ViewSet's default queryset
         else:
-            # Perform case-insensitive search on the name field
-            clients = self.get_queryset().filter(name__icontains=query)
+            # Indexed search (trigram / FTS5), ranked best match first
+            clients = search_clients(self.get_queryset(), query)
+            self.keyset_ordering = SEARCH_ORDERING
+
+        if settings.AFIYA_FAST_SERIALIZERS:
+            response = self.fast_page(clients)
+        else:
+            # Paginate with the ViewSet's cursor paginator, then serialize the page
+            page = self.paginate_queryset(clients)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                response = self.get_paginated_response(serializer.data)
+            else:
+                serializer = self.get_serializer(clients, many=True)
+                response = Response(serializer.data)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms > settings.AFIYA_SEARCH_LATENCY_BUDGET_MS:
+            logger.warning(
+                "Client search for %r took %.1f ms (budget %s ms)",
+                query, elapsed_ms, settings.AFIYA_SEARCH_LATENCY_BUDGET_MS
+            )
+        return response
+
+    @action(detail=False, methods=['get'], url_path='autocomplete', pagination_class=None)
+    def autocomplete(self, request):
+        """
+        Suggest clients whose name starts with 'prefix' (case-insensitive).
+        Returns only id and name for the top 'limit' matches, served from the
+        in-memory name index without a database query.
+        Maps to GET /afiya/clients/autocomplete/?prefix=...&limit=...
+        """
+        prefix = request.query_params.get('prefix', None)
+        if prefix is None:
+            return Response(
+                {"detail": "Query parameter 'prefix' is required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        prefix = prefix.strip()
+        if not prefix:
+            return Response([])
 
-        # Use the ViewSet's default serializer (ClientSerializer)
-        serializer = self.get_serializer(clients, many=True)
-        return Response(serializer.data)
+        try:
+            limit = int(request.query_params.get('limit', settings.AFIYA_AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            limit = settings.AFIYA_AUTOCOMPLETE_LIMIT
+        limit = max(1, min(limit, settings.AFIYA_AUTOCOMPLETE_MAX_LIMIT))
+
+        matches = client_name_index.lookup(prefix, limit)
+        return Response([{'id': client_id, 'name': name} for client_id, name in matches])
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[FastJSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Register many clients in one request.
+        Accepts a JSON array (application/json) or one object per line
+        (application/x-ndjson). Each row takes the usual client fields plus an
+        optional 'enrolled_program_ids' list. Rows are validated and inserted
+        in batches of 'batch_size' inside one transaction; invalid rows are
+        reported by index without aborting the rest.
+        Maps to POST /afiya/clients/bulk/?batch_size=...
+        """
+        rows = request.data
+        # A JSON array, or the rows generator NDJSONParser returns; not null, objects or scalars
+        if not isinstance(rows, (list, types.GeneratorType)):
+            return Response(
+                {"detail": "Expected a JSON array or NDJSON rows of clients."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            batch_size = int(request.query_params.get('batch_size', settings.AFIYA_BULK_BATCH_SIZE))
+        except ValueError:
+            batch_size = settings.AFIYA_BULK_BATCH_SIZE
+        batch_size = max(1, min(batch_size, settings.AFIYA_BULK_MAX_BATCH_SIZE))
+
+        result = bulk_register_clients(rows, batch_size)
+        if not result.errors:
+            response_status = status.HTTP_201_CREATED
+        elif result.created:
+            response_status = status.HTTP_207_MULTI_STATUS # Some rows created, some rejected
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(result.as_dict(), status=response_status)
+
+    @action(detail=False, methods=['get', 'post'], url_path='batch', serializer_class=ClientBatchSerializer)
+    def batch(self, request):
+        """
+        Fetch many client profiles in one call, in the order the ids were
+        given. Ids that match no client are listed under 'not_found' instead
+        of failing the request. Two queries whatever the number of ids:
+        the clients, then their enrolled programs.
+        Maps to GET /afiya/clients/batch/?ids=1,2,3
+        and POST /afiya/clients/batch/ with {"ids": [1, 2, 3]} for long lists
+        """
+        if request.method == 'GET':
+            ids = request.query_params.get('ids', None)
+            data = {} if ids is None else {'ids': [part for part in ids.split(',') if part.strip()]}
+        else:
+            data = request.data
+        batch_serializer = self.get_serializer(data=data)
+        batch_serializer.is_valid(raise_exception=True)
+
+        clients, not_found = clients_by_id(self.get_queryset(), batch_serializer.validated_data['ids'])
+        results = ClientSerializer(clients, many=True, context=self.get_serializer_context()).data
+        return Response({'results': results, 'not_found': not_found}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """
+        Stream every client with their enrolled programs as CSV or NDJSON,
+        in constant memory. Gzip-compressed on the fly when the client sends
+        'Accept-Encoding: gzip'.
+        Maps to GET /afiya/clients/export/?format=csv|ndjson
+        """
+        export_format = request.accepted_renderer.format
+        use_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+        chunks = stream_clients(export_format, settings.AFIYA_EXPORT_CHUNK_SIZE, gzip=use_gzip)
+        if isinstance(request._request, ASGIRequest):
+            chunks = as_async_iterator(chunks)
+
+        response = StreamingHttpResponse(chunks, content_type=request.accepted_renderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="clients.{export_format}"'
+        response['Vary'] = 'Accept-Encoding'
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+        return response
 
     # Use ClientEnrollmentSerializer specifically for INPUT validation here
     @action(detail=True, methods=['post'], serializer_class=ClientEnrollmentSerializer)
@@ -93,25 +329,16 @@ class ClientViewSet(viewsets.ModelViewSet):
         # If validation fails, it automatically returns a 400 Bad Request response.
         enrollment_serializer.is_valid(raise_exception=True)
 
-        # If validation passes, validated_data is available
-        program_id = enrollment_serializer.validated_data['program_id']
-        try:
-            # Fetch the program instance
-            program = Program.objects.get(pk=program_id)
-            # Add the client to the program's 'clients' relationship (or vice-versa)
-            client.enrolled_programs.add(program)
-            # Note: .add() handles duplicates gracefully (doesn't add if already present)
-
-            # Return the updated client profile using the default ClientSerializer
-            # This ensures the response includes the newly enrolled program.
-            response_serializer = ClientSerializer(client)
-            return Response(response_serializer.data, status=status.HTTP_200_OK)
-
-        except Program.DoesNotExist:
-            
-            raise serializers.ValidationError(
-                {'program_id': f"Program with ID {program_id} not found."}
-            )
+        # If validation passes, validated_data holds the program it looked up
+        program = enrollment_serializer.validated_data['program']
+        # Add the client to the program's 'clients' relationship (or vice-versa)
+        client.enrolled_programs.add(program)
+        # Note: .add() handles duplicates gracefully (doesn't add if already present)
+
+        # Return the updated client profile using the default ClientSerializer
+        # This ensures the response includes the newly enrolled program.
+        response_serializer = ClientSerializer(client)
+        return Response(response_serializer.data, status=status.HTTP_200_OK)
 
 class DoctorRegistrationView(generics.CreateAPIView):
     """
@@ -152,16 +379,20 @@ class UserLoginView(views.APIView):
     """
     permission_classes = [permissions.AllowAny] # Anyone can attempt to log in
     serializer_class = UserLoginSerializer # Use for input validation
+    # Brute-force traffic is cut off per username and per IP before any hashing
+    throttle_classes = [LoginUsernameThrottle, LoginIPThrottle]
 
     def post(self, request, *args, **kwargs):
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
 
         # If validation passes, serializer.validated_data contains 'user'
         user = serializer.validated_data['user']
+        # Only failed attempts should count towards the username's limit
+        LoginUsernameThrottle().reset(request, self)
 
-        # Generate or get token
-        token, created = Token.objects.get_or_create(user=user)
+        # Token came with the user query; only a first login inserts one
+        token = token_for(user)
 
         # Return token and user details
         return Response({
@@ -186,6 +417,31 @@ class UserProfileView(views.APIView):
             'username': user.username,
             'first_name': user.first_name,
             'last_name': user.last_name,
-            'email': user.email
+            'email': user.email,
+            # Whether the dashboard should subscribe to /afiya/events/
+            'live_updates': settings.AFIYA_SSE_ENABLED
         }
         return Response(data)
+
+
+class SyncView(views.APIView):
+    """
+    Incremental sync for offline copies: the clients, programs and enrollments
+    created, updated or deleted since ?since=<token>, from the change log
+    (see afiya/changelog.py). Omit the token for the whole dataset; repeat
+    with the returned token while 'more' is true.
+    Maps to GET /afiya/sync/?since=<token>&limit=<n>
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            since = parse_token(request.query_params.get('since'))
+            limit = int(request.query_params.get('limit', settings.AFIYA_SYNC_PAGE_SIZE))
+        except ValueError:
+            return Response(
+                {"detail": "Query parameter 'since' must be a token from a previous sync and 'limit' an integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = min(max(limit, 1), settings.AFIYA_SYNC_PAGE_SIZE)
+        return Response(changes_since(since, limit), status=status.HTTP_200_OK)
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -58,6 +59,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole stack (see afiya/metrics.py)
+    'afiya.metrics.MetricsMiddleware',
+    # Per-request read-replica routing and read-your-writes pinning (afiya/routers.py)
+    'afiya.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     # Whitenoise Middleware should be placed high up, right after SecurityMiddleware
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -114,11 +119,18 @@ WSGI_APPLICATION = 'afiya_system.wsgi.application'
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# Connections to DATABASE_URL (and replicas). Without pooling each worker thread keeps
+# its connection for DATABASE_CONN_MAX_AGE seconds (0: a new one per request) and, with
+# DATABASE_CONN_HEALTH_CHECKS, checks a reused one is alive before the request's first query.
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', '600'))
+DATABASE_CONN_HEALTH_CHECKS = os.environ.get('DATABASE_CONN_HEALTH_CHECKS', 'True') == 'True'
+
 if DATABASE_URL:
     DATABASES = {
         'default': dj_database_url.config(
             default=DATABASE_URL, # Use the loaded DATABASE_URL
-            conn_max_age=600 # Optional: Number of seconds database connections should persist
+            conn_max_age=DATABASE_CONN_MAX_AGE,
+            conn_health_checks=DATABASE_CONN_HEALTH_CHECKS,
         )
     }
 else:
@@ -131,7 +143,76 @@ else:
         }
     }
 
+# Read replicas (afiya/routers.py): comma-separated database URLs. Safe reads from the
+# client and program endpoints go to them round-robin; after a write, that browser
+# reads from the primary for AFIYA_REPLICA_PIN_SECONDS. Locally, a copy of the
+# SQLite file can stand in for a replica: sqlite:////path/to/replica.sqlite3
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+AFIYA_READ_REPLICAS = []
+for index, url in enumerate(DATABASE_REPLICA_URLS, start=1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dj_database_url.parse(
+        url, conn_max_age=DATABASE_CONN_MAX_AGE, conn_health_checks=DATABASE_CONN_HEALTH_CHECKS,
+    )
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'} # Tests read the primary's test database
+    AFIYA_READ_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['afiya.routers.ReplicaRouter']
+AFIYA_REPLICA_PIN_SECONDS = int(os.environ.get('AFIYA_REPLICA_PIN_SECONDS', '5'))
+
+# Connection pooling for PostgreSQL, through Django's psycopg 3 pool (needs
+# pip install "psycopg[binary,pool]"; psycopg2 has no pool). Each process then shares
+# AFIYA_DB_POOL_SIZE open connections between its threads and requests, opening up to
+# AFIYA_DB_POOL_OVERFLOW more under load (closed again after AFIYA_DB_POOL_MAX_IDLE idle
+# seconds). A request waits up to AFIYA_DB_POOL_TIMEOUT seconds for a free connection,
+# then fails. DATABASE_CONN_HEALTH_CHECKS makes the pool check connections as they are
+# handed out. Pool statistics are exported at /afiya/_metrics (afiya/metrics.py).
+AFIYA_DB_POOL = os.environ.get('AFIYA_DB_POOL', 'False') == 'True'
+AFIYA_DB_POOL_SIZE = int(os.environ.get('AFIYA_DB_POOL_SIZE', '4'))
+AFIYA_DB_POOL_OVERFLOW = int(os.environ.get('AFIYA_DB_POOL_OVERFLOW', '8'))
+AFIYA_DB_POOL_TIMEOUT = float(os.environ.get('AFIYA_DB_POOL_TIMEOUT', '10'))
+AFIYA_DB_POOL_MAX_IDLE = float(os.environ.get('AFIYA_DB_POOL_MAX_IDLE', '600'))
+POOLED_DATABASES = [
+    database for database in DATABASES.values()
+    if AFIYA_DB_POOL and database['ENGINE'] == 'django.db.backends.postgresql'
+]
+if POOLED_DATABASES:
+    try:
+        from psycopg_pool import ConnectionPool
+    except ImportError:
+        raise ImproperlyConfigured('AFIYA_DB_POOL needs psycopg 3 with its pool: pip install "psycopg[binary,pool]"')
+    for database in POOLED_DATABASES:
+        database['CONN_MAX_AGE'] = 0 # Connections go back to the pool at the end of each request
+        database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': AFIYA_DB_POOL_SIZE,
+            'max_size': AFIYA_DB_POOL_SIZE + AFIYA_DB_POOL_OVERFLOW,
+            'timeout': AFIYA_DB_POOL_TIMEOUT,
+            'max_idle': AFIYA_DB_POOL_MAX_IDLE,
+            'check': ConnectionPool.check_connection if DATABASE_CONN_HEALTH_CHECKS else None,
+        }
+
+
+# Cache (used for program responses, see afiya/caching.py).
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared cache
+# (e.g. django.core.cache.backends.redis.RedisCache, redis://127.0.0.1:6379/1)
+# so invalidation reaches every worker process.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'afiya'),
+    }
+}
 
+# Password hashing: PBKDF2 with an adjustable cost (see afiya/hashers.py).
+# Unset keeps Django's default iteration count; stored hashes move to the
+# configured cost on each user's next login.
+PASSWORD_HASHERS = [
+    'afiya.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+AFIYA_PBKDF2_ITERATIONS = int(os.environ.get('AFIYA_PBKDF2_ITERATIONS', '0')) or None
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -193,9 +274,10 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         # Useful for browser-based interaction (login/logout) and the browsable API
-        'rest_framework.authentication.SessionAuthentication',
+        # (cached drop-ins for DRF's classes, see afiya/authentication.py)
+        'afiya.authentication.CachedSessionAuthentication',
         # Useful if you plan to use API tokens for external clients or mobile apps
-        'rest_framework.authentication.TokenAuthentication',
+        'afiya.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         # By default, require authentication unless overridden in a specific view.
@@ -206,11 +288,111 @@ REST_FRAMEWORK = {
         # 'rest_framework.permissions.AllowAny',
     ],
 
+    # JSON via orjson when installed, stdlib json otherwise (see afiya/renderers.py, afiya/parsers.py).
+    # The browsable API and form/multipart parsing stay as DRF's defaults.
+    'DEFAULT_RENDERER_CLASSES': [
+        'afiya.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'afiya.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+
+    # Login throttles (see afiya/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'login_username': os.environ.get('AFIYA_LOGIN_USERNAME_RATE', '10/min'),
+        'login_ip': os.environ.get('AFIYA_LOGIN_IP_RATE', '60/min'),
+    },
+
     # Optional: Add default pagination, filtering, etc. here if desired
     # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     # 'PAGE_SIZE': 10
 }
 
+# Client list/search pagination (cursor-based, see afiya/pagination.py)
+# Clients may request smaller pages with ?page_size=, capped at the max below.
+AFIYA_CLIENT_PAGE_SIZE = int(os.environ.get('AFIYA_CLIENT_PAGE_SIZE', '50'))
+AFIYA_CLIENT_MAX_PAGE_SIZE = int(os.environ.get('AFIYA_CLIENT_MAX_PAGE_SIZE', '500'))
+
+# Client search (see afiya/search.py). Searches slower than this budget are logged.
+AFIYA_SEARCH_LATENCY_BUDGET_MS = float(os.environ.get('AFIYA_SEARCH_LATENCY_BUDGET_MS', '20'))
+
+# Client name autocomplete (see afiya/autocomplete.py). The in-memory index is
+# patched on saves in this process and rebuilt after MAX_AGE seconds (0 = never)
+# to pick up writes from other worker processes.
+AFIYA_AUTOCOMPLETE_LIMIT = int(os.environ.get('AFIYA_AUTOCOMPLETE_LIMIT', '10'))
+AFIYA_AUTOCOMPLETE_MAX_LIMIT = int(os.environ.get('AFIYA_AUTOCOMPLETE_MAX_LIMIT', '50'))
+AFIYA_AUTOCOMPLETE_MAX_AGE = int(os.environ.get('AFIYA_AUTOCOMPLETE_MAX_AGE', '300'))
+
+# Bulk client registration (POST /afiya/clients/bulk/, see afiya/bulk.py).
+# Rows are validated and inserted in batches of this size; ?batch_size= may override up to the max.
+AFIYA_BULK_BATCH_SIZE = int(os.environ.get('AFIYA_BULK_BATCH_SIZE', '1000'))
+AFIYA_BULK_MAX_BATCH_SIZE = int(os.environ.get('AFIYA_BULK_MAX_BATCH_SIZE', '5000'))
+
+# Render client list/search pages and the program list from .values() rows instead of
+# the DRF serializers (see afiya/fast_serializers.py). The JSON is identical either way.
+AFIYA_FAST_SERIALIZERS = os.environ.get('AFIYA_FAST_SERIALIZERS', 'True') == 'True'
+
+# Batch lookup (GET /afiya/clients/batch/?ids=1,2,3 or POST {"ids": [...]}): most ids per request.
+# Each request is one IN (...) query, so keep this under the database's bound-parameter limit.
+AFIYA_CLIENT_BATCH_MAX_IDS = int(os.environ.get('AFIYA_CLIENT_BATCH_MAX_IDS', '5000'))
+
+# Streaming export (GET /afiya/clients/export/): clients read (and programs prefetched) per chunk.
+AFIYA_EXPORT_CHUNK_SIZE = int(os.environ.get('AFIYA_EXPORT_CHUNK_SIZE', '2000'))
+
+# Program statistics (GET /afiya/programs/stats/, see afiya/stats.py).
+# Age bands are given by their lower bounds in years, e.g. "0,5,15,25,50" -> 0-4, 5-14, ..., 50+.
+AFIYA_STATS_AGE_BANDS = [int(bound) for bound in os.environ.get('AFIYA_STATS_AGE_BANDS', '0,5,15,25,35,50,65').split(',')]
+AFIYA_STATS_DAYS = int(os.environ.get('AFIYA_STATS_DAYS', '30'))
+AFIYA_STATS_MAX_DAYS = int(os.environ.get('AFIYA_STATS_MAX_DAYS', '366'))
+
+# Cached program list/retrieve responses (see afiya/caching.py). Writes invalidate
+# immediately; the timeout bounds staleness across processes with a per-process cache.
+AFIYA_PROGRAM_CACHE_TIMEOUT = int(os.environ.get('AFIYA_PROGRAM_CACHE_TIMEOUT', '300'))
+
+# Authentication cache (see afiya/authentication.py): resolved users per token /
+# session key, per process. SHARED also keeps them in CACHES['default'] so
+# invalidation (token deleted, password or is_active changed) reaches every process.
+AFIYA_AUTH_CACHE_TTL = int(os.environ.get('AFIYA_AUTH_CACHE_TTL', '60'))
+AFIYA_AUTH_CACHE_MAX_ENTRIES = int(os.environ.get('AFIYA_AUTH_CACHE_MAX_ENTRIES', '10000'))
+AFIYA_AUTH_CACHE_SHARED = os.environ.get('AFIYA_AUTH_CACHE_SHARED', 'False') == 'True'
+
+# Login (see afiya/login.py): concurrent password hashes and how many logins may
+# wait for a turn before the rest get 503. Applied under ASGI, or under WSGI
+# too when HASH_LIMIT_UNDER_WSGI is True. 0 workers disables the limit.
+AFIYA_LOGIN_HASH_WORKERS = int(os.environ.get('AFIYA_LOGIN_HASH_WORKERS', str(os.cpu_count() or 1)))
+AFIYA_LOGIN_MAX_PENDING = int(os.environ.get('AFIYA_LOGIN_MAX_PENDING', '64'))
+AFIYA_LOGIN_HASH_LIMIT_UNDER_WSGI = os.environ.get('AFIYA_LOGIN_HASH_LIMIT_UNDER_WSGI', 'False') == 'True'
+
+# Native async views (see afiya/async_views.py) are always reachable under /afiya/async/.
+# Set True when serving with an ASGI server (uvicorn afiya_system.asgi:application)
+# to route the hot client/program endpoints to them instead of the DRF views.
+AFIYA_ASYNC_VIEWS = os.environ.get('AFIYA_ASYNC_VIEWS', 'False') == 'True'
+
+# Request metrics (afiya.metrics.MetricsMiddleware, served at /afiya/_metrics in Prometheus format).
+# Quantiles cover the last AFIYA_METRICS_WINDOW requests per endpoint. Scrapers authenticate
+# with 'Authorization: Bearer <AFIYA_METRICS_TOKEN>'; without a token only staff users can read it.
+AFIYA_METRICS_ENABLED = os.environ.get('AFIYA_METRICS_ENABLED', 'True') == 'True'
+AFIYA_METRICS_WINDOW = int(os.environ.get('AFIYA_METRICS_WINDOW', '1024'))
+AFIYA_METRICS_TOKEN = os.environ.get('AFIYA_METRICS_TOKEN', '')
+
+# Live change events (afiya/events.py, streamed at /afiya/events/ under ASGI).
+# AFIYA_SSE_ENABLED: set True only when serving with an ASGI server; otherwise (and for any
+# request arriving through WSGI) /afiya/events/ answers 204 so EventSource gives up, since
+# an endless stream would hold a WSGI worker thread per dashboard. HEARTBEAT: seconds between keep-alive comments on an idle stream. BACKLOG: recent
+# events kept for reconnecting clients. QUEUE_SIZE: undelivered events a slow
+# subscriber may hold before it is sent a reset (refetch) instead.
+AFIYA_SSE_ENABLED = os.environ.get('AFIYA_SSE_ENABLED', 'False') == 'True'
+AFIYA_EVENTS_HEARTBEAT = int(os.environ.get('AFIYA_EVENTS_HEARTBEAT', '15'))
+AFIYA_EVENTS_BACKLOG = int(os.environ.get('AFIYA_EVENTS_BACKLOG', '1000'))
+AFIYA_EVENTS_QUEUE_SIZE = int(os.environ.get('AFIYA_EVENTS_QUEUE_SIZE', '1000'))
+
+# Incremental sync (/afiya/sync/, afiya/changelog.py): change log entries read per
+# response, and the most a caller may ask for with ?limit=.
+AFIYA_SYNC_PAGE_SIZE = int(os.environ.get('AFIYA_SYNC_PAGE_SIZE', '1000'))
+
 # Optional: Define where users are redirected after login/logout via DRF's browsable API
 # LOGIN_URL = 'rest_framework:login' # Use DRF's login view
 # LOGOUT_URL = 'rest_framework:logout' # Use DRF's logout view
@@ -4,6 +4,8 @@ set -o errexit
 
 # Install dependencies
 pip install -r requirements.txt
+# Optional speedup; the API falls back to the stdlib json module without it
+pip install "orjson>=3.8" || echo "orjson not installed; using the stdlib json module"
 
 # Collect static files
 python manage.py collectstatic --no-input
@@ -2,6 +2,7 @@
 
 // --- Configuration ---
 const API_BASE_URL = 'https://juma-afiya-system.onrender.com'; // Your Django backend URL
+const CLIENT_LIST_FIELDS = 'id,name'; // The client list only shows names; skip the rest (and the programs)
 
 // --- Utility Functions (Common) ---
 
@@ -78,8 +79,35 @@ function setButtonLoading(button, isLoading) {
 function showLoadingIndicator(element) { element?.classList.remove('hidden'); }
 function hideLoadingIndicator(element) { element?.classList.add('hidden'); }
 
+// --- Conditional GET cache (ETag / Last-Modified) ---
+// Remembers the validators and body of GET responses that carry them, sends the
+// validators back on the next GET of the same URL and reuses the body on 304.
+const validatorCache = new Map();
+
+function conditionalHeaders(url, method) {
+    const cached = method === 'GET' ? validatorCache.get(url) : null;
+    if (!cached) { return {}; }
+    const headers = {};
+    if (cached.etag) { headers['If-None-Match'] = cached.etag; }
+    if (cached.lastModified) { headers['If-Modified-Since'] = cached.lastModified; }
+    return headers;
+}
+
+function rememberValidators(url, method, response, data) {
+    if (method !== 'GET') {
+        validatorCache.delete(url); // A write to this URL invalidates what we hold for it
+        return;
+    }
+    const etag = response.headers.get('ETag');
+    const lastModified = response.headers.get('Last-Modified');
+    if (etag || lastModified) {
+        validatorCache.set(url, { etag, lastModified, data });
+    }
+}
+
 // --- API Call Function (Common) ---
 async function apiRequest(url, options = {}) {
+    const method = (options.method || 'GET').toUpperCase();
     const csrfToken = getCookie('csrftoken'); // Get token
     // --- Add this console log ---
     console.log(`apiRequest to ${url}: Using CSRF Token: ${csrfToken}`); // <-- This is the added line
@@ -89,6 +117,7 @@ async function apiRequest(url, options = {}) {
         'Content-Type': 'application/json',
         'Accept': 'application/json',
         'X-CSRFToken': csrfToken, // Use the fetched token
+        ...conditionalHeaders(url, method),
         ...options.headers,
     };
     try {
@@ -99,10 +128,16 @@ async function apiRequest(url, options = {}) {
         });
 
         // Handle No Content response
-        if (response.status === 204) { return null; }
+        if (response.status === 204) { validatorCache.delete(url); return null; }
+
+        // Not Modified: the copy we sent validators for is still current
+        if (response.status === 304 && validatorCache.has(url)) {
+            return validatorCache.get(url).data;
+        }
 
         // Try to parse JSON, default to null if body is empty or not JSON
         const data = await response.json().catch(() => null);
+        if (response.ok) { rememberValidators(url, method, response, data); }
 
         if (!response.ok) {
             let errorMessage = `HTTP error! Status: ${response.status}`;
@@ -196,6 +231,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const searchStatus = document.getElementById('search-status');
     const clearSearchBtn = document.getElementById('clear-search-btn');
     const searchSubmitBtn = document.getElementById('search-submit-btn');
+    const clientSuggestionsEl = document.getElementById('client-suggestions');
     // Clients - Register
     const registerClientForm = document.getElementById('register-client-form');
     const clientNameInputModal = document.getElementById('client-name-modal');
@@ -432,55 +468,104 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Client Functions (Index Page) ---
-    async function fetchClients(url = `${API_BASE_URL}/afiya/clients/`) {
+    // Client list/search responses are cursor-paginated: { next, previous, results }.
+    // We render the first page and follow `next` as the user scrolls (infinite scroll).
+    let nextClientsUrl = null;
+    let clientsPageLoading = false;
+    const clientListSentinel = document.createElement('li');
+    clientListSentinel.className = 'list-group-item text-center text-muted small';
+    clientListSentinel.textContent = 'Loading more clients...';
+    clientListSentinel.style.cursor = 'pointer';
+    clientListSentinel.addEventListener('click', () => fetchNextClientsPage()); // Fallback without IntersectionObserver
+    const clientListObserver = ('IntersectionObserver' in window)
+        ? new IntersectionObserver((entries) => {
+              if (entries.some(entry => entry.isIntersecting)) { fetchNextClientsPage(); }
+          })
+        : null;
+
+    function renderClientItem(client) {
+        const listItem = document.createElement('li');
+        listItem.className = 'list-group-item list-group-item-action d-flex justify-content-between align-items-center';
+        listItem.dataset.clientId = client.id;
+
+        const nameSpan = document.createElement('span');
+        nameSpan.textContent = client.name;
+        nameSpan.style.cursor = 'pointer';
+        // Add click listener to the name to show details
+        nameSpan.addEventListener('click', () => showClientDetail(client.id));
+        listItem.appendChild(nameSpan);
+
+        // Button group for actions
+        const buttonGroup = document.createElement('div');
+        buttonGroup.className = 'd-flex gap-1'; // Use gap for spacing
+
+        // View Button
+        const viewButton = document.createElement('button');
+        viewButton.className = 'btn btn-sm btn-outline-primary';
+        viewButton.innerHTML = '<i class="bi bi-eye"></i>';
+        viewButton.title = 'View Client Profile';
+        viewButton.onclick = (e) => { e.stopPropagation(); showClientDetail(client.id); }; // Prevent li click, show detail
+        buttonGroup.appendChild(viewButton);
+
+        // Edit Button
+        const editButton = document.createElement('button');
+        editButton.className = 'btn btn-sm btn-outline-warning';
+        editButton.innerHTML = '<i class="bi bi-pencil-square"></i>';
+        editButton.title = 'Edit Client';
+        editButton.onclick = (e) => { e.stopPropagation(); openEditClientModal(client.id); }; // Prevent li click, open edit modal
+        buttonGroup.appendChild(editButton);
+
+        listItem.appendChild(buttonGroup);
+        return listItem;
+    }
+
+    function appendClientsPage(page) {
+        // Accept both paginated ({results}) and plain array responses
+        const clients = Array.isArray(page) ? page : (page?.results || []);
+        clientListObserver?.unobserve(clientListSentinel);
+        clientListSentinel.remove();
+
+        clients.forEach(client => clientListEl.appendChild(renderClientItem(client)));
+
+        nextClientsUrl = Array.isArray(page) ? null : (page?.next || null);
+        if (nextClientsUrl) {
+            // Watch the sentinel so the next page loads when it scrolls into view
+            clientListEl.appendChild(clientListSentinel);
+            clientListObserver?.observe(clientListSentinel);
+        }
+        return clients.length;
+    }
+
+    async function fetchNextClientsPage() {
+        if (!nextClientsUrl || clientsPageLoading) return;
+        clientsPageLoading = true;
+        try {
+            const page = await apiRequest(nextClientsUrl);
+            appendClientsPage(page);
+        } catch (error) {
+            // Error handling (like redirect) is likely done in apiRequest
+            nextClientsUrl = null;
+            clientListSentinel.textContent = 'Error loading more clients.';
+        } finally {
+            clientsPageLoading = false;
+        }
+    }
+
+    async function fetchClients(url = `${API_BASE_URL}/afiya/clients/?fields=${CLIENT_LIST_FIELDS}`) {
         if (!clientListEl || !clientLoadingIndicator) return; // Only run on index page
 
         showLoadingIndicator(clientLoadingIndicator);
         clientListEl.innerHTML = '';
+        nextClientsUrl = null;
+        clientListSentinel.textContent = 'Loading more clients...';
         hideClientDetail(); // Hide detail view when refreshing list
 
         try {
-            const clients = await apiRequest(url);
+            const page = await apiRequest(url);
             hideLoadingIndicator(clientLoadingIndicator);
 
-            if (!clients || clients.length === 0) {
+            if (appendClientsPage(page) === 0) {
                 clientListEl.innerHTML = '<li class="list-group-item text-muted">No clients found.</li>';
-            } else {
-                clients.forEach(client => {
-                    const listItem = document.createElement('li');
-                    listItem.className = 'list-group-item list-group-item-action d-flex justify-content-between align-items-center';
-                    listItem.dataset.clientId = client.id;
-
-                    const nameSpan = document.createElement('span');
-                    nameSpan.textContent = client.name;
-                    nameSpan.style.cursor = 'pointer';
-                    // Add click listener to the name to show details
-                    nameSpan.addEventListener('click', () => showClientDetail(client.id));
-                    listItem.appendChild(nameSpan);
-
-                    // Button group for actions
-                    const buttonGroup = document.createElement('div');
-                    buttonGroup.className = 'd-flex gap-1'; // Use gap for spacing
-
-                    // View Button
-                    const viewButton = document.createElement('button');
-                    viewButton.className = 'btn btn-sm btn-outline-primary';
-                    viewButton.innerHTML = '<i class="bi bi-eye"></i>';
-                    viewButton.title = 'View Client Profile';
-                    viewButton.onclick = (e) => { e.stopPropagation(); showClientDetail(client.id); }; // Prevent li click, show detail
-                    buttonGroup.appendChild(viewButton);
-
-                    // Edit Button
-                    const editButton = document.createElement('button');
-                    editButton.className = 'btn btn-sm btn-outline-warning';
-                    editButton.innerHTML = '<i class="bi bi-pencil-square"></i>';
-                    editButton.title = 'Edit Client';
-                    editButton.onclick = (e) => { e.stopPropagation(); openEditClientModal(client.id); }; // Prevent li click, open edit modal
-                    buttonGroup.appendChild(editButton);
-
-                    listItem.appendChild(buttonGroup);
-                    clientListEl.appendChild(listItem);
-                });
             }
         } catch (error) {
             // Error handling (like redirect) is likely done in apiRequest
@@ -489,6 +574,78 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // --- Live Client List Updates ---
+    // Writes (ours and other dashboards') arrive as server-sent events from /afiya/events/
+    // and are patched into the loaded list instead of re-fetching it.
+    let changeEvents = null;
+
+    function clientItem(clientId) {
+        return clientListEl?.querySelector(`li[data-client-id="${clientId}"]`) || null;
+    }
+
+    function sortsBefore(a, b) {
+        // The list is ordered by (name, id), like the server's cursor pagination
+        return a.name < b.name || (a.name === b.name && Number(a.id) < Number(b.id));
+    }
+
+    function placeClientItem(client) {
+        if (!clientListEl) return;
+        const existing = clientItem(client.id);
+        if (searchQueryInput?.value.trim()) {
+            // Search results are ranked, not sorted: rename in place, and leave new clients to the next search
+            if (existing) existing.replaceWith(renderClientItem(client));
+            return;
+        }
+        existing?.remove();
+        const following = [...clientListEl.querySelectorAll('li[data-client-id]')].find(item =>
+            sortsBefore(client, { id: item.dataset.clientId, name: item.firstChild.textContent }));
+        if (following) {
+            clientListEl.insertBefore(renderClientItem(client), following);
+        } else if (!nextClientsUrl) {
+            clientListEl.appendChild(renderClientItem(client));
+        } // Otherwise it sorts after the loaded pages and arrives with a later one
+        // Drop the "No clients found." placeholder
+        clientListEl.querySelectorAll('li:not([data-client-id])').forEach(item => {
+            if (item !== clientListSentinel) item.remove();
+        });
+    }
+
+    function removeClientItem(clientId) {
+        clientItem(clientId)?.remove();
+        if (currentClientId == clientId) hideClientDetail();
+    }
+
+    async function refreshEnrolledPrograms(clientId) {
+        try {
+            const client = await apiRequest(`${API_BASE_URL}/afiya/clients/${clientId}/`);
+            if (currentClientId == clientId) updateEnrolledProgramsDisplay(client.enrolled_programs);
+        } catch (error) {
+            // apiRequest has already reported it
+        }
+    }
+
+    function subscribeToChanges() {
+        if (!('EventSource' in window) || !clientListEl || changeEvents) return;
+        // Authenticated by the session cookie; reconnects (resuming after the last event) on its own
+        changeEvents = new EventSource(`${API_BASE_URL}/afiya/events/`, { withCredentials: true });
+        const on = (kind, handler) => changeEvents.addEventListener(kind, message => handler(JSON.parse(message.data)));
+        on('client.created', placeClientItem);
+        on('client.updated', client => {
+            placeClientItem(client);
+            if (currentClientId == client.id && detailClientName) detailClientName.textContent = client.name;
+        });
+        on('client.deleted', ({ id }) => removeClientItem(id));
+        on('enrollment.added', ({ client_ids }) => {
+            if (currentClientId && client_ids.includes(Number(currentClientId))) refreshEnrolledPrograms(currentClientId);
+        });
+        // The server could not replay what we missed (restart, or we fell behind): reload the list once
+        on('reset', () => fetchClients());
+        // A non-200 answer (e.g. 204 when streaming is off) closes the source for good
+        changeEvents.addEventListener('error', () => {
+            if (changeEvents?.readyState === EventSource.CLOSED) changeEvents = null;
+        });
+    }
+
     async function openEditClientModal(clientId) {
         if (!editClientForm || !editClientStatus || !editClientIdInput || !editClientNameInputModal || !editClientDobInputModal || !editClientContactInputModal || !editClientModal) return;
 
@@ -544,7 +701,7 @@ document.addEventListener('DOMContentLoaded', () => {
             });
             showAlert(`Client "${result.name}" updated successfully!`, 'success', globalAlertArea);
             editClientModal.hide();
-            fetchClients(); // Refresh the client list
+            placeClientItem(result); // Patch the list in place (the change event does the same for other dashboards)
             // If the edited client was the one being viewed, refresh the detail view
             if (currentClientId == clientId) {
                 showClientDetail(clientId);
@@ -575,12 +732,38 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         // Construct the search URL
-        const searchUrl = `${API_BASE_URL}/afiya/clients/search/?q=${encodeURIComponent(query)}`;
+        const searchUrl = `${API_BASE_URL}/afiya/clients/search/?q=${encodeURIComponent(query)}&fields=${CLIENT_LIST_FIELDS}`;
         await fetchClients(searchUrl); // Fetch clients using the search URL
         searchStatus.textContent = `Showing results for "${query}"`;
         setButtonLoading(searchSubmitBtn, false);
     }
 
+    // Suggest client names while typing, from the lightweight autocomplete endpoint
+    let suggestTimeoutId = null;
+    function suggestClients() {
+        if (!searchQueryInput || !clientSuggestionsEl) return;
+        clearTimeout(suggestTimeoutId);
+        const prefix = searchQueryInput.value.trim();
+        if (!prefix) {
+            clientSuggestionsEl.innerHTML = '';
+            return;
+        }
+        // Debounce so fast typing sends one request per pause, not per keystroke
+        suggestTimeoutId = setTimeout(async () => {
+            try {
+                const suggestions = await apiRequest(`${API_BASE_URL}/afiya/clients/autocomplete/?prefix=${encodeURIComponent(prefix)}`);
+                clientSuggestionsEl.innerHTML = '';
+                (suggestions || []).forEach(suggestion => {
+                    const option = document.createElement('option');
+                    option.value = suggestion.name;
+                    clientSuggestionsEl.appendChild(option);
+                });
+            } catch (error) {
+                clientSuggestionsEl.innerHTML = ''; // Suggestions are best-effort
+            }
+        }, 150);
+    }
+
     function clearSearch() {
         if (!searchQueryInput || !searchStatus) return;
         searchQueryInput.value = '';
@@ -617,7 +800,7 @@ document.addEventListener('DOMContentLoaded', () => {
             showAlert(`Client "${result.name}" registered successfully!`, 'success', globalAlertArea);
             registerClientForm.reset();
             registerClientModal.hide();
-            fetchClients(); // Refresh the client list
+            placeClientItem(result); // Insert into the list in place (the change event does the same for other dashboards)
         } catch (error) {
              // Show error within the modal
              showFormStatus(registerClientStatus, `Error: ${error.message}`, false);
@@ -737,6 +920,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Provide visual feedback during logout
         logoutBtn.disabled = true;
+        changeEvents?.close();
         logoutBtn.innerHTML = '<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> Logging out...';
 
         try {
@@ -806,6 +990,8 @@ document.addEventListener('DOMContentLoaded', () => {
             // Load initial data
             fetchPrograms(true);
             fetchClients();
+            // Only ASGI deployments stream events; elsewhere /afiya/events/ answers 204
+            if (userData.live_updates) subscribeToChanges();
     
         } catch (error) {
             console.error("Authentication check failed:", error.message);
@@ -837,6 +1023,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (createProgramForm) createProgramForm.addEventListener('submit', createProgram);
         if (searchClientForm) searchClientForm.addEventListener('submit', searchClients);
         if (clearSearchBtn) clearSearchBtn.addEventListener('click', clearSearch);
+        if (searchQueryInput) searchQueryInput.addEventListener('input', suggestClients);
         if (registerClientForm) registerClientForm.addEventListener('submit', registerClient);
         if (closeDetailBtn) closeDetailBtn.addEventListener('click', hideClientDetail);
         if (enrollClientForm) enrollClientForm.addEventListener('submit', enrollClient);